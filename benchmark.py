@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+benchmark.py
+
+Time the FakeBank pipeline at several scale factors of the N_* row counts and
+compare the numbers with a stored baseline.
+
+Stages, each run in a fresh process so its peak RSS is its own:
+  generate:<table>   the table's generator and Parquet output (upstream tables already built)
+  write:<table>      rewriting the generated table with the Parquet writer alone
+  arrow              uncompressed Arrow IPC copies of every table (generate_fakebank_data.refresh_arrow_cache)
+  load:<source>:<n>  n reader processes loading LOAD_TABLE at the same moment, from Parquet (read_table)
+                     or memory-mapped from its Arrow copy (load_table), and summing its numeric columns;
+                     records the mean load latency, each reader's RSS and the readers' private memory in total
+  charts             profiling cube plus every summary chart
+  var:<scenarios>    historical-simulation VaR/ES of the last month's market_positions over that
+                     many scenarios (historical return vectors resampled with replacement);
+                     its rows are position x scenario P&L values
+  upload_dry_run     walking data/ for upload.py (no network)
+
+Usage examples:
+  python benchmark.py
+  python benchmark.py --scales 0.01 0.1 --save-baseline
+  python benchmark.py --scales 0.1 --baseline benchmark_baseline.json --max-slowdown 0.5
+  python benchmark.py --scales 1 --var-scenarios 250 1000 10000 100000
+  python benchmark.py --scales 0.1 --readers 1 4 16
+
+Each stage records wall time, rows/s, peak RSS and output bytes in the results
+file. A stage regresses when it is more than --max-slowdown slower (ignoring
+stages under --min-seconds) or uses more than --max-memory-growth more memory
+than in the baseline; regressions make the exit status 1.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import importlib.util
+import platform
+import argparse
+import tempfile
+from datetime import datetime
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import generate_fakebank_data as fb
+
+SCALES = (0.01, 0.1, 1.0)
+RESULTS = 'benchmark_results.json'
+BASELINE = 'benchmark_baseline.json'
+MAX_SLOWDOWN = 0.25
+MAX_MEMORY_GROWTH = 0.25
+MIN_SECONDS = 0.5
+VAR_SCENARIOS = (250, 1000, 10000)
+LOAD_TABLE = 'loans'
+LOAD_SOURCES = ('parquet', 'arrow')
+READERS = (1, 16)
+
+
+def scaled_config(scale, data_dir, months):
+    rows = {name: max(1, round(count * scale)) for name, count in fb.DEFAULT_ROWS.items()}
+    return fb.GenerationConfig(rows=rows, data_dir=data_dir, months=months, cache_dir=None)
+
+
+def enter_run_dir(run_dir):
+    """Work in a scale's run folder, so the generator's sample/, summary/ and other folders
+    relative to the working directory land there, next to its data/; returns the data folder."""
+    os.chdir(run_dir)
+    return os.path.join(run_dir, 'data')
+
+def load_reader(barrier, results, source, scale, run_dir, months):
+    """One reader process of a load stage: loads LOAD_TABLE once every reader is ready and sums its numeric columns.
+
+    Puts (load seconds, load and sum seconds, RSS MB, private RSS MB) on results.
+    """
+    config = scaled_config(scale, enter_run_dir(run_dir), months)
+    barrier.wait()
+    start = time.perf_counter()
+    table = fb.load_table(config, LOAD_TABLE) if source == 'arrow' else fb.read_table(config, LOAD_TABLE)
+    loaded = time.perf_counter() - start
+    for column in table.itercolumns():
+        if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+            pc.sum(column)
+    results.put((loaded, time.perf_counter() - start, fb.rss_mb(), fb.private_rss_mb()))
+
+def run_stage(stage, scale, run_dir, months):
+    """Run one stage (in a fresh worker process, in the scale's run folder);
+    returns (seconds, rows, bytes, peak RSS MB, extra result fields)."""
+    data_dir = enter_run_dir(run_dir)
+    config = scaled_config(scale, data_dir, months)
+    kind, _, name = stage.partition(':')
+    extra = {}
+    start = time.perf_counter()
+    if kind == 'generate':
+        fb.build([name], config, samples=False, upstream=False)
+        seconds = time.perf_counter() - start
+        rows, size = fb.table_rows(config, name), fb.path_bytes(config.path(name))
+    elif kind == 'write':
+        table = fb.read_table(config, name)
+        path = os.path.join(data_dir, '_rewrite.parquet')
+        start = time.perf_counter()
+        with fb.ParquetTableWriter(path, **config.writer_options(name)) as writer:
+            for offset in range(0, max(table.num_rows, 1), fb.CHUNK_ROWS):
+                writer.write(table.slice(offset, fb.CHUNK_ROWS))
+        seconds = time.perf_counter() - start
+        rows, size = table.num_rows, fb.path_bytes(path)
+        os.remove(path)
+    elif kind == 'arrow':
+        fb.refresh_arrow_cache(config)
+        seconds = time.perf_counter() - start
+        rows, size = sum(fb.table_rows(config, name) for name in fb.TABLES), fb.path_bytes(os.path.join(data_dir, fb.ARROW_DIR))
+    elif kind == 'load':
+        source, _, readers = name.partition(':')
+        if source == 'arrow' and fb.open_arrow_table(config, LOAD_TABLE) is None:
+            raise RuntimeError(f'No current Arrow copy of {LOAD_TABLE}; the arrow stage must run first')
+        context = get_context('spawn')
+        barrier, queue = context.Barrier(int(readers)), context.Queue()
+        processes = [context.Process(target=load_reader, args=(barrier, queue, source, scale, run_dir, months))
+                     for _ in range(int(readers))]
+        for process in processes:
+            process.start()
+        loads = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        seconds = max(total for _, total, _, _ in loads)  # until the slowest reader is done
+        rows = len(loads) * fb.table_rows(config, LOAD_TABLE)
+        size = fb.path_bytes(fb.arrow_path(config, LOAD_TABLE) if source == 'arrow' else config.path(LOAD_TABLE))
+        extra = {'load_ms': round(float(np.mean([loaded for loaded, _, _, _ in loads])) * 1e3, 2),
+                 'reader_rss_mb': round(max(rss or 0 for _, _, rss, _ in loads), 1),
+                 'private_mb': round(sum(private or 0 for _, _, _, private in loads), 1)}
+        return seconds, rows, size, extra['reader_rss_mb'], extra
+    elif kind == 'charts':
+        shutil.rmtree(fb.SUMMARY_DIR, ignore_errors=True)
+        fb.render_charts(list(fb.TABLES), config)
+        seconds = time.perf_counter() - start
+        rows, size = sum(fb.table_rows(config, name) for name in fb.PROFILES), fb.path_bytes(fb.SUMMARY_DIR)
+    elif kind == 'var':
+        dates, returns = fb.instrument_returns(config)
+        scenarios = returns[:, np.random.default_rng(fb.SEED).integers(0, returns.shape[1], int(name))]
+        positions = fb.read_month(config, 'market_positions', dates[-1], ['instrument', 'market_value'])
+        market_value = positions['market_value'].to_numpy(dtype=float)
+        start = time.perf_counter()
+        fb.position_var(market_value, fb.label_codes(positions['instrument'], fb.INSTRUMENTS), scenarios)
+        seconds = time.perf_counter() - start
+        rows, size = len(positions) * scenarios.shape[1], 0  # position x scenario P&L values
+    else:
+        logging.disable(logging.INFO)
+        import upload
+        results = upload.upload_tree(None, data_dir, 'benchmark', 'data', dry_run=True)
+        seconds = time.perf_counter() - start
+        rows, size = len(results), sum(result[3] for result in results)
+    return seconds, rows, size, fb.peak_rss_mb(), extra
+
+
+def run_benchmark(scales, months, work_dir, var_scenarios=VAR_SCENARIOS, readers=READERS):
+    results = []
+    stages = ([f'generate:{name}' for name in fb.resolve_tables(list(fb.TABLES))] +
+              [f'write:{name}' for name in fb.resolve_tables(list(fb.TABLES))] + ['arrow'] +
+              [f'load:{source}:{n}' for n in readers for source in LOAD_SOURCES] + ['charts'] +
+              [f'var:{scenarios}' for scenarios in var_scenarios])
+    if importlib.util.find_spec('boto3') is not None:  # upload.py exits without it
+        stages.append('upload_dry_run')
+    for scale in scales:
+        run_dir = os.path.abspath(os.path.join(work_dir, f'scale-{scale:g}'))
+        shutil.rmtree(run_dir, ignore_errors=True)
+        os.makedirs(os.path.join(run_dir, 'data'))
+        print(f'Scale {scale:g}:')
+        for stage in stages:
+            # A fresh process per stage keeps each peak RSS separate
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                seconds, rows, size, rss, extra = pool.submit(run_stage, stage, scale, run_dir, months).result()
+            results.append({'scale': scale, 'stage': stage, 'seconds': round(seconds, 3), 'rows': rows,
+                            'rows_per_s': round(rows / seconds) if seconds else None,
+                            'peak_rss_mb': None if rss is None else round(rss, 1), 'bytes': size, **extra})
+            print(f'  {stage:<32} {seconds:8.2f}s {rows:>12,} rows {results[-1]["rows_per_s"] or 0:>12,} rows/s '
+                  f'{rss or 0:8.0f} MB {size / 1e6:10.1f} MB out' +
+                  (f'  load {extra["load_ms"]:.1f} ms, {extra["private_mb"]:.0f} MB private in all readers' if extra else ''))
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, max_slowdown=MAX_SLOWDOWN, max_memory_growth=MAX_MEMORY_GROWTH, min_seconds=MIN_SECONDS):
+    """Regressions of results against baseline results, as printable strings."""
+    previous = {(r['scale'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        base = previous.get((result['scale'], result['stage']))
+        if base is None:
+            continue
+        if max(base['seconds'], result['seconds']) >= min_seconds and result['seconds'] > base['seconds'] * (1 + max_slowdown):
+            regressions.append(f'{result["stage"]} @ {result["scale"]:g}x: {base["seconds"]:.2f}s -> {result["seconds"]:.2f}s '
+                               f'({result["seconds"] / base["seconds"] - 1:+.0%})')
+        if base['peak_rss_mb'] and result['peak_rss_mb'] and result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + max_memory_growth):
+            regressions.append(f'{result["stage"]} @ {result["scale"]:g}x: peak RSS {base["peak_rss_mb"]:.0f} MB -> '
+                               f'{result["peak_rss_mb"]:.0f} MB ({result["peak_rss_mb"] / base["peak_rss_mb"] - 1:+.0%})')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark FakeBank generation, profiling and upload at several scale factors')
+    parser.add_argument('--scales', type=float, nargs='+', default=list(SCALES), help=f'Scale factors of the N_* row counts (default: {" ".join(map(str, SCALES))})')
+    parser.add_argument('--months', type=int, default=fb.MONTHS, help=f'Number of month-end snapshots (default: {fb.MONTHS})')
+    parser.add_argument('--var-scenarios', type=int, nargs='*', default=list(VAR_SCENARIOS), help=f'Scenario counts of the VaR stages (default: {" ".join(map(str, VAR_SCENARIOS))})')
+    parser.add_argument('--readers', type=int, nargs='*', default=list(READERS), help=f'Reader process counts of the load stages (default: {" ".join(map(str, READERS))})')
+    parser.add_argument('--work-dir', help='Folder for the generated data (default: a temporary folder)')
+    parser.add_argument('--output', default=RESULTS, help=f'Results file (default: {RESULTS})')
+    parser.add_argument('--baseline', default=BASELINE, help=f'Baseline results to compare with, if it exists (default: {BASELINE})')
+    parser.add_argument('--save-baseline', action='store_true', help='Also write the results as the new baseline')
+    parser.add_argument('--max-slowdown', type=float, default=MAX_SLOWDOWN, help=f'Allowed wall-time increase per stage (default: {MAX_SLOWDOWN})')
+    parser.add_argument('--max-memory-growth', type=float, default=MAX_MEMORY_GROWTH, help=f'Allowed peak RSS increase per stage (default: {MAX_MEMORY_GROWTH})')
+    parser.add_argument('--min-seconds', type=float, default=MIN_SECONDS, help=f'Stages faster than this are not checked for slowdowns (default: {MIN_SECONDS})')
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='fakebank-benchmark-')
+    try:
+        results = run_benchmark(args.scales, args.months, work_dir, args.var_scenarios, args.readers)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'created': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+              'platform': platform.platform(), 'cpus': os.cpu_count(), 'months': args.months, 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'Results written to {args.output}')
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_slowdown, args.max_memory_growth, args.min_seconds)
+        print(f'Compared with {args.baseline}: {len(regressions)} regression(s)')
+        for regression in regressions:
+            print(f'  REGRESSION {regression}')
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f'Baseline saved to {args.baseline}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,76 @@
+"""
+generate_fakebank_data.py
+
+Generate the synthetic FakeBank tables into `data/` (Parquet), with head(15)
+samples in `sample/` and profiling charts in `summary/`.
+
+Each table has a generator function registered in TABLES together with the
+tables it depends on; asking for a table builds it and its upstream tables
+only, in dependency order. Importing this module does no work.
+
+Usage examples:
+  python generate_fakebank_data.py
+  python generate_fakebank_data.py --tables market_positions --no-charts
+  python generate_fakebank_data.py --months 12 --end-date 2025-06-30 --rows loans=1000000
+  python generate_fakebank_data.py --sampling exact
+  python generate_fakebank_data.py --validate --workers 4
+"""
 import os
+import re
+import sys
+import copy
+import json
+import time
+import glob
+import zlib
+import types
+import shutil
+import hashlib
+import inspect
+import logging
+import cProfile
+import argparse
+import itertools
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from faker import Faker
 from datetime import datetime, timedelta
 import random
 from calendar import monthrange
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not recorded
+    resource = None
 
-# Set random seed for reproducibility
+# Default random seed for reproducibility
 SEED = 42
-random.seed(SEED)
-np.random.seed(SEED)
 fake = Faker('en_AU')
-fake.seed_instance(SEED)
 
-# Output folder
+# Output folders
 DATA_DIR = 'data'
-os.makedirs(DATA_DIR, exist_ok=True)
-# Purge old .png, .parquet, and .csv files in output folders BEFORE generating new ones
-import glob
-for folder in [DATA_DIR, 'sample', 'summary']:
-    for ext in ('*.png', '*.parquet', '*.csv'):
-        for f in glob.glob(os.path.join(folder, ext)):
-            try:
-                os.remove(f)
-            except Exception as e:
-                print(f'Could not remove {f}: {e}')
+SAMPLE_DIR = 'sample'
+SUMMARY_DIR = 'summary'
+MART_DIR = '_mart'  # in the data folder, `_`-prefixed like _parts/ and _profiles/ so upload.py leaves it out
 
-# Date range
+# Default date range
 END_DATE = datetime(2025, 9, 30)
 MONTHS = 24
-DATES = []
-for i in reversed(range(MONTHS)):
-    d = END_DATE - timedelta(days=30*i)
-    last_day = monthrange(d.year, d.month)[1]
-    DATES.append(d.replace(day=last_day))
-
-# Print DATES and check for duplicates
-print('DATES:', [d.strftime('%Y-%m-%d') for d in DATES])
-if len(DATES) != len(set([d.strftime('%Y-%m-%d') for d in DATES])):
-    print('Warning: Duplicate dates found in DATES! Removing duplicates.')
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_dates = []
-    for d in DATES:
-        ds = d.strftime('%Y-%m-%d')
-        if ds not in seen:
-            seen.add(ds)
-            unique_dates.append(d)
-    DATES = unique_dates
-print('Final DATES:', [d.strftime('%Y-%m-%d') for d in DATES])
 
+def month_end_dates(end_date=END_DATE, months=MONTHS):
+    """The last day of each of the `months` calendar months up to end_date, oldest first."""
+    dates = []
+    for i in reversed(range(months)):
+        year, month = divmod(end_date.year * 12 + end_date.month - 1 - i, 12)
+        dates.append(datetime(year, month + 1, monthrange(year, month + 1)[1]))
+    return dates
 
 # Allowed values (from specs)
 CREDIT_RATINGS = ['A', 'B', 'C', 'D', 'E']
@@ -64,6 +85,9 @@ COLLATERAL_TYPES = ['Property', 'Vehicle', 'Deposit', 'Unsecured', 'Equipment']
 LIEN_TYPES = ['First Lien', 'Second Lien', 'Third Lien']
 SEGMENTS = ['Retail', 'Corporate', 'SME']
 APPLICATION_STATUS = ['Approved', 'Rejected', 'Pending']
+WRITE_OFF_REASONS = ['Default', 'Fraud', 'Bankruptcy', 'Settlement']
+INTERACTION_TYPES = ['Phone Call', 'Email', 'Branch Visit', 'Chat', 'Mobile App']
+N_AGENTS = 100  # agent ids run AGT001-AGT100
 
 # Liquidity Risk allowed values
 ASSET_TYPES = ['Cash', 'Deposit', 'Security', 'Government Bond', 'Corporate Bond']
@@ -89,6 +113,62 @@ N_LIQUIDITY_EVENTS = 500
 N_MARKET_POSITIONS = 30000
 N_MARKET_EVENTS = 500
 
+# Default row counts by table (per as_of_date for panel tables), overridable with --rows
+DEFAULT_ROWS = {
+    'customers': N_CUSTOMERS,
+    'loans': N_LOANS,
+    'loan_applications': N_APPLICATIONS,
+    'write_offs': N_WRITE_OFFS,
+    'customer_interactions': N_INTERACTIONS,
+    'loan_securities': N_SECURITIES,
+    'liquidity_positions': N_LIQUIDITY_POSITIONS,
+    'funding_sources': N_FUNDING_SOURCES,
+    'liquidity_events': N_LIQUIDITY_EVENTS,
+    'market_positions': N_MARKET_POSITIONS,
+    'market_events': N_MARKET_EVENTS,
+}
+
+# Rows per Parquet row group for tables that are not written one as_of_date at a time
+CHUNK_ROWS = 100_000
+
+# Rows per generation partition. Each partition has its own random stream derived
+# from the seed, so changing this changes the output (the worker count does not).
+PARTITION_ROWS = 10_000
+
+# Text/date sampling: 'pooled' draws names, addresses and sentences from pools of
+# POOL_SIZE Faker values and dates from integer day offsets; 'exact' calls Faker per row.
+SAMPLING_MODES = ('pooled', 'exact')
+POOL_SIZE = 5_000
+
+# Output layouts: 'flat' writes data/<table>.parquet; 'hive' writes tables registered
+# with partition_by as data/<table>/as_of_date=YYYY-MM-DD/part-00000.parquet
+LAYOUTS = ('flat', 'hive')
+COMPRESSION_CODECS = ('snappy', 'zstd', 'gzip', 'brotli', 'lz4', 'none')
+
+# Stored schemas: 'text' keeps ids and as_of_date as strings; 'compact' stores ids as
+# int32 surrogate keys, as_of_date as date32 and enumerated columns dictionary-encoded
+SCHEMAS = ('text', 'compact')
+
+# market_risk_metrics VaR/SVaR/ES: 'fraction' draws them as random fractions of market_value,
+# 'historical' computes them by historical simulation over instrument_prices (see historical_var)
+VAR_MODELS = ('fraction', 'historical')
+VAR_LEVELS = (0.95, 0.99)  # confidence levels of historical_var()
+MRM_VAR_LEVEL = 0.99  # confidence level of the historical market_risk_metrics
+VAR_WINDOW = 12  # months of instrument returns per scenario set, and length of the stressed window
+VAR_CELLS = 4_000_000  # position x scenario P&L values held in memory at once
+
+# Settings and random states used by append_month(), kept in the data folder
+CHECKPOINT_FILE = '_checkpoint.json'
+
+# Generated tables keyed by a hash of their code, settings and upstream tables (see cache_keys);
+# CACHE_ENTRIES versions are kept per table
+CACHE_DIR = 'cache'
+CACHE_ENTRIES = 3
+
+# Per-stage metrics of each run, saved next to the data (see RunReport)
+RUN_REPORT = 'run_report.json'
+logger = logging.getLogger('fakebank')
+
 # Helper functions
 
 def random_choice(seq):
@@ -150,550 +230,3031 @@ def random_financials():
         'net_profit_margin': round((net_profit / revenue) if revenue else 0, 2)
     }
 
-# Generate customers
-customers = []
-for i in range(N_CUSTOMERS):
-    customers.append({
-        'customer_id': f'CUST{i+1:05d}',
-        'name': fake.name(),
-        'date_of_birth': fake.date_of_birth(minimum_age=18, maximum_age=80),
-        'address': fake.address().replace('\n', ', '),
-        'customer_since': fake.date_between(start_date='-10y', end_date='today'),
-        'segment': random_segment(),
-        'state': random_state(),
-        'postcode': random_postcode(),
-        'industry': random_industry() if random_segment() != 'Retail' else ''
-    })
-customers_df = pd.DataFrame(customers)
-customers_df.to_parquet(os.path.join(DATA_DIR, 'customers.parquet'))
-
-# Generate loans (panel data)
-loans = []
-for as_of_idx, as_of_date in enumerate(DATES):
-    for i in range(N_LOANS):
-        cust = customers[i % N_CUSTOMERS]
-        financials = random_financials() if cust['segment'] != 'Retail' else {}
-        # Balance logic with upward trend and increased volatility
-        if as_of_idx == 0:
-            balance = random.randint(10_000, 1_000_000)
+def random_dates(rng, start, end, size):
+    """Draw `size` dates uniformly between start and end (inclusive) as a datetime64[D] array."""
+    start = np.datetime64(start, 'D')
+    end = np.datetime64(end, 'D')
+    span = (end - start).astype(np.int64) + 1
+    return start + (rng.random(size) * span).astype(np.int64)
+
+def random_labels(rng, values, size):
+    """Vectorised random_choice(): `size` uniform draws from values as an object array."""
+    return np.array(values, dtype=object)[rng.integers(0, len(values), size)]
+
+def label_codes(values, labels):
+    """Inverse of random_labels(): int8 positions of values (str or Categorical) in labels."""
+    return pd.Categorical(np.asarray(values, dtype=object), categories=labels).codes.astype(np.int8)
+
+def random_financials_block(rng, size):
+    """Vectorised random_financials(): one column array per financials field."""
+    assets = rng.integers(100_000, 10_000_001, size)
+    liabilities = rng.integers(50_000, assets + 1)
+    equity = assets - liabilities
+    revenue = rng.integers(50_000, 5_000_001, size)
+    interest_expense = rng.integers(1_000, 100_001, size)
+    net_profit = rng.integers(-100_000, revenue + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        debt_to_equity = np.where(equity != 0, liabilities / equity, 0)
+    return {
+        'total_assets': assets,
+        'total_liabilities': liabilities,
+        'annual_revenue': revenue,
+        'interest_coverage_ratio': np.round(revenue / interest_expense, 2),
+        'debt_to_equity_ratio': np.round(debt_to_equity, 2),
+        'current_ratio': np.round(rng.uniform(0.5, 3.0, size), 2),
+        'net_profit_margin': np.round(net_profit / revenue, 2)
+    }
+
+def format_ids(prefix, start, stop, width):
+    """Vectorised f'{prefix}{i:0{width}d}' for i in range(start + 1, stop + 1)."""
+    return format_id_values(prefix, np.arange(start + 1, stop + 1), width)
+
+def format_id_values(prefix, numbers, width):
+    """Vectorised f'{prefix}{n:0{width}d}' for each n in numbers."""
+    numbers = np.asarray(numbers)
+    if not numbers.size:
+        return np.array([], dtype=object)
+    return np.char.add(prefix, np.char.zfill(numbers.astype(str), width)).astype(object)
+
+# Faker value pools, built once per process and seed: (seed, kind) -> object array
+_FAKER_POOLS = {}
+
+def faker_pool(seed, kind):
+    """POOL_SIZE Faker values of one kind ('name', 'address' or 'sentence') for a seed.
+
+    Pools use their own Faker instance and seed, so they are the same in every
+    worker process and do not disturb the shared `fake` stream.
+    """
+    key = (seed, kind)
+    if key not in _FAKER_POOLS:
+        pool_fake = Faker('en_AU')
+        pool_fake.seed_instance(int(np.random.SeedSequence([seed, zlib.crc32(kind.encode())]).generate_state(1)[0]))
+        make = {
+            'name': pool_fake.name,
+            'address': lambda: pool_fake.address().replace('\n', ', '),
+            'sentence': lambda: pool_fake.sentence(nb_words=20),
+        }[kind]
+        _FAKER_POOLS[key] = np.array([make() for _ in range(POOL_SIZE)], dtype=object)
+    return _FAKER_POOLS[key]
+
+class ColumnSampler:
+    """Whole-column draws of Faker-style text and date values for one partition.
+
+    In 'pooled' mode text comes from faker_pool() by random index and dates
+    from vectorised day/second offsets; in 'exact' mode every value is a Faker
+    call. Both return object arrays of str, date or datetime values.
+    """
+
+    def __init__(self, config, rng):
+        self.seed = config.seed
+        self.exact = config.sampling == 'exact'
+        self.rng = rng
+
+    def _text(self, kind, make, size):
+        if self.exact:
+            return np.array([make() for _ in range(size)], dtype=object)
+        return faker_pool(self.seed, kind)[self.rng.integers(0, POOL_SIZE, size)]
+
+    def names(self, size):
+        return self._text('name', fake.name, size)
+
+    def addresses(self, size):
+        return self._text('address', lambda: fake.address().replace('\n', ', '), size)
+
+    def sentences(self, size):
+        return self._text('sentence', lambda: fake.sentence(nb_words=20), size)
+
+    def dates(self, start, end, size):
+        """Dates uniformly between start and end (date or datetime), inclusive."""
+        if self.exact:
+            return np.array([fake.date_between(start_date=start, end_date=end) for _ in range(size)], dtype=object)
+        return random_dates(self.rng, np.datetime64(start, 'D'), np.datetime64(end, 'D'), size).astype(object)
+
+    def datetimes(self, start, end, size):
+        """Datetimes uniformly between start and end, to the second."""
+        if self.exact:
+            return np.array([fake.date_time_between(start_date=start, end_date=end) for _ in range(size)], dtype=object)
+        start = np.datetime64(start, 's')
+        span = (np.datetime64(end, 's') - start).astype(np.int64) + 1
+        return (start + (self.rng.random(size) * span).astype(np.int64)).astype(object)
+
+    def dates_of_birth(self, today, size, minimum_age=18, maximum_age=80):
+        """Birth dates for ages minimum_age to maximum_age on `today` (config.now, not the wall clock, so reruns match)."""
+        today = np.datetime64(today, 'D')
+        first, last = today - int(365.25 * (maximum_age + 1)) + 1, today - int(365.25 * minimum_age)
+        return self.dates(first.astype(object), last.astype(object), size)
+
+def iter_loan_snapshots(customers_df, dates, rng, start, stop, chunk_rows=None, today=None, state=None):
+    """Yield (as_of_idx, DataFrame) chunks of the loans panel for loans start..stop-1, month by month.
+
+    Each month is built as whole arrays; only the previous month's balances and
+    rating codes are carried forward. Balances follow a lognormal walk with a
+    ~0.33% monthly mean increase (6% volatility, 35% for every 100th loan) and
+    credit/LGD ratings are redrawn for a 5% migration mask each month. Row
+    attributes are materialised chunk_rows loans at a time. To extend an
+    existing panel, pass the (balance, credit code, LGD code) arrays of the
+    month before dates[0] as `state`.
+    """
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    n_loans = stop - start
+    loan_idx = np.arange(start, stop)
+    customer_ids = customers_df['customer_id'].to_numpy(dtype=object)
+    industries = customers_df['industry'].to_numpy(dtype=object)
+    geographies = customers_df['state'].to_numpy(dtype=object)
+    is_business = customers_df['segment'].to_numpy(dtype=object) != 'Retail'
+    credit_labels = np.array(CREDIT_RATINGS, dtype=object)
+    lgd_labels = np.array(LGD_RATINGS, dtype=object)
+    credit_p = [0.2, 0.3, 0.3, 0.15, 0.05]
+    lgd_p = [0.7, 0.2, 0.1]
+    today = np.datetime64((today or datetime.today()).date(), 'D')
+
+    # Carried state: balances plus int8 rating codes (~10 bytes per loan)
+    balance, credit, lgd = state if state is not None else (None, None, None)
+    for as_of_idx, as_of_date in enumerate(dates):
+        if balance is None:
+            balance = rng.integers(10_000, 1_000_001, n_loans).astype(float)
+            credit = rng.choice(len(CREDIT_RATINGS), size=n_loans, p=credit_p).astype(np.int8)
+            lgd = rng.choice(len(LGD_RATINGS), size=n_loans, p=lgd_p).astype(np.int8)
         else:
-            prev = loans[-N_LOANS]
-            is_material = (i % 100 == 0)
-            # Monthly mean increase of ~0.33% (4% p.a.), std dev 6% for more volatility
-            change_pct = np.random.normal(loc=0.0033, scale=0.06) if not is_material else np.random.normal(loc=0.0033, scale=0.35)
-            balance = max(0, round(prev['loan_amount'] * (1 + change_pct), 2))
-        # PD/LGD migration
-        if as_of_idx == 0:
-            credit_rating = random_credit_rating()
-            lgd_rating = random_lgd_rating()
+            sigma = np.where(loan_idx % 100 == 0, 0.35, 0.06)
+            balance = np.round(balance * rng.lognormal(np.log1p(0.0033) - sigma ** 2 / 2, sigma), 2)
+            migrate = rng.random(n_loans) < 0.05
+            credit[migrate] = rng.choice(len(CREDIT_RATINGS), size=int(migrate.sum()), p=credit_p)
+            migrate = rng.random(n_loans) < 0.05
+            lgd[migrate] = rng.choice(len(LGD_RATINGS), size=int(migrate.sum()), p=lgd_p)
+
+        as_of_day = np.datetime64(as_of_date.date(), 'D')
+        for lo in range(0, n_loans, chunk_rows):
+            hi = min(lo + chunk_rows, n_loans)
+            size = hi - lo
+            cust_idx = loan_idx[lo:hi] % len(customers_df)
+            amount = balance[lo:hi]
+            chunk = pd.DataFrame({
+                'loan_id': format_ids('LOAN', start + lo, start + hi, 6),
+                'customer_id': customer_ids[cust_idx],
+                'as_of_date': as_of_date.strftime('%Y-%m-%d'),
+                'loan_amount': amount,
+                'credit_rating': credit_labels[credit[lo:hi]],
+                'lgd_rating': lgd_labels[lgd[lo:hi]],
+                'ead': np.round(amount * rng.uniform(0.8, 1.2, size), 2),
+                'rwa': np.round(amount * rng.uniform(0.5, 1.5, size), 2),
+                'capital': np.round(amount * rng.uniform(0.08, 0.12, size), 2),
+                'provisions': np.round(amount * rng.uniform(0.01, 0.05, size), 2),
+                'arrears': np.round(amount * rng.uniform(0, 0.1, size), 2),
+                'sales_channel': np.array(SALES_CHANNELS, dtype=object)[rng.integers(0, len(SALES_CHANNELS), size)],
+                'industry': industries[cust_idx],
+                'geography': geographies[cust_idx],
+                'product_type': np.array(PRODUCT_TYPES, dtype=object)[rng.integers(0, len(PRODUCT_TYPES), size)],
+                'purpose': np.array(PURPOSES, dtype=object)[rng.integers(0, len(PURPOSES), size)],
+                'currency': 'AUD',
+                'origination_date': random_dates(rng, today - 3652, as_of_day, size).astype(object),
+                'maturity_date': random_dates(rng, as_of_day, today + 3652, size).astype(object),
+                'interest_rate': np.round(rng.uniform(2.5, 7.5, size), 2),
+                'repayment_type': np.array(REPAYMENT_TYPES, dtype=object)[rng.integers(0, len(REPAYMENT_TYPES), size)],
+                'collateral_type': np.array(COLLATERAL_TYPES, dtype=object)[rng.integers(0, len(COLLATERAL_TYPES), size)],
+            })
+            # Financials only apply to non-retail customers; retail rows stay NaN
+            business = is_business[cust_idx]
+            for col, values in random_financials_block(rng, int(business.sum())).items():
+                column = np.full(size, np.nan)
+                column[business] = values
+                chunk[col] = column
+            yield as_of_idx, chunk
+
+# Streaming Parquet output
+class ParquetTableWriter:
+    """Write a table to one Parquet file incrementally, one row group per chunk.
+
+    DataFrames passed to write() become a row group each; rows passed to
+    append() are buffered and flushed every chunk_rows rows (or on flush()).
+    The schema is taken from the first chunk and only its first 15 rows are
+    kept in memory, for the sample/ export. Column statistics are always
+    written; only dictionary_columns (default: all) are dictionary-encoded.
+    `transform`, if given, maps each pyarrow Table chunk to its stored form.
+    `seconds` adds up the time spent encoding and writing row groups.
+    """
+
+    def __init__(self, path, chunk_rows=None, compression='snappy', dictionary_columns=None, transform=None):
+        self.path = path
+        self.chunk_rows = chunk_rows or CHUNK_ROWS
+        self.compression = compression
+        self.dictionary_columns = dictionary_columns
+        self.transform = transform
+        self.rows = 0
+        self.seconds = 0.0
+        self.sample = None
+        self._buffer = []
+        self._writer = None
+
+    def append(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.write(pd.DataFrame(self._buffer))
+            self._buffer = []
+
+    def write(self, df):
+        """Write a DataFrame or pyarrow Table as one row group."""
+        start = time.perf_counter()
+        schema = self._writer.schema if self._writer is not None else None
+        table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+        if self.transform is not None:
+            table = self.transform(table)
+        if schema is not None and not table.schema.equals(schema):
+            table = table.cast(schema)
+        if any(pa.types.is_dictionary(field.type) for field in table.schema):
+            # One dictionary per column chunk, or Parquet falls back to plain encoding
+            table = table.unify_dictionaries()
+        if self._writer is None:
+            use_dictionary = True
+            if self.dictionary_columns is not None:
+                use_dictionary = [c for c in self.dictionary_columns if c in table.column_names]
+            self._writer = pq.ParquetWriter(self.path, table.schema, compression=self.compression,
+                                            use_dictionary=use_dictionary, write_statistics=True)
+            self.sample = table.slice(0, 15).to_pandas()
+        self._writer.write_table(table)
+        self.rows += len(table)
+        self.seconds += time.perf_counter() - start
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            start = time.perf_counter()
+            self._writer.close()
+            self._writer = None
+            self.seconds += time.perf_counter() - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class PartitionedTableWriter:
+    """Write a table as a hive-partitioned folder: path/<column>=<value>/part-00000.parquet.
+
+    write() takes pyarrow Tables; rows are routed to one ParquetTableWriter per
+    partition value, in arrival order, and the partition column itself is not
+    stored in the files (readers recover it from the folder names).
+    """
+
+    def __init__(self, path, column, **options):
+        self.path = path
+        self.column = column
+        self.options = options
+        self.sample = None
+        self._writers = {}
+
+    @property
+    def rows(self):
+        return sum(writer.rows for writer in self._writers.values())
+
+    @property
+    def seconds(self):
+        return sum(writer.seconds for writer in self._writers.values())
+
+    def write(self, table):
+        if self.sample is None:
+            self.sample = table.slice(0, 15).to_pandas()
+        values = table.column(self.column)
+        for value in values.unique().to_pylist():
+            rows = table.filter(pc.equal(values, value)).drop_columns([self.column])
+            if value not in self._writers:
+                folder = os.path.join(self.path, f'{self.column}={value}')
+                os.makedirs(folder, exist_ok=True)
+                self._writers[value] = ParquetTableWriter(os.path.join(folder, 'part-00000.parquet'), **self.options)
+            self._writers[value].write(rows)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def hive_files(path):
+    """(partition value, file path) for each file of a PartitionedTableWriter folder, in value order."""
+    files = []
+    for folder in sorted(os.listdir(path)):
+        _, _, value = folder.partition('=')
+        for name in sorted(os.listdir(os.path.join(path, folder))):
+            files.append((value, os.path.join(path, folder, name)))
+    return files
+
+def merge_partitions(writer, part_paths, panel=False):
+    """Concatenate partition files into writer (a table writer) in a fixed order.
+
+    Panel partitions hold one row group per as_of_date, so they are interleaved
+    month by month; row groups are re-chunked up to CHUNK_ROWS but never span
+    two months (panel) or two partitions (other tables). Partitions are id
+    ranges, so rows come out in key order within each as_of_date.
+    """
+    files = [pq.ParquetFile(p) for p in part_paths]
+    if panel:
+        n_months = files[0].num_row_groups
+        assert all(f.num_row_groups == n_months for f in files), 'panel partitions must have one row group per month'
+        order = [(month, f, month) for month in range(n_months) for f in files]
+    else:
+        order = [(idx, f, rg) for idx, f in enumerate(files) for rg in range(f.num_row_groups)]
+    pending, pending_key, pending_rows = [], None, 0
+    for key, f, rg in order:
+        table = f.read_row_group(rg)
+        if pending and (key != pending_key or pending_rows + len(table) > CHUNK_ROWS):
+            writer.write(pa.concat_tables(pending))
+            pending, pending_rows = [], 0
+        pending.append(table)
+        pending_key = key
+        pending_rows += len(table)
+    if pending:
+        writer.write(pa.concat_tables(pending))
+    return writer
+
+
+# Run configuration
+class GenerationConfig:
+    """Settings for one generation run: seed, as_of_dates, row counts, output folder, sampling mode, Parquet layout/schema,
+    market_risk_metrics VaR model and table cache folder (None to always generate)."""
+
+    def __init__(self, seed=SEED, end_date=END_DATE, months=MONTHS, rows=None, data_dir=DATA_DIR, sampling='pooled',
+                 layout='flat', compression='snappy', schema='text', cache_dir=CACHE_DIR, var_model='fraction'):
+        if sampling not in SAMPLING_MODES:
+            raise ValueError(f'Unknown sampling mode: {sampling}')
+        if layout not in LAYOUTS:
+            raise ValueError(f'Unknown layout: {layout}')
+        if compression not in COMPRESSION_CODECS:
+            raise ValueError(f'Unknown compression codec: {compression}')
+        if schema not in SCHEMAS:
+            raise ValueError(f'Unknown schema: {schema}')
+        if var_model not in VAR_MODELS:
+            raise ValueError(f'Unknown VaR model: {var_model}')
+        self.seed = seed
+        self.end_date = end_date
+        self.months = months
+        self.dates = month_end_dates(end_date, months)
+        self.rows = dict(DEFAULT_ROWS, **(rows or {}))
+        self.data_dir = data_dir
+        self.sampling = sampling
+        self.layout = layout
+        self.compression = compression
+        self.compact = schema == 'compact'
+        self.var_model = var_model
+        self.cache_dir = cache_dir
+        # Fixed once per run so every worker process sees the same "now"
+        self.now = datetime.now().replace(microsecond=0)
+
+    def to_dict(self):
+        """The settings that determine the generated data, as JSON-serialisable values."""
+        return {'seed': self.seed, 'end_date': self.end_date.strftime('%Y-%m-%d'), 'months': self.months,
+                'rows': self.rows, 'sampling': self.sampling, 'layout': self.layout, 'compression': self.compression,
+                'schema': 'compact' if self.compact else 'text', 'var_model': self.var_model, 'now': self.now.isoformat()}
+
+    @classmethod
+    def from_dict(cls, settings, data_dir=DATA_DIR):
+        config = cls(seed=settings['seed'], end_date=datetime.strptime(settings['end_date'], '%Y-%m-%d'),
+                     months=settings['months'], rows=settings['rows'], data_dir=data_dir, sampling=settings['sampling'],
+                     layout=settings['layout'], compression=settings['compression'], schema=settings['schema'],
+                     var_model=settings.get('var_model', 'fraction'))
+        config.now = datetime.fromisoformat(settings['now'])
+        return config
+
+    def next_month(self):
+        """A copy of this config extended by one month-end as_of_date."""
+        year, month = divmod(self.end_date.year * 12 + self.end_date.month, 12)
+        config = copy.copy(self)
+        config.end_date = datetime(year, month + 1, monthrange(year, month + 1)[1])
+        config.months = self.months + 1
+        config.dates = month_end_dates(config.end_date, config.months)
+        return config
+
+    def partitioned(self, name):
+        """True if the table is written as a hive-partitioned folder in this layout."""
+        return self.layout == 'hive' and TABLES[name]['partition_by'] is not None
+
+    def path(self, name):
+        """The table's Parquet file, or its folder for hive-partitioned tables."""
+        if self.partitioned(name):
+            return os.path.join(self.data_dir, name)
+        return os.path.join(self.data_dir, f'{name}.parquet')
+
+    def writer_options(self, name):
+        """ParquetTableWriter keyword arguments for a table."""
+        return {'compression': self.compression, 'dictionary_columns': TABLES[name]['categorical'],
+                'transform': partial(compact_table, name=name) if self.compact else None}
+
+    def as_of_value(self, date):
+        """An as_of_date as stored in this schema: 'YYYY-MM-DD' text or a date (compact)."""
+        return date.date() if self.compact else date.strftime('%Y-%m-%d')
+
+    def open_writer(self, name):
+        """A writer for the table's final output in this layout."""
+        if self.partitioned(name):
+            return PartitionedTableWriter(self.path(name), TABLES[name]['partition_by'], **self.writer_options(name))
+        return ParquetTableWriter(self.path(name), **self.writer_options(name))
+
+    def part_path(self, name, index):
+        return os.path.join(self.data_dir, '_parts', name, f'part-{index:05d}.parquet')
+
+    @property
+    def mart_dir(self):
+        """The KPI mart, interaction index and limit breaches of this data folder."""
+        return os.path.join(self.data_dir, MART_DIR)
+
+# A slice of a table's work: partition index plus the [start, stop) row range it covers
+Partition = namedtuple('Partition', 'index start stop')
+
+def seed_partition(config, name, index=0):
+    """Seed the shared generators for one partition of a table and return its NumPy generator.
+
+    Every (table, partition) pair gets an independent stream spawned from the
+    master seed, so output does not depend on which other tables or partitions
+    ran before it in the same process, or on how many worker processes there are.
+    """
+    seq = np.random.SeedSequence([config.seed, zlib.crc32(name.encode()), index])
+    seed = int(seq.generate_state(1, dtype=np.uint64)[0])
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    fake.seed_instance(seed)
+    return np.random.default_rng(seq)
+
+def rng_state(rng):
+    """JSON-serialisable state of a partition's NumPy generator plus the shared random and Faker streams."""
+    return {'numpy': rng.bit_generator.state, 'random': random.getstate(), 'faker': fake.random.getstate()}
+
+def restore_rng_state(rng, state):
+    """Inverse of rng_state()."""
+    rng.bit_generator.state = state['numpy']
+    version, internal, gauss = state['random']
+    random.setstate((version, tuple(internal), gauss))
+    version, internal, gauss = state['faker']
+    fake.random.setstate((version, tuple(internal), gauss))
+
+def load_checkpoint(data_dir):
+    """table name -> {'config': GenerationConfig.to_dict(), 'states': {partition index: rng_state()}}."""
+    path = os.path.join(data_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(config, states):
+    """Record the settings and per-partition random states of the given tables."""
+    checkpoint = load_checkpoint(config.data_dir)
+    for name, table_states in states.items():
+        checkpoint[name] = {'config': config.to_dict(),
+                            'states': {str(index): state for index, state in table_states.items()}}
+    path = os.path.join(config.data_dir, CHECKPOINT_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+def load_customers(config):
+    return pd.read_parquet(config.path('customers'), columns=['customer_id', 'segment', 'state', 'industry'])
+
+def table_partitioning(config, name):
+    """Hive partitioning of a table, with the partition column typed as in the flat
+    file (text, or date32 in the compact schema) so filters work the same way; None for flat files."""
+    if not config.partitioned(name):
+        return None
+    column_type = pa.date32() if config.compact else pa.string()
+    return ds.partitioning(pa.schema([(TABLES[name]['partition_by'], column_type)]), flavor='hive')
+
+def read_table(config, name, columns=None, filters=None, read_dictionary=None):
+    """Read a table as a pyarrow Table in either layout."""
+    options = {}
+    if config.partitioned(name):
+        options['partitioning'] = table_partitioning(config, name)
+    return pq.read_table(config.path(name), columns=columns, filters=filters, read_dictionary=read_dictionary, **options)
+
+def table_dataset(config, name):
+    """A pyarrow Dataset over a table in either layout, for scanning it in record batches."""
+    return ds.dataset(config.path(name), format='parquet', partitioning=table_partitioning(config, name))
+
+def read_frame(config, name, columns=None):
+    """Read a table into a compact DataFrame, in either schema and layout.
+
+    Enumerated columns and as_of_date become pandas Categoricals (as_of_date
+    with 'YYYY-MM-DD' labels) and other date columns datetime64, instead of
+    Python str/date objects.
+    """
+    categorical = [c for c in TABLES[name]['categorical'] if columns is None or c in columns]
+    table = read_table(config, name, columns=columns, read_dictionary=categorical)
+    if 'as_of_date' in table.column_names:
+        as_of_date = table.column('as_of_date')
+        if pa.types.is_date(as_of_date.type):
+            as_of_date = as_of_date.cast(pa.string())
+        if not pa.types.is_dictionary(as_of_date.type):
+            as_of_date = as_of_date.dictionary_encode()
+        table = table.set_column(table.column_names.index('as_of_date'), 'as_of_date', as_of_date)
+    return table.to_pandas(date_as_object=False)
+
+def load_first_month_loans(config):
+    """loan_id, as_of_date and loan_amount of the first as_of_date snapshot of loans."""
+    return read_table(config, 'loans', columns=['loan_id', 'as_of_date', 'loan_amount'],
+                      filters=[('as_of_date', '==', config.as_of_value(config.dates[0]))]).to_pandas()
+
+def row_groups(config, name):
+    """(file path, row group index, rows, partition value) for every row group of a table, in table order.
+
+    The partition value is None for flat files.
+    """
+    if config.partitioned(name):
+        files = hive_files(config.path(name))
+    else:
+        files = [(None, config.path(name))]
+    groups = []
+    for value, path in files:
+        metadata = pq.ParquetFile(path).metadata
+        groups.extend((path, index, metadata.row_group(index).num_rows, value) for index in range(metadata.num_row_groups))
+    return groups
+
+def read_row_group(config, name, group, columns):
+    """Read one row_groups() entry, restoring the partition column of hive-partitioned tables."""
+    path, index, rows, value = group
+    column = TABLES[name]['partition_by']
+    stored = [c for c in columns if value is None or c != column]
+    table = pq.ParquetFile(path).read_row_group(index, columns=stored)
+    if value is not None and column in columns:
+        values = pa.array([value] * rows, pa.string())
+        table = table.add_column(columns.index(column), column, values.cast(pa.date32()) if config.compact else values)
+    return table
+
+# Table registry: name -> generator, upstream tables, risk domain and partitioning
+TABLES = {}
+
+def table(name, key, depends=(), domain='Credit Risk', panel=False, partitions=None, partition_by=None, categorical=(), ids=None,
+          append=False, settings=()):
+    """Register a table generator together with the tables it reads.
+
+    Generators are called as generate(config, writer, part, rng) and write the
+    rows of one Partition for config.dates, drawing from rng (the partition's
+    NumPy generator) or the shared random/Faker streams seeded alongside it. By default a table with a row count is split into
+    PARTITION_ROWS-sized id ranges; `partitions(config)` overrides that. Panel
+    generators must write exactly one row group per as_of_date. `key` is the
+    table's id column, `categorical` its enumerated (dictionary-encoded)
+    columns, `ids` the (prefix, width) format of each text id column and
+    `partition_by` the column the hive layout partitions on. append_month()
+    extends `append` tables; their generators also take `previous`, the
+    partition's rows at the last existing as_of_date, and continue from it.
+    `settings` names further GenerationConfig attributes the output depends on.
+    """
+    def register(func):
+        TABLES[name] = {'generate': func, 'depends': tuple(depends), 'domain': domain,
+                        'panel': panel, 'partitions': partitions, 'key': key,
+                        'partition_by': partition_by, 'categorical': tuple(categorical), 'ids': dict(ids or {}),
+                        'append': append, 'settings': tuple(settings)}
+        return func
+    return register
+
+def table_partitions(config, name):
+    spec = TABLES[name]
+    if spec['partitions'] is not None:
+        return spec['partitions'](config)
+    n_rows = config.rows.get(name, 0)
+    if not n_rows:
+        return [Partition(0, 0, 0)]
+    return [Partition(index, start, min(start + PARTITION_ROWS, n_rows))
+            for index, start in enumerate(range(0, n_rows, PARTITION_ROWS))]
+
+def malformed_ids(column, prefix):
+    """True for each text id that is not prefix followed by 1-9 digits, null for nulls."""
+    return pc.invert(pc.match_substring_regex(column, f'^{re.escape(prefix)}[0-9]{{1,9}}$'))
+
+def compact_table(table, name):
+    """Convert a chunk of a table to the compact schema.
+
+    Text ids become int32 surrogate keys (their number, see text_ids() for the
+    reverse), as_of_date becomes date32 and enumerated columns are
+    dictionary-encoded. Columns already in compact form are left as they are.
+    Malformed text ids (see malformed_ids) become null keys.
+    """
+    spec = TABLES[name]
+    for index, field in enumerate(table.schema):
+        column = table.column(index)
+        is_text = pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+        if field.name in spec['ids']:
+            if is_text:
+                prefix = spec['ids'][field.name][0]
+                column = pc.utf8_slice_codeunits(pc.if_else(malformed_ids(column, prefix), None, column), len(prefix))
+                column = column.cast(pa.int32(), safe=False)  # at most 9 digits
+            if column.type != pa.int32():
+                column = column.cast(pa.int32())
+        elif field.name == 'as_of_date':
+            # Text, or timestamps when the dates came through NumPy (market_risk_metrics)
+            if field.type == pa.date32():
+                continue
+            column = column.cast(pa.date32())
+        elif not is_text:
+            continue
+        elif field.name in spec['categorical']:
+            column = column.dictionary_encode()
         else:
-            prev = loans[-N_LOANS]
-            # Small migration probability
-            if random.random() < 0.05:
-                credit_rating = random_credit_rating()
-            else:
-                credit_rating = prev['credit_rating']
-            if random.random() < 0.05:
-                lgd_rating = random_lgd_rating()
-            else:
-                lgd_rating = prev['lgd_rating']
-        loans.append({
-            'loan_id': f'LOAN{i+1:06d}',
-            'customer_id': cust['customer_id'],
-            'as_of_date': as_of_date.strftime('%Y-%m-%d'),
-            'loan_amount': balance,
-            'credit_rating': credit_rating,
-            'lgd_rating': lgd_rating,
-            'ead': round(balance * random.uniform(0.8, 1.2), 2),
-            'rwa': round(balance * random.uniform(0.5, 1.5), 2),
-            'capital': round(balance * random.uniform(0.08, 0.12), 2),
-            'provisions': round(balance * random.uniform(0.01, 0.05), 2),
-            'arrears': round(balance * random.uniform(0, 0.1), 2),
-            'sales_channel': random_sales_channel(),
-            'industry': cust['industry'],
-            'geography': cust['state'],
-            'product_type': random_product_type(),
-            'purpose': random_purpose(),
-            'currency': 'AUD',
-            'origination_date': fake.date_between(start_date='-10y', end_date=as_of_date),
-            'maturity_date': fake.date_between(start_date=as_of_date, end_date='+10y'),
-            'interest_rate': round(random.uniform(2.5, 7.5), 2),
-            'repayment_type': random_repayment_type(),
-            'collateral_type': random_collateral_type(),
-            **financials
+            continue
+        table = table.set_column(index, field.name, column)
+    # The pandas metadata still describes the text columns; drop it so readers use the Arrow types
+    return table.replace_schema_metadata(None)
+
+def text_ids(df, name):
+    """Formatting view of a compact table: integer id columns of df shown as their text ids."""
+    df = df.copy()
+    for column, (prefix, width) in TABLES[name]['ids'].items():
+        if column in df.columns and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = format_id_values(prefix, df[column].to_numpy(), width)
+    return df
+
+def resolve_tables(names):
+    """Return the requested tables plus everything upstream of them, in build order."""
+    order = []
+    def visit(name):
+        if name not in TABLES:
+            raise ValueError(f'Unknown table: {name}')
+        if name in order:
+            return
+        for dep in TABLES[name]['depends']:
+            visit(dep)
+        order.append(name)
+    for name in names:
+        visit(name)
+    return order
+
+# ==================== CREDIT RISK DATA ====================
+
+@table('customers', 'customer_id', categorical=['segment', 'state', 'industry'],
+       ids={'customer_id': ('CUST', 5)})
+def generate_customers(config, writer, part, rng):
+    sampler = ColumnSampler(config, rng)
+    size = part.stop - part.start
+    today = config.now.date()
+    names = sampler.names(size)
+    dates_of_birth = sampler.dates_of_birth(today, size)
+    addresses = sampler.addresses(size)
+    customer_since = sampler.dates(today - timedelta(days=3652), today, size)
+    for k, i in enumerate(range(part.start, part.stop)):
+        writer.append({
+            'customer_id': f'CUST{i+1:05d}',
+            'name': names[k],
+            'date_of_birth': dates_of_birth[k],
+            'address': addresses[k],
+            'customer_since': customer_since[k],
+            'segment': random_segment(),
+            'state': random_state(),
+            'postcode': random_postcode(),
+            'industry': random_industry() if random_segment() != 'Retail' else ''
+        })
+
+@table('loans', 'loan_id', depends=['customers'], panel=True, partition_by='as_of_date',
+       categorical=['as_of_date', 'credit_rating', 'lgd_rating', 'sales_channel', 'industry', 'geography',
+                    'product_type', 'purpose', 'currency', 'repayment_type', 'collateral_type'],
+       ids={'loan_id': ('LOAN', 6), 'customer_id': ('CUST', 5)}, append=True)
+def generate_loans(config, writer, part, rng, previous=None):
+    """Loans panel, one row group per as_of_date."""
+    customers_df = load_customers(config)
+    state = None
+    if previous is not None:
+        state = (previous['loan_amount'].to_numpy(dtype=float),
+                 label_codes(previous['credit_rating'], CREDIT_RATINGS),
+                 label_codes(previous['lgd_rating'], LGD_RATINGS))
+    for _, chunk in iter_loan_snapshots(customers_df, config.dates, rng, part.start, part.stop,
+                                        today=config.now, state=state):
+        writer.write(chunk)
+
+@table('loan_applications', 'application_id', depends=['customers'], categorical=['status', 'product_type'],
+       ids={'application_id': ('APP', 6), 'customer_id': ('CUST', 5)})
+def generate_loan_applications(config, writer, part, rng):
+    sampler = ColumnSampler(config, rng)
+    today = config.now.date()
+    application_dates = sampler.dates(today - timedelta(days=730), today, part.stop - part.start)
+    customer_ids = load_customers(config)['customer_id'].to_numpy(dtype=object)
+    for k, i in enumerate(range(part.start, part.stop)):
+        customer_id = customer_ids[random.randint(0, len(customer_ids)-1)]
+        writer.append({
+            'application_id': f'APP{i+1:06d}',
+            'customer_id': customer_id,
+            'application_date': application_dates[k],
+            'amount_requested': random.randint(5_000, 500_000),
+            'status': random_application_status(),
+            'product_type': random_product_type()
+        })
+
+@table('write_offs', 'write_off_id', depends=['loans'], categorical=['as_of_date', 'reason'],
+       ids={'write_off_id': ('WO', 5), 'loan_id': ('LOAN', 6)})
+def generate_write_offs(config, writer, part, rng):
+    """Write-offs against loans from the first as_of_date snapshot."""
+    loans_df = load_first_month_loans(config)
+    loan_ids = loans_df['loan_id'].to_numpy()
+    loan_dates = loans_df['as_of_date'].to_numpy()
+    loan_amounts = loans_df['loan_amount'].to_numpy()
+    for i in range(part.start, part.stop):
+        loan_idx = random.randint(0, len(loan_ids)-1)
+        writer.append({
+            'write_off_id': f'WO{i+1:05d}',
+            'loan_id': loan_ids[loan_idx],
+            'as_of_date': loan_dates[loan_idx],
+            'amount_written_off': round(loan_amounts[loan_idx] * random.uniform(0.1, 1.0), 2),
+            'reason': random_choice(WRITE_OFF_REASONS)
+        })
+
+@table('customer_interactions', 'interaction_id', depends=['customers'], categorical=['interaction_type', 'agent_id'],
+       ids={'interaction_id': ('INT', 7), 'customer_id': ('CUST', 5), 'agent_id': ('AGT', 3)})
+def generate_customer_interactions(config, writer, part, rng):
+    sampler = ColumnSampler(config, rng)
+    size = part.stop - part.start
+    interaction_dates = sampler.datetimes(config.now - timedelta(days=730), config.now, size)
+    interaction_texts = sampler.sentences(size)
+    customer_ids = load_customers(config)['customer_id'].to_numpy(dtype=object)
+    for k, i in enumerate(range(part.start, part.stop)):
+        customer_id = customer_ids[random.randint(0, len(customer_ids)-1)]
+        writer.append({
+            'interaction_id': f'INT{i+1:07d}',
+            'customer_id': customer_id,
+            'interaction_date': interaction_dates[k],
+            'interaction_type': random_choice(INTERACTION_TYPES),
+            'agent_id': f'AGT{random.randint(1, N_AGENTS):03d}',
+            'interaction_text': interaction_texts[k]
+        })
+
+@table('loan_securities', 'security_id', depends=['loans'], categorical=['as_of_date', 'security_type', 'lien_type'],
+       ids={'security_id': ('SEC', 6), 'loan_id': ('LOAN', 6)})
+def generate_loan_securities(config, writer, part, rng):
+    """Securities against loans from the first as_of_date snapshot."""
+    loans_df = load_first_month_loans(config)
+    loan_ids = loans_df['loan_id'].to_numpy()
+    loan_dates = loans_df['as_of_date'].to_numpy()
+    loan_amounts = loans_df['loan_amount'].to_numpy()
+    sampler = ColumnSampler(config, rng)
+    size = part.stop - part.start
+    addresses = sampler.addresses(size)
+    owners = sampler.names(size)
+    for k, i in enumerate(range(part.start, part.stop)):
+        loan_idx = i % len(loan_ids)
+        writer.append({
+            'security_id': f'SEC{i+1:06d}',
+            'loan_id': loan_ids[loan_idx],
+            'as_of_date': loan_dates[loan_idx],
+            'security_type': random_collateral_type(),
+            'security_value': round(loan_amounts[loan_idx] * random.uniform(0.5, 1.5), 2),
+            'address': addresses[k],
+            'lien_type': random_lien_type(),
+            'ownership_details': owners[k]
         })
-loans_df = pd.DataFrame(loans)
-loans_df.to_parquet(os.path.join(DATA_DIR, 'loans.parquet'))
-
-# Generate loan applications
-applications = []
-for i in range(N_APPLICATIONS):
-    cust = customers[random.randint(0, N_CUSTOMERS-1)]
-    applications.append({
-        'application_id': f'APP{i+1:06d}',
-        'customer_id': cust['customer_id'],
-        'application_date': fake.date_between(start_date='-2y', end_date='today'),
-        'amount_requested': random.randint(5_000, 500_000),
-        'status': random_application_status(),
-        'product_type': random_product_type()
-    })
-applications_df = pd.DataFrame(applications)
-applications_df.to_parquet(os.path.join(DATA_DIR, 'loan_applications.parquet'))
-
-# Generate write-offs
-write_offs = []
-for i in range(N_WRITE_OFFS):
-    loan_idx = random.randint(0, N_LOANS-1)
-    loan = loans[loan_idx]
-    write_offs.append({
-        'write_off_id': f'WO{i+1:05d}',
-        'loan_id': loan['loan_id'],
-        'as_of_date': loan['as_of_date'],
-        'amount_written_off': round(loan['loan_amount'] * random.uniform(0.1, 1.0), 2),
-        'reason': random_choice(['Default', 'Fraud', 'Bankruptcy', 'Settlement'])
-    })
-write_offs_df = pd.DataFrame(write_offs)
-write_offs_df.to_parquet(os.path.join(DATA_DIR, 'write_offs.parquet'))
-
-# Generate customer interactions
-interactions = []
-for i in range(N_INTERACTIONS):
-    cust = customers[random.randint(0, N_CUSTOMERS-1)]
-    interactions.append({
-        'interaction_id': f'INT{i+1:07d}',
-        'customer_id': cust['customer_id'],
-        'interaction_date': fake.date_time_between(start_date='-2y', end_date='now'),
-        'interaction_type': random_choice(['Phone Call', 'Email', 'Branch Visit', 'Chat', 'Mobile App']),
-        'agent_id': f'AGT{random.randint(1, 100):03d}',
-        'interaction_text': fake.sentence(nb_words=20)
-    })
-interactions_df = pd.DataFrame(interactions)
-interactions_df.to_parquet(os.path.join(DATA_DIR, 'customer_interactions.parquet'))
-
-# Generate loan securities
-securities = []
-for i in range(N_SECURITIES):
-    loan = loans[i % len(loans)]
-    securities.append({
-        'security_id': f'SEC{i+1:06d}',
-        'loan_id': loan['loan_id'],
-        'as_of_date': loan['as_of_date'],
-        'security_type': random_collateral_type(),
-        'security_value': round(loan['loan_amount'] * random.uniform(0.5, 1.5), 2),
-        'address': fake.address().replace('\n', ', '),
-        'lien_type': random_lien_type(),
-        'ownership_details': fake.name()
-    })
-securities_df = pd.DataFrame(securities)
-securities_df.to_parquet(os.path.join(DATA_DIR, 'loan_securities.parquet'))
 
 # ==================== LIQUIDITY RISK DATA ====================
 
-print('Generating liquidity risk data...')
+@table('liquidity_positions', 'position_id', depends=['customers'], domain='Liquidity Risk', panel=True,
+       partition_by='as_of_date', categorical=['as_of_date', 'asset_type', 'geography'],
+       ids={'position_id': ('LP', 6), 'customer_id': ('CUST', 5)}, append=True)
+def generate_liquidity_positions(config, writer, part, rng, previous=None):
+    """Liquidity positions panel, one row group per as_of_date.
 
-# Generate liquidity positions (panel data)
-liquidity_positions = []
-for as_of_date in DATES:
-    for i in range(N_LIQUIDITY_POSITIONS):
-        cust = customers[i % N_CUSTOMERS]
-        # Amount logic
-        if as_of_date == DATES[0]:
-            amount = random.randint(10_000, 10_000_000)
+    Amounts start uniform in 10k-10M and change by up to +/-10% a month.
+    """
+    sampler = ColumnSampler(config, rng)
+    size = part.stop - part.start
+    maturity_end = config.now.date() + timedelta(days=1826)
+    customers_df = load_customers(config)
+    cust_idx = np.arange(part.start, part.stop) % len(customers_df)
+    position_ids = format_ids('LP', part.start, part.stop, 6)
+    customer_ids = customers_df['customer_id'].to_numpy(dtype=object)[cust_idx]
+    geographies = customers_df['state'].to_numpy(dtype=object)[cust_idx]
+    amounts = previous['amount'].to_numpy(dtype=float) if previous is not None else None
+    for as_of_date in config.dates:
+        if amounts is None:
+            amounts = rng.integers(10_000, 10_000_001, size).astype(float)
         else:
-            prev = liquidity_positions[-N_LIQUIDITY_POSITIONS]
-            change_pct = random.uniform(-0.1, 0.1)
-            amount = max(0, round(prev['amount'] * (1 + change_pct), 2))
-        liquidity_positions.append({
-            'position_id': f'LP{i+1:06d}',
+            amounts = np.maximum(0, np.round(amounts * (1 + rng.uniform(-0.1, 0.1, size)), 2))
+        maturities = sampler.dates(as_of_date.date(), maturity_end, size)
+        writer.write(pd.DataFrame({
+            'position_id': position_ids,
             'as_of_date': as_of_date.strftime('%Y-%m-%d'),
-            'customer_id': cust['customer_id'],
-            'asset_type': random_choice(ASSET_TYPES),
-            'amount': amount,
-            'geography': cust['state'],
-            'maturity_date': fake.date_between(start_date=as_of_date, end_date='+5y') if random.random() > 0.3 else None
-        })
-liquidity_positions_df = pd.DataFrame(liquidity_positions)
-liquidity_positions_df.to_parquet(os.path.join(DATA_DIR, 'liquidity_positions.parquet'))
-
-# Generate funding sources (panel data)
-funding_sources = []
-for as_of_date in DATES:
-    for i in range(N_FUNDING_SOURCES):
-        # Amount logic
-        if as_of_date == DATES[0]:
-            amount = random.randint(100_000, 100_000_000)
+            'customer_id': customer_ids,
+            'asset_type': random_labels(rng, ASSET_TYPES, size),
+            'amount': amounts,
+            'geography': geographies,
+            'maturity_date': np.where(rng.random(size) > 0.3, maturities, None)
+        }))
+
+@table('funding_sources', 'funding_id', domain='Liquidity Risk', panel=True, partition_by='as_of_date',
+       categorical=['as_of_date', 'source_type'],
+       ids={'funding_id': ('FS', 5)}, append=True)
+def generate_funding_sources(config, writer, part, rng, previous=None):
+    """Funding sources panel, one row group per as_of_date.
+
+    Amounts start uniform in 100k-100M and drift by up to +/-5% a month.
+    """
+    size = part.stop - part.start
+    funding_ids = format_ids('FS', part.start, part.stop, 5)
+    amounts = previous['amount'].to_numpy(dtype=float) if previous is not None else None
+    for as_of_date in config.dates:
+        if amounts is None:
+            amounts = rng.integers(100_000, 100_000_001, size).astype(float)
         else:
-            prev = funding_sources[-N_FUNDING_SOURCES]
-            change_pct = random.uniform(-0.05, 0.05)
-            amount = max(0, round(prev['amount'] * (1 + change_pct), 2))
-        
-        funding_sources.append({
-            'funding_id': f'FS{i+1:05d}',
+            amounts = np.maximum(0, np.round(amounts * (1 + rng.uniform(-0.05, 0.05, size)), 2))
+        writer.write(pd.DataFrame({
+            'funding_id': funding_ids,
+            'as_of_date': as_of_date.strftime('%Y-%m-%d'),
+            'source_type': random_labels(rng, FUNDING_SOURCE_TYPES, size),
+            'amount': amounts,
+            'cost': np.round(rng.uniform(1.0, 5.0, size), 2)  # Cost of funds percentage
+        }))
+
+@table('liquidity_metrics', 'metric_id', domain='Liquidity Risk', categorical=['as_of_date'],
+       ids={'metric_id': ('LM', 5)}, append=True)
+def generate_liquidity_metrics(config, writer, part, rng, previous=None):
+    """One set of liquidity metrics per as_of_date; ids continue from part.start (months are independent)."""
+    for metric_id, as_of_date in enumerate(config.dates, start=part.start + 1):
+        cash_inflows = random.randint(1_000_000, 100_000_000)
+        cash_outflows = random.randint(1_000_000, 100_000_000)
+        lcr = round(random.uniform(100, 150), 2)  # LCR should be above 100%
+        nsfr = round(random.uniform(100, 130), 2)  # NSFR should be above 100%
+
+        writer.append({
+            'metric_id': f'LM{metric_id:05d}',
+            'as_of_date': as_of_date.strftime('%Y-%m-%d'),
+            'LCR': lcr,
+            'NSFR': nsfr,
+            'cash_inflows': cash_inflows,
+            'cash_outflows': cash_outflows
+        })
+
+@table('liquidity_events', 'event_id', domain='Liquidity Risk', categorical=['as_of_date', 'event_type'],
+       ids={'event_id': ('LE', 5)})
+def generate_liquidity_events(config, writer, part, rng):
+    for i in range(part.start, part.stop):
+        as_of_date = random_choice(config.dates)
+        event_type = random_choice(LIQUIDITY_EVENT_TYPES)
+
+        # Generate appropriate event details based on type
+        if event_type == 'Stress':
+            details = random_choice([
+                'Market volatility stress test scenario',
+                'Regulatory stress test scenario',
+                'Internal stress test - severe economic downturn',
+                'Liquidity stress test - bank run scenario'
+            ])
+        elif event_type == 'Withdrawal':
+            details = f'Large withdrawal of ${random.randint(100_000, 10_000_000):,} from {random_choice(["corporate", "institutional", "retail"])} customers'
+        else:  # Deposit
+            details = f'Large deposit of ${random.randint(100_000, 10_000_000):,} from {random_choice(["corporate", "institutional", "retail"])} customers'
+
+        writer.append({
+            'event_id': f'LE{i+1:05d}',
             'as_of_date': as_of_date.strftime('%Y-%m-%d'),
-            'source_type': random_choice(FUNDING_SOURCE_TYPES),
-            'amount': amount,
-            'cost': round(random.uniform(1.0, 5.0), 2)  # Cost of funds percentage
+            'event_type': event_type,
+            'event_details': details
         })
-funding_sources_df = pd.DataFrame(funding_sources)
-funding_sources_df.to_parquet(os.path.join(DATA_DIR, 'funding_sources.parquet'))
-
-# Generate liquidity metrics (panel data)
-liquidity_metrics = []
-metric_id = 1
-for as_of_date in DATES:
-    # Generate one set of metrics per month
-    cash_inflows = random.randint(1_000_000, 100_000_000)
-    cash_outflows = random.randint(1_000_000, 100_000_000)
-    lcr = round(random.uniform(100, 150), 2)  # LCR should be above 100%
-    nsfr = round(random.uniform(100, 130), 2)  # NSFR should be above 100%
-    
-    liquidity_metrics.append({
-        'metric_id': f'LM{metric_id:05d}',
-        'as_of_date': as_of_date.strftime('%Y-%m-%d'),
-        'LCR': lcr,
-        'NSFR': nsfr,
-        'cash_inflows': cash_inflows,
-        'cash_outflows': cash_outflows
-    })
-    metric_id += 1
-liquidity_metrics_df = pd.DataFrame(liquidity_metrics)
-liquidity_metrics_df.to_parquet(os.path.join(DATA_DIR, 'liquidity_metrics.parquet'))
-
-# Generate liquidity events
-liquidity_events = []
-for i in range(N_LIQUIDITY_EVENTS):
-    as_of_date = random_choice(DATES)
-    event_type = random_choice(LIQUIDITY_EVENT_TYPES)
-    
-    # Generate appropriate event details based on type
-    if event_type == 'Stress':
-        details = random_choice([
-            'Market volatility stress test scenario',
-            'Regulatory stress test scenario',
-            'Internal stress test - severe economic downturn',
-            'Liquidity stress test - bank run scenario'
-        ])
-    elif event_type == 'Withdrawal':
-        details = f'Large withdrawal of ${random.randint(100_000, 10_000_000):,} from {random_choice(["corporate", "institutional", "retail"])} customers'
-    else:  # Deposit
-        details = f'Large deposit of ${random.randint(100_000, 10_000_000):,} from {random_choice(["corporate", "institutional", "retail"])} customers'
-    
-    liquidity_events.append({
-        'event_id': f'LE{i+1:05d}',
-        'as_of_date': as_of_date.strftime('%Y-%m-%d'),
-        'event_type': event_type,
-        'event_details': details
-    })
-liquidity_events_df = pd.DataFrame(liquidity_events)
-liquidity_events_df.to_parquet(os.path.join(DATA_DIR, 'liquidity_events.parquet'))
 
 # ==================== MARKET RISK DATA ====================
 
-print('Generating market risk data...')
-
-# Generate market positions (panel data)
-market_positions = []
-for as_of_date in DATES:
-    for i in range(N_MARKET_POSITIONS):
-        cust = customers[i % N_CUSTOMERS]
-        # Value logic
-        if as_of_date == DATES[0]:
-            notional = random.randint(10_000, 50_000_000)
-            market_value = notional * random.uniform(0.9, 1.1)
+@table('market_positions', 'position_id', depends=['customers'], domain='Market Risk', panel=True,
+       partition_by='as_of_date', categorical=['as_of_date', 'desk', 'instrument'],
+       ids={'position_id': ('MP', 6), 'customer_id': ('CUST', 5)}, append=True)
+def generate_market_positions(config, writer, part, rng, previous=None):
+    """Market positions panel, one row group per as_of_date.
+
+    Notionals start uniform in 10k-50M and move by up to +/-1.5% a month;
+    market value is the notional times 0.9-1.1.
+    """
+    size = part.stop - part.start
+    customers_df = load_customers(config)
+    cust_idx = np.arange(part.start, part.stop) % len(customers_df)
+    position_ids = format_ids('MP', part.start, part.stop, 6)
+    customer_ids = customers_df['customer_id'].to_numpy(dtype=object)[cust_idx]
+    notionals = previous['notional'].to_numpy(dtype=float) if previous is not None else None
+    for as_of_date in config.dates:
+        if notionals is None:
+            notionals = rng.integers(10_000, 50_000_001, size).astype(float)
         else:
-            prev = market_positions[-N_MARKET_POSITIONS]
-            change_pct = random.uniform(-0.15, 0.15)
-            notional = max(0, round(prev['notional'] * (1 + change_pct * 0.1), 2))
-            market_value = notional * random.uniform(0.9, 1.1)
-        
-        market_positions.append({
-            'position_id': f'MP{i+1:06d}',
+            notionals = np.maximum(0, np.round(notionals * (1 + rng.uniform(-0.15, 0.15, size) * 0.1), 2))
+        writer.write(pd.DataFrame({
+            'position_id': position_ids,
             'as_of_date': as_of_date.strftime('%Y-%m-%d'),
-            'desk': random_choice(DESKS),
-            'instrument': random_choice(INSTRUMENTS),
-            'notional': round(notional, 2),
-            'market_value': round(market_value, 2),
-            'customer_id': cust['customer_id']
-        })
-market_positions_df = pd.DataFrame(market_positions)
-market_positions_df.to_parquet(os.path.join(DATA_DIR, 'market_positions.parquet'))
-
-# Generate market risk metrics (panel data)
-market_risk_metrics = []
-metric_id = 1
-for idx, position in enumerate(market_positions):
-    # Generate metrics for each position
-    notional = position['notional']
-    market_value = position['market_value']
-    
-    # VaR typically 1-3% of position value
-    var = round(market_value * random.uniform(0.01, 0.03), 2)
-    # SVaR typically 2-5% of position value
-    svar = round(market_value * random.uniform(0.02, 0.05), 2)
-    # Expected shortfall typically slightly higher than VaR
-    expected_shortfall = round(var * random.uniform(1.1, 1.3), 2)
-    # Volatility as percentage
-    volatility = round(random.uniform(5, 30), 2)
-    
-    market_risk_metrics.append({
-        'metric_id': f'MRM{metric_id:06d}',
-        'position_id': position['position_id'],
-        'as_of_date': position['as_of_date'],
+            'desk': random_labels(rng, DESKS, size),
+            'instrument': random_labels(rng, INSTRUMENTS, size),
+            'notional': notionals,
+            'market_value': np.round(notionals * rng.uniform(0.9, 1.1, size), 2),
+            'customer_id': customer_ids
+        }))
+
+def market_positions_row_groups(config):
+    """One partition per market_positions row group, covering its rows."""
+    partitions, start = [], 0
+    for index, (_, _, rows, _) in enumerate(row_groups(config, 'market_positions')):
+        partitions.append(Partition(index, start, start + rows))
+        start += rows
+    return partitions
+
+@table('market_risk_metrics', 'metric_id', depends=['market_positions', 'instrument_prices'], domain='Market Risk',
+       partitions=market_positions_row_groups, partition_by='as_of_date', categorical=['as_of_date'],
+       ids={'metric_id': ('MRM', 6), 'position_id': ('MP', 6)}, append=True, settings=['var_model'])
+def generate_market_risk_metrics(config, writer, part, rng, previous=None):
+    """Position-level risk metrics for one market_positions row group, computed as columns (months are independent).
+
+    With config.var_model 'historical' they come from historical_position_metrics()
+    instead of random fractions of market_value.
+    """
+    positions = read_row_group(config, 'market_positions', row_groups(config, 'market_positions')[part.index],
+                               columns=['position_id', 'as_of_date', 'instrument', 'market_value'])
+    size = positions.num_rows
+    market_value = positions.column('market_value').to_numpy()
+    if config.var_model == 'historical':
+        as_of_date = str(positions.column('as_of_date')[0])[:10] if size else None
+        var, svar, es, volatility = historical_position_metrics(config, positions.column('instrument').to_pandas(),
+                                                                market_value, as_of_date)
+    else:
+        # VaR typically 1-3% of position value
+        var = np.round(market_value * rng.uniform(0.01, 0.03, size), 2)
+        # SVaR typically 2-5% of position value
+        svar = np.round(market_value * rng.uniform(0.02, 0.05, size), 2)
+        # Expected shortfall typically slightly higher than VaR
+        es = np.round(var * rng.uniform(1.1, 1.3, size), 2)
+        # Volatility as percentage
+        volatility = np.round(rng.uniform(5, 30, size), 2)
+    writer.write(pd.DataFrame({
+        'metric_id': format_ids('MRM', part.start, part.stop, 6),
+        'position_id': positions.column('position_id').to_numpy(),
+        'as_of_date': positions.column('as_of_date').to_numpy(),
         'VaR': var,
         'SVaR': svar,
-        'expected_shortfall': expected_shortfall,
+        'expected_shortfall': es,
         'volatility': volatility
-    })
-    metric_id += 1
-market_risk_metrics_df = pd.DataFrame(market_risk_metrics)
-market_risk_metrics_df.to_parquet(os.path.join(DATA_DIR, 'market_risk_metrics.parquet'))
-
-# Generate instrument prices (panel data)
-instrument_prices = []
-price_id = 1
-for as_of_date in DATES:
-    for instrument in INSTRUMENTS:
-        # Set base price based on instrument type
-        if instrument == 'ASX Equity':
-            base_price = random.uniform(5, 200)
-        elif instrument == 'AUD Bond':
-            base_price = random.uniform(95, 105)
-        elif instrument == 'FX Pair':
-            base_price = random.uniform(0.5, 1.5)
-        elif instrument == 'Commodity':
-            base_price = random.uniform(50, 500)
-        else:  # Derivative
-            base_price = random.uniform(10, 100)
-        
-        # Add some variation
-        if as_of_date != DATES[0] and price_id > len(INSTRUMENTS):
-            prev_idx = price_id - len(INSTRUMENTS) - 1
-            prev_price = instrument_prices[prev_idx]['price']
-            change_pct = random.uniform(-0.1, 0.1)
-            price = max(0.01, round(prev_price * (1 + change_pct), 2))
-        else:
-            price = round(base_price, 2)
-        
-        instrument_prices.append({
-            'price_id': f'IP{price_id:06d}',
-            'instrument': instrument,
+    }))
+
+@table('instrument_prices', 'price_id', domain='Market Risk', categorical=['instrument', 'as_of_date', 'currency'],
+       ids={'price_id': ('IP', 6)}, append=True)
+def generate_instrument_prices(config, writer, part, rng, previous=None):
+    """Monthly price per instrument, each a +/-10% walk from the previous month; ids continue from part.start."""
+    instrument_prices = []
+    price_id = part.start + 1
+    prices = None
+    if previous is not None:
+        prices = dict(zip(previous['instrument'].astype(str), previous['price']))
+    for as_of_date in config.dates:
+        month_prices = {}
+        for instrument in INSTRUMENTS:
+            # Set base price based on instrument type
+            if instrument == 'ASX Equity':
+                base_price = random.uniform(5, 200)
+            elif instrument == 'AUD Bond':
+                base_price = random.uniform(95, 105)
+            elif instrument == 'FX Pair':
+                base_price = random.uniform(0.5, 1.5)
+            elif instrument == 'Commodity':
+                base_price = random.uniform(50, 500)
+            else:  # Derivative
+                base_price = random.uniform(10, 100)
+
+            # Add some variation
+            if prices is not None:
+                change_pct = random.uniform(-0.1, 0.1)
+                price = max(0.01, round(prices[instrument] * (1 + change_pct), 2))
+            else:
+                price = round(base_price, 2)
+            month_prices[instrument] = price
+
+            instrument_prices.append({
+                'price_id': f'IP{price_id:06d}',
+                'instrument': instrument,
+                'as_of_date': as_of_date.strftime('%Y-%m-%d'),
+                'price': price,
+                'currency': 'AUD' if random.random() > 0.2 else random_choice(CURRENCIES)
+            })
+            price_id += 1
+        prices = month_prices
+    writer.write(pd.DataFrame(instrument_prices))
+
+@table('market_events', 'event_id', domain='Market Risk', categorical=['as_of_date', 'instrument', 'event_type'],
+       ids={'event_id': ('ME', 5)})
+def generate_market_events(config, writer, part, rng):
+    for i in range(part.start, part.stop):
+        as_of_date = random_choice(config.dates)
+        instrument = random_choice(INSTRUMENTS)
+        event_type = random_choice(MARKET_EVENT_TYPES)
+
+        # Generate appropriate event details based on type
+        if event_type == 'Shock':
+            details = random_choice([
+                'Market shock - significant price movement',
+                'Flash crash event',
+                'Volatility spike',
+                'Liquidity shock in market'
+            ])
+        elif event_type == 'News':
+            details = random_choice([
+                'RBA interest rate announcement',
+                'Major economic data release',
+                'Corporate earnings announcement',
+                'Geopolitical news affecting markets'
+            ])
+        else:  # Regulatory
+            details = random_choice([
+                'APRA regulatory update',
+                'ASIC market conduct review',
+                'New capital requirements announced',
+                'Market structure regulatory change'
+            ])
+
+        writer.append({
+            'event_id': f'ME{i+1:05d}',
             'as_of_date': as_of_date.strftime('%Y-%m-%d'),
-            'price': price,
-            'currency': 'AUD' if random.random() > 0.2 else random_choice(CURRENCIES)
+            'instrument': instrument,
+            'event_type': event_type,
+            'event_details': details
         })
-        price_id += 1
-instrument_prices_df = pd.DataFrame(instrument_prices)
-instrument_prices_df.to_parquet(os.path.join(DATA_DIR, 'instrument_prices.parquet'))
-
-# Generate market events
-market_events = []
-for i in range(N_MARKET_EVENTS):
-    as_of_date = random_choice(DATES)
-    instrument = random_choice(INSTRUMENTS)
-    event_type = random_choice(MARKET_EVENT_TYPES)
-    
-    # Generate appropriate event details based on type
-    if event_type == 'Shock':
-        details = random_choice([
-            'Market shock - significant price movement',
-            'Flash crash event',
-            'Volatility spike',
-            'Liquidity shock in market'
-        ])
-    elif event_type == 'News':
-        details = random_choice([
-            'RBA interest rate announcement',
-            'Major economic data release',
-            'Corporate earnings announcement',
-            'Geopolitical news affecting markets'
-        ])
-    else:  # Regulatory
-        details = random_choice([
-            'APRA regulatory update',
-            'ASIC market conduct review',
-            'New capital requirements announced',
-            'Market structure regulatory change'
-        ])
-    
-    market_events.append({
-        'event_id': f'ME{i+1:05d}',
-        'as_of_date': as_of_date.strftime('%Y-%m-%d'),
-        'instrument': instrument,
-        'event_type': event_type,
-        'event_details': details
-    })
-market_events_df = pd.DataFrame(market_events)
-market_events_df.to_parquet(os.path.join(DATA_DIR, 'market_events.parquet'))
-
-print('Fake bank data generated in ./data as parquet files.')
-print('\nGenerated files:')
-print('  Credit Risk:')
-print('    - customers.parquet')
-print('    - loans.parquet')
-print('    - loan_applications.parquet')
-print('    - write_offs.parquet')
-print('    - customer_interactions.parquet')
-print('    - loan_securities.parquet')
-print('  Liquidity Risk:')
-print('    - liquidity_positions.parquet')
-print('    - funding_sources.parquet')
-print('    - liquidity_metrics.parquet')
-print('    - liquidity_events.parquet')
-print('  Market Risk:')
-print('    - market_positions.parquet')
-print('    - market_risk_metrics.parquet')
-print('    - instrument_prices.parquet')
-print('    - market_events.parquet')
-
-# (Old purge moved to top of file to avoid removing freshly generated outputs)
-
-# Save head(15) of each table to 'sample' folder as CSV
-sample_dir = 'sample'
-os.makedirs(sample_dir, exist_ok=True)
-for df, name in [
-    (customers_df, 'customers'),
-    (loans_df, 'loans'),
-    (applications_df, 'loan_applications'),
-    (write_offs_df, 'write_offs'),
-    (interactions_df, 'customer_interactions'),
-    (securities_df, 'loan_securities'),
-    (liquidity_positions_df, 'liquidity_positions'),
-    (funding_sources_df, 'funding_sources'),
-    (liquidity_metrics_df, 'liquidity_metrics'),
-    (liquidity_events_df, 'liquidity_events'),
-    (market_positions_df, 'market_positions'),
-    (market_risk_metrics_df, 'market_risk_metrics'),
-    (instrument_prices_df, 'instrument_prices'),
-    (market_events_df, 'market_events')
-]:
-    df.head(15).to_csv(os.path.join(sample_dir, f'{name}_sample.csv'), index=False)
-
-# Data profiling and summary charts
-import matplotlib.pyplot as plt
-import seaborn as sns
-summary_dir = 'summary'
-os.makedirs(summary_dir, exist_ok=True)
-
-loan_amt_by_date = loans_df.groupby('as_of_date')['loan_amount'].sum().reset_index()
-# Remove duplicate as_of_date if any
-loan_amt_by_date = loan_amt_by_date.drop_duplicates(subset=['as_of_date'])
-plt.figure(figsize=(12,6))
-sns.lineplot(data=loan_amt_by_date, x='as_of_date', y='loan_amount')
-plt.title('Total Loan Amounts by As-of-Date')
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig(os.path.join(summary_dir, 'total_loan_amounts_by_date.png'))
-plt.close()
-
-# Stacked column chart: loan amount by as_of_date and industry
-industry_by_date = loans_df.groupby(['as_of_date', 'industry'])['loan_amount'].sum().unstack(fill_value=0)
-industry_by_date = industry_by_date.loc[~industry_by_date.index.duplicated(keep='first')]
-industry_by_date.plot(kind='bar', stacked=True, figsize=(14,7))
-plt.title('Stacked Loan Amounts by Industry and As-of-Date')
-plt.xlabel('As-of-Date')
-plt.ylabel('Loan Amount')
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig(os.path.join(summary_dir, 'stacked_loan_amounts_by_industry.png'))
-plt.close()
-
-# Stacked column chart: loan amount by as_of_date and sales_channel
-channel_by_date = loans_df.groupby(['as_of_date', 'sales_channel'])['loan_amount'].sum().unstack(fill_value=0)
-channel_by_date = channel_by_date.loc[~channel_by_date.index.duplicated(keep='first')]
-channel_by_date.plot(kind='bar', stacked=True, figsize=(14,7))
-plt.title('Stacked Loan Amounts by Sales Channel and As-of-Date')
-plt.xlabel('As-of-Date')
-plt.ylabel('Loan Amount')
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig(os.path.join(summary_dir, 'stacked_loan_amounts_by_channel.png'))
-plt.close()
-
-def plot_and_save(df, col, title, filename, kind='bar', rotate_xticks=True):
+
+# ==================== HISTORICAL-SIMULATION VAR ====================
+
+def instrument_returns(config):
+    """Monthly returns of each INSTRUMENTS price from instrument_prices: (as_of_dates, instruments x months array).
+
+    as_of_dates are 'YYYY-MM-DD' strings; the first month, which has no return, is left out.
+    """
+    prices = read_frame(config, 'instrument_prices', columns=['as_of_date', 'instrument', 'price'])
+    prices['as_of_date'] = prices['as_of_date'].astype(str)
+    prices = prices.pivot_table(index='instrument', columns='as_of_date', values='price', observed=True).reindex(INSTRUMENTS)
+    values = prices.to_numpy(dtype=float)
+    return [str(date) for date in prices.columns[1:]], values[:, 1:] / values[:, :-1] - 1
+
+def tail_statistics(pnl, levels):
+    """{level: (VaR, ES)} of each row of a P&L matrix (rows x scenarios), as positive losses.
+
+    At confidence level c the tail is the k = ceil(scenarios * (1 - c)) worst
+    scenarios: VaR is the k-th worst loss and expected shortfall their mean.
+    """
+    scenarios = pnl.shape[1]
+    if scenarios == 0:
+        return {level: (np.full(len(pnl), np.nan), np.full(len(pnl), np.nan)) for level in levels}
+    tails = {level: max(1, int(np.ceil(round(scenarios * (1 - level), 9)))) for level in levels}
+    worst = np.partition(pnl, sorted({k - 1 for k in tails.values()}), axis=1)
+    return {level: (-worst[:, k - 1], -worst[:, :k].mean(axis=1)) for level, k in tails.items()}
+
+def position_var(market_value, instrument_codes, scenarios, levels=VAR_LEVELS, cells=VAR_CELLS):
+    """{level: (VaR, ES)} of each position, whose P&L in a scenario is its market_value times its instrument's return.
+
+    scenarios is an instruments x scenarios return matrix; the positions x
+    scenarios P&L is built and reduced in chunks of at most `cells` values.
+    """
+    stats = {level: (np.empty(len(market_value)), np.empty(len(market_value))) for level in levels}
+    step = max(1, cells // max(scenarios.shape[1], 1))
+    for start in range(0, len(market_value), step):
+        pnl = market_value[start:start + step, None] * scenarios[instrument_codes[start:start + step]]
+        for level, (var, es) in tail_statistics(pnl, levels).items():
+            stats[level][0][start:start + step] = var
+            stats[level][1][start:start + step] = es
+    return stats
+
+def scenario_window(dates, returns, as_of_date, window=VAR_WINDOW):
+    """The return vectors of the `window` months up to as_of_date ('YYYY-MM-DD'): instruments x scenarios."""
+    end = int(np.searchsorted(dates, as_of_date, side='right'))
+    return returns[:, max(0, end - window):end]
+
+def stressed_window(dates, returns, exposure, as_of_date, window=VAR_WINDOW, level=max(VAR_LEVELS)):
+    """The `window` consecutive months up to as_of_date whose returns give the instrument exposures the largest VaR."""
+    history = returns[:, :int(np.searchsorted(dates, as_of_date, side='right'))]
+    if history.shape[1] <= window:
+        return history
+    windows = np.lib.stride_tricks.sliding_window_view(exposure @ history, window)
+    start = int(np.argmax(tail_statistics(windows, [level])[level][0]))
+    return history[:, start:start + window]
+
+def historical_var(config, as_of_date=None, levels=VAR_LEVELS, window=VAR_WINDOW):
+    """Historical-simulation VaR, expected shortfall and stressed VaR of market_positions at one as_of_date (default: the last).
+
+    The scenarios are the instrument return vectors of the `window` months up
+    to as_of_date (see instrument_returns); the stressed scenarios are those of
+    the `window`-month period of the whole history that gives today's
+    portfolio its largest VaR. Desks and the portfolio are revalued through
+    their instrument exposures. Returns {'positions', 'desks', 'portfolio'}
+    DataFrames with var_<level>, es_<level> and svar_<level> columns, as
+    positive AUD losses (level in %, e.g. var_99).
+    """
+    as_of_date = as_of_date or config.dates[-1].strftime('%Y-%m-%d')
+    dates, returns = instrument_returns(config)
+    positions = read_month(config, 'market_positions', as_of_date, ['position_id', 'desk', 'instrument', 'market_value'])
+    market_value = positions['market_value'].to_numpy(dtype=float)
+    instrument_codes = label_codes(positions['instrument'], INSTRUMENTS)
+    desk_codes = label_codes(positions['desk'], DESKS)
+    exposures = np.bincount(desk_codes.astype(np.int64) * len(INSTRUMENTS) + instrument_codes, market_value,
+                            minlength=len(DESKS) * len(INSTRUMENTS)).reshape(len(DESKS), len(INSTRUMENTS))
+    scenarios = scenario_window(dates, returns, as_of_date, window)
+    stressed = stressed_window(dates, returns, exposures.sum(axis=0), as_of_date, window, max(levels))
+    desks = pd.DataFrame({'desk': DESKS, 'market_value': exposures.sum(axis=1)})
+    portfolio = pd.DataFrame({'market_value': [market_value.sum()]})
+    positions = positions.assign(as_of_date=as_of_date)
+    for frame, stats, stressed_stats in (
+            (positions, position_var(market_value, instrument_codes, scenarios, levels),
+             position_var(market_value, instrument_codes, stressed, levels)),
+            (desks, tail_statistics(exposures @ scenarios, levels), tail_statistics(exposures @ stressed, levels)),
+            (portfolio, tail_statistics(exposures.sum(axis=0, keepdims=True) @ scenarios, levels),
+             tail_statistics(exposures.sum(axis=0, keepdims=True) @ stressed, levels))):
+        for level in levels:
+            frame[f'var_{level * 100:g}'], frame[f'es_{level * 100:g}'] = stats[level]
+            frame[f'svar_{level * 100:g}'] = stressed_stats[level][0]
+    desks.insert(0, 'as_of_date', as_of_date)
+    portfolio.insert(0, 'as_of_date', as_of_date)
+    return {'positions': positions, 'desks': desks, 'portfolio': portfolio}
+
+def month_exposures(config):
+    """{'YYYY-MM-DD': market value per INSTRUMENTS} of market_positions at each of config.dates, from one batched scan."""
+    exposure = np.zeros(len(config.dates) * len(INSTRUMENTS))
+    months = ds.field('as_of_date').isin([config.as_of_value(date) for date in config.dates])
+    for table in scan_compact(config, 'market_positions', ['as_of_date', 'instrument', 'market_value'], months):
+        keys = month_index(table, config) * len(INSTRUMENTS) + dictionary_codes(table, 'instrument', INSTRUMENTS)
+        exposure += group_sums(keys, table.column('market_value').to_numpy(), exposure.size)
+    return dict(zip((date.strftime('%Y-%m-%d') for date in config.dates), exposure.reshape(len(config.dates), -1)))
+
+# Scenario sets of the historical market_risk_metrics, kept per process for the dataset last used:
+# (instrument_prices + market_positions fingerprint, as_of_dates) -> {as_of_date: month's scenario sets}
+_MONTH_SCENARIOS = {}
+
+def month_scenarios(config, as_of_date):
+    """(scenario returns, stressed scenario returns, annualised volatility % per instrument) at as_of_date.
+
+    The instrument returns and every month's exposure are read once and the
+    scenario sets of all config.dates computed together, then shared by all
+    the market_positions row groups a process generates. Rewriting either
+    source table changes its fingerprint and clears them.
+    """
+    key = (parquet_fingerprint(config, 'instrument_prices') + parquet_fingerprint(config, 'market_positions'),
+           tuple(config.dates))
+    if key not in _MONTH_SCENARIOS:
+        dates, returns = instrument_returns(config)
+        months = {}
+        for month, exposure in month_exposures(config).items():
+            scenarios = scenario_window(dates, returns, month)
+            volatility = np.std(scenarios, axis=1, ddof=1) * np.sqrt(12) * 100 if scenarios.shape[1] > 1 else np.full(len(INSTRUMENTS), np.nan)
+            months[month] = (scenarios, stressed_window(dates, returns, exposure, month), volatility)
+        _MONTH_SCENARIOS.clear()
+        _MONTH_SCENARIOS[key] = months
+    return _MONTH_SCENARIOS[key][as_of_date]
+
+def historical_position_metrics(config, instruments, market_value, as_of_date):
+    """VaR, SVaR and expected shortfall at MRM_VAR_LEVEL and annualised volatility (%) of positions, for market_risk_metrics.
+
+    The stressed window is chosen for the whole month's portfolio, so every
+    market_positions row group of the month shares it (see month_scenarios). NaN before the first return.
+    """
+    if as_of_date is None:
+        return (np.empty(0),) * 4
+    scenarios, stressed, volatility = month_scenarios(config, as_of_date)
+    codes = label_codes(instruments, INSTRUMENTS)
+    var, es = position_var(market_value, codes, scenarios, [MRM_VAR_LEVEL])[MRM_VAR_LEVEL]
+    svar, _ = position_var(market_value, codes, stressed, [MRM_VAR_LEVEL])[MRM_VAR_LEVEL]
+    return np.round(var, 2), np.round(svar, 2), np.round(es, 2), np.round(volatility[codes], 2)
+
+class ParquetFileSummary:
+    """Row count and head(15) sample of a Parquet file written in one piece."""
+
+    def __init__(self, path):
+        parquet_file = pq.ParquetFile(path)
+        self.path = path
+        self.rows = parquet_file.metadata.num_rows
+        self.sample = next(parquet_file.iter_batches(batch_size=15)).to_pandas() if self.rows else None
+
+# ==================== INSTRUMENTATION ====================
+
+def rss_mb():
+    """Current resident memory of this process in MB (None where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def private_rss_mb():
+    """Resident memory of this process not backed by files or shared memory, in MB (None where /proc is unavailable).
+
+    Pages of a memory-mapped file count towards rss_mb() in every process
+    that touches them but are held once in the page cache; this leaves them out.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            _, resident, shared = (int(value) for value in f.read().split()[:3])
+        return (resident - shared) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far in MB (None on Windows)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB elsewhere
+
+def path_bytes(path):
+    """Size of a file, or of every file under a folder."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk(path) for name in names)
+
+def table_rows(config, name):
+    return sum(rows for _, _, rows, _ in row_groups(config, name))
+
+@contextmanager
+def measure(stage, profile_path=None):
+    """Measure a block; yields the stage's metrics dict, to which the block may add rows and bytes.
+
+    Records wall and CPU seconds, the change in resident memory and the peak
+    so far. With profile_path the block runs under cProfile and its stats are
+    dumped there.
+    """
+    metrics = {'stage': stage}
+    profiler = cProfile.Profile() if profile_path else None
+    rss = rss_mb()
+    start, cpu = time.perf_counter(), time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield metrics
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+            profiler.dump_stats(profile_path)
+            metrics['profile'] = profile_path
+        metrics['seconds'] = round(time.perf_counter() - start, 4)
+        metrics['cpu_seconds'] = round(time.process_time() - cpu, 4)
+        end_rss = rss_mb()
+        metrics['rss_delta_mb'] = None if rss is None or end_rss is None else round(end_rss - rss, 1)
+        peak = peak_rss_mb()
+        metrics['peak_rss_mb'] = None if peak is None else round(peak, 1)
+
+def combine_metrics(stage, parts):
+    """One stage's metrics from those of its partitions; seconds are summed, so with
+    several workers they are busy time rather than wall time."""
+    metrics = {'stage': stage, 'partitions': len(parts)}
+    for field in ('rows', 'write_seconds', 'seconds', 'cpu_seconds'):
+        metrics[field] = round(sum(part[field] for part in parts), 4)
+    for field in ('rss_delta_mb', 'peak_rss_mb'):
+        values = [part[field] for part in parts if part[field] is not None]
+        metrics[field] = max(values) if values else None
+    profiles = [part['profile'] for part in parts if 'profile' in part]
+    if profiles:
+        metrics['profile'] = profiles
+    return metrics
+
+class RunReport:
+    """Metrics of every stage of a run, logged as JSON lines and saved to <data_dir>/run_report.json.
+
+    Stages are named generate:<table> (its partitions' generators and row-group
+    writes), write:<table> (merging the partitions into the final output),
+    sample:<table>, cache:<table> (restoring from the cache), store:<table>
+    (adding to it), arrow:<table> (its Arrow IPC copy), profile and charts. The stage named profile_stage is run
+    under cProfile, with its stats saved under <data_dir>/_profiles/.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, profile_stage=None):
+        self.data_dir = data_dir
+        self.profile_stage = profile_stage
+        self.started = datetime.now()
+        self.stages = []
+
+    def profile_path(self, stage, part=None):
+        """Where the stage's cProfile stats go, or None if it is not the profiled stage."""
+        if stage != self.profile_stage:
+            return None
+        suffix = '' if part is None else f'-{part:05d}'
+        return os.path.join(self.data_dir, '_profiles', f'{stage.replace(":", "-")}{suffix}.prof')
+
+    def add(self, metrics):
+        self.stages.append(metrics)
+        logger.info(json.dumps(metrics))
+
+    @contextmanager
+    def stage(self, stage):
+        with measure(stage, self.profile_path(stage)) as metrics:
+            yield metrics
+        self.add(metrics)
+
+    def save(self, config=None):
+        """Write the report (with the run's settings, if given) and return its path."""
+        finished = datetime.now()
+        report = {'started': self.started.isoformat(timespec='seconds'), 'finished': finished.isoformat(timespec='seconds'),
+                  'seconds': round((finished - self.started).total_seconds(), 3),
+                  'peak_rss_mb': round(peak_rss_mb() or 0, 1) or None, 'settings': config.to_dict() if config is not None else None,
+                  'stages': self.stages}
+        os.makedirs(self.data_dir, exist_ok=True)
+        path = os.path.join(self.data_dir, RUN_REPORT)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1, default=str)
+        return path
+
+def run_partition(config, name, part, path, state=None, previous=None, profile_path=None):
+    """Generate one partition of a table into its own Parquet file (runs in worker processes).
+
+    `state` (from a checkpoint) resumes the partition's random streams and
+    `previous` holds its rows at the last existing as_of_date when appending.
+    Returns (random state, metrics): the state after generation for tables
+    that can be appended to, else None, and the partition's measure() metrics.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rng = seed_partition(config, name, part.index)
+    if state is not None:
+        restore_rng_state(rng, state)
+    with measure(f'generate:{name}', profile_path) as metrics:
+        with ParquetTableWriter(path, **config.writer_options(name)) as writer:
+            TABLES[name]['generate'](config, writer, part, rng, *([previous] if previous is not None else []))
+        metrics.update(rows=writer.rows, write_seconds=round(writer.seconds, 4))
+    return (rng_state(rng) if TABLES[name]['append'] else None), metrics
+
+def remove_parts(part_paths):
+    shutil.rmtree(os.path.dirname(part_paths[0]), ignore_errors=True)
+    try:
+        os.rmdir(os.path.dirname(os.path.dirname(part_paths[0])))
+    except OSError:
+        pass  # other tables' partitions are still in progress
+
+def finish_table(config, name, parts):
+    """Merge a table's partition files into its final output (see GenerationConfig.open_writer); returns the writer."""
+    if len(parts) == 1 and not config.partitioned(name):
+        return ParquetFileSummary(config.path(name))
+    part_paths = [config.part_path(name, part.index) for part in parts]
+    with config.open_writer(name) as writer:
+        merge_partitions(writer, part_paths, panel=TABLES[name]['panel'])
+    remove_parts(part_paths)
+    return writer
+
+def _code_names(code):
+    """Global names used by a code object, including its nested functions and comprehensions."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+def _is_constant(value):
+    if isinstance(value, (str, int, float, bool, type(None), datetime)):
+        return True
+    if isinstance(value, (list, tuple)):
+        return all(_is_constant(item) for item in value)
+    if isinstance(value, dict):
+        return all(_is_constant(key) and _is_constant(item) for key, item in value.items())
+    return False
+
+def code_digest(*roots):
+    """SHA-256 of the source of the given functions/classes and of the module-level
+    functions, classes and constants they use, followed transitively."""
+    hasher = hashlib.sha256()
+    pending, seen = list(roots), set()
+    while pending:
+        obj = pending.pop(0)
+        if obj in seen:
+            continue
+        seen.add(obj)
+        if hasattr(obj, '_fields'):  # namedtuples have no source of their own
+            hasher.update(f'{obj.__name__}{obj._fields}\n'.encode())
+            continue
+        hasher.update(inspect.getsource(obj).encode())
+        if inspect.isclass(obj):
+            members = [getattr(member, '__func__', getattr(member, 'fget', member)) for member in vars(obj).values()]
+            functions = [member for member in members if inspect.isfunction(member)]
+        else:
+            functions = [obj]
+        for name in sorted(set().union(*(_code_names(function.__code__) for function in functions))):
+            value = globals().get(name)
+            if (inspect.isfunction(value) or inspect.isclass(value)) and value.__module__ == __name__:
+                pending.append(value)
+            elif _is_constant(value) and not name.startswith('_'):  # _-prefixed globals are per-process caches
+                hasher.update(f'{name} = {value!r}\n'.encode())
+    return hasher.hexdigest()
+
+def cache_keys(config, order):
+    """Cache key of each table in build order.
+
+    A key hashes the table's generator (with the helpers and constants it
+    uses, and the writing pipeline), the settings that shape its output and
+    its upstream tables' keys, so changing e.g. MARKET_EVENT_TYPES only
+    invalidates market_events. The run's start time is not part of the key:
+    reused tables keep the interaction dates and ages of the run that made them.
+    """
+    keys = {}
+    for name in order:
+        spec = TABLES[name]
+        roots = [spec['generate'], run_partition, finish_table, compact_table, text_ids, GenerationConfig]
+        if spec['partitions'] is not None:
+            roots.append(spec['partitions'])
+        settings = {'seed': config.seed, 'dates': [d.strftime('%Y-%m-%d') for d in config.dates],
+                    'rows': config.rows.get(name, 0), 'sampling': config.sampling, 'partitioned': config.partitioned(name),
+                    'compression': config.compression, 'compact': config.compact,
+                    'depends': [keys[dep] for dep in spec['depends']]}
+        settings.update({setting: getattr(config, setting) for setting in spec['settings']})
+        hasher = hashlib.sha256(code_digest(*roots).encode())
+        hasher.update(json.dumps(settings, sort_keys=True).encode())
+        keys[name] = hasher.hexdigest()[:20]
+    return keys
+
+def restore_table(config, name, key, samples):
+    """Copy a cached table (output, sample CSV and checkpoint state) into place; False if it is not cached."""
+    entry = os.path.join(config.cache_dir, name, key)
+    if not os.path.isdir(entry):
+        return False
+    output = os.path.join(entry, os.path.basename(config.path(name)))
+    if os.path.isdir(output):
+        shutil.copytree(output, config.path(name))
+    else:
+        shutil.copy2(output, config.path(name))
+    if samples and os.path.exists(os.path.join(entry, 'sample.csv')):
+        shutil.copy2(os.path.join(entry, 'sample.csv'), os.path.join(SAMPLE_DIR, f'{name}_sample.csv'))
+    if os.path.exists(os.path.join(entry, 'states.json')):
+        with open(os.path.join(entry, 'states.json')) as f:
+            save_checkpoint(config, {name: json.load(f)})
+    os.utime(entry)  # most recently used
+    return True
+
+def store_table(config, name, key, sample, states):
+    """Save a generated table to the cache, keeping the CACHE_ENTRIES most recently used versions."""
+    folder = os.path.join(config.cache_dir, name)
+    entry = os.path.join(folder, key)
+    shutil.rmtree(entry + '.tmp', ignore_errors=True)
+    os.makedirs(entry + '.tmp')
+    output = os.path.join(entry + '.tmp', os.path.basename(config.path(name)))
+    if os.path.isdir(config.path(name)):
+        shutil.copytree(config.path(name), output)
+    else:
+        shutil.copy2(config.path(name), output)
+    if sample is not None:
+        text_ids(sample, name).to_csv(os.path.join(entry + '.tmp', 'sample.csv'), index=False)
+    if states is not None:
+        with open(os.path.join(entry + '.tmp', 'states.json'), 'w') as f:
+            json.dump(states, f)
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(entry + '.tmp', entry)
+    entries = sorted((os.path.join(folder, key) for key in os.listdir(folder)), key=os.path.getmtime, reverse=True)
+    for old in entries[CACHE_ENTRIES:]:
+        shutil.rmtree(old, ignore_errors=True)
+
+def build(names=None, config=None, samples=True, workers=1, upstream=True, report=None):
+    """Generate the requested tables (default: all) and their upstream tables.
+
+    Tables are split into partitions (see table_partitions). With workers > 1
+    partitions of independent tables run concurrently in a process pool; a
+    table starts once all its upstream tables are merged. Output is identical
+    for any worker count. Returns the list of tables built, in build order.
+    Each table's Parquet file (or hive folder) and, with samples, its sample
+    CSV are replaced; other tables' outputs are left untouched. The random state of tables that
+    append_month() extends is saved to the data folder's checkpoint. Tables
+    found in config.cache_dir under their cache key are copied instead of
+    generated, and generated tables are added to it. With upstream=False only
+    the named tables are built, from the upstream outputs already in data_dir.
+    Stage metrics are added to `report` (see RunReport); without one they are
+    saved to the data folder's run_report.json.
+    """
+    config = config or GenerationConfig()
+    own_report = report is None
+    report = report or RunReport(config.data_dir)
+    order = resolve_tables(names or list(TABLES))
+    if not upstream:
+        order = [name for name in order if name in (names or list(TABLES))]
+    os.makedirs(config.data_dir, exist_ok=True)
+    if samples:
+        os.makedirs(SAMPLE_DIR, exist_ok=True)
+    for name in order:
+        # Both layouts are cleared so switching --layout leaves no stale copy behind;
+        # the sample is only replaced when a new one is written
+        stale = [os.path.join(config.data_dir, f'{name}.parquet')]
+        if samples:
+            stale.append(os.path.join(SAMPLE_DIR, f'{name}_sample.csv'))
+        for f in stale:
+            if os.path.exists(f):
+                os.remove(f)
+        shutil.rmtree(os.path.join(config.data_dir, name), ignore_errors=True)
+    keys = {name: key for name, key in cache_keys(config, resolve_tables(order)).items() if name in order} if config.cache_dir else {}
+
+    def cached(name):
+        if name not in keys:
+            return False
+        with measure(f'cache:{name}', report.profile_path(f'cache:{name}')) as metrics:
+            restored = restore_table(config, name, keys[name], samples)
+        if restored:
+            print(f'Reusing cached {name}...')
+            metrics.update(rows=table_rows(config, name), bytes=path_bytes(config.path(name)))
+            report.add(metrics)
+        return restored
+
+    def start(name):
+        print(f'Generating {name}...')
+        shutil.rmtree(os.path.dirname(config.part_path(name, 0)), ignore_errors=True)
+        parts = table_partitions(config, name)
+        tasks = []
+        for part in parts:
+            direct = len(parts) == 1 and not config.partitioned(name)
+            path = config.path(name) if direct else config.part_path(name, part.index)
+            tasks.append((config, name, part, path, None, None, report.profile_path(f'generate:{name}', part.index)))
+        return parts, tasks
+
+    states = {}  # table name -> {partition index: random state}
+    partition_metrics = {}  # table name -> [metrics of each finished partition]
+
+    def finish(name, parts):
+        report.add(combine_metrics(f'generate:{name}', partition_metrics.pop(name)))
+        with report.stage(f'write:{name}') as metrics:
+            writer = finish_table(config, name, parts)
+            metrics.update(rows=writer.rows, bytes=path_bytes(config.path(name)))
+        if samples and writer.sample is not None:
+            sample_path = os.path.join(SAMPLE_DIR, f'{name}_sample.csv')
+            with report.stage(f'sample:{name}') as metrics:
+                text_ids(writer.sample, name).to_csv(sample_path, index=False)
+                metrics.update(rows=len(writer.sample), bytes=path_bytes(sample_path))
+        table_states = states.pop(name)
+        if TABLES[name]['append']:
+            save_checkpoint(config, {name: table_states})
+        if name in keys:
+            with report.stage(f'store:{name}') as metrics:
+                store_table(config, name, keys[name], writer.sample, table_states if TABLES[name]['append'] else None)
+                metrics['bytes'] = path_bytes(os.path.join(config.cache_dir, name, keys[name]))
+
+    if workers <= 1:
+        for name in order:
+            if cached(name):
+                continue
+            parts, tasks = start(name)
+            states[name], partition_metrics[name] = {}, []
+            for task in tasks:
+                states[name][task[2].index], metrics = run_partition(*task)
+                partition_metrics[name].append(metrics)
+            finish(name, parts)
+        if own_report:
+            report.save(config)
+        return order
+
+    waiting = list(order)
+    running = {}  # table name -> (parts, {outstanding future: partition index})
+    done = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while waiting or running:
+            for name in list(waiting):
+                if all(dep in done for dep in TABLES[name]['depends'] if dep in order):
+                    waiting.remove(name)
+                    if cached(name):
+                        done.add(name)
+                        continue
+                    parts, tasks = start(name)
+                    running[name] = (parts, {pool.submit(run_partition, *task): task[2].index for task in tasks})
+                    states[name], partition_metrics[name] = {}, []
+            finished, _ = wait([f for _, futures in running.values() for f in futures], return_when=FIRST_COMPLETED)
+            for name, (parts, futures) in list(running.items()):
+                for future in finished & futures.keys():
+                    states[name][futures.pop(future)], metrics = future.result()
+                    partition_metrics[name].append(metrics)
+                if not futures:
+                    del running[name]
+                    finish(name, parts)
+                    done.add(name)
+    if own_report:
+        report.save(config)
+    return order
+
+def append_month(data_dir=DATA_DIR, report=None):
+    """Extend the tables registered with append=True by the month after their last as_of_date.
+
+    Each table's settings and per-partition random state come from the data
+    folder's checkpoint, the panels' walks and rating migrations continue from
+    the rows at the last as_of_date, and only the new month is generated: a
+    new as_of_date folder (hive layout) or new row groups (flat files, rewritten
+    in place). The result matches a full build with one more month.
+    Returns (tables appended, config of the extended dataset). Stage metrics
+    go to `report`, or to the data folder's run_report.json without one.
+    """
+    own_report = report is None
+    report = report or RunReport(data_dir)
+    checkpoint = load_checkpoint(data_dir)
+    names = [name for name in resolve_tables(list(TABLES)) if TABLES[name]['append']]
+    missing = [name for name in names if name not in checkpoint]
+    if missing:
+        raise ValueError(f'No checkpoint for {", ".join(missing)} in {data_dir}; run a full build first')
+    configs = {name: GenerationConfig.from_dict(checkpoint[name]['config'], data_dir) for name in names}
+    last = min(configs.values(), key=lambda config: config.end_date)
+    # Tables a month ahead were appended by an interrupted run (a checkpoint is saved once its table is written)
+    ahead = [name for name in names if configs[name].end_date > last.end_date]
+    if any(configs[name].end_date != last.next_month().end_date for name in ahead):
+        raise ValueError(f'Tables in {data_dir} end on as_of_dates more than a month apart; run a full build')
+
+    for name in names:
+        if name in ahead:
+            config = configs[name]
+            continue
+        spec = TABLES[name]
+        config = configs[name].next_month()
+        print(f'Appending {config.dates[-1]:%Y-%m-%d} to {name}...')
+        month_config = copy.copy(config)
+        month_config.dates = config.dates[-1:]
+        existing_rows = sum(rows for _, _, rows, _ in row_groups(config, name))
+        previous = None  # rows at the last existing as_of_date, for the generators that continue from them
+        if spec['partitions'] is not None:
+            parts = [part for part in table_partitions(config, name) if part.start >= existing_rows]
+        else:
+            parts = table_partitions(config, name) if spec['panel'] else [Partition(0, existing_rows, existing_rows)]
+            previous = read_table(config, name, filters=[('as_of_date', '==', config.as_of_value(config.dates[-2]))]).to_pandas()
+        states, partition_metrics = {}, []
+        for part in parts:
+            state = checkpoint[name]['states'].get(str(part.index))
+            rows = previous.iloc[part.start:part.stop] if spec['panel'] and previous is not None else previous
+            states[part.index], metrics = run_partition(month_config, name, part, config.part_path(name, part.index), state, rows,
+                                                        report.profile_path(f'generate:{name}', part.index))
+            partition_metrics.append(metrics)
+        report.add(combine_metrics(f'generate:{name}', partition_metrics))
+
+        part_paths = [config.part_path(name, part.index) for part in parts]
+        with report.stage(f'write:{name}') as metrics:
+            if config.partitioned(name):
+                with config.open_writer(name) as writer:
+                    merge_partitions(writer, part_paths, panel=spec['panel'])
+            else:
+                # Parquet files cannot be appended to: copy the existing row groups, then add the new month's
+                path = config.path(name)
+                with pq.ParquetFile(path) as existing, ParquetTableWriter(path + '.tmp', **config.writer_options(name)) as writer:
+                    for index in range(existing.num_row_groups):
+                        writer.write(existing.read_row_group(index))
+                    merge_partitions(writer, part_paths, panel=spec['panel'])
+                os.replace(path + '.tmp', path)
+            metrics.update(rows=writer.rows, bytes=path_bytes(config.path(name)))
+        remove_parts(part_paths)
+        save_checkpoint(config, {name: states})
+    if own_report:
+        report.save(config)
+    return names, config
+
+# ==================== ARROW IPC CACHE ====================
+# Optional uncompressed Arrow IPC copy of each table in the data folder's ARROW_DIR. load_table() memory-maps
+# it, so any number of reader processes share one page-cache copy of a table instead of
+# each decompressing the Parquet file into memory of its own.
+
+ARROW_DIR = '_arrow'  # in the data folder, `_`-prefixed so upload.py leaves the copies out
+ARROW_SOURCE = b'fakebank_source'  # schema metadata: parquet_fingerprint() of the output a copy was made from
+
+def arrow_path(config, name):
+    return os.path.join(config.data_dir, ARROW_DIR, f'{name}.arrow')
+
+def parquet_fingerprint(config, name):
+    """[path, size, mtime_ns] of each Parquet file of a table, as JSON bytes, to tell whether its Arrow copy is current."""
+    paths = [path for _, path in hive_files(config.path(name))] if config.partitioned(name) else [config.path(name)]
+    fingerprint = []
+    for path in paths:
+        stat = os.stat(path)
+        fingerprint.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+    return json.dumps(fingerprint).encode()
+
+def open_arrow_table(config, name):
+    """A reader of the table's Arrow copy, memory-mapped, or None if there is none or it is stale."""
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(arrow_path(config, name)))
+    except (OSError, pa.ArrowInvalid):
+        return None  # missing or unreadable
+    if (reader.schema.metadata or {}).get(ARROW_SOURCE) != parquet_fingerprint(config, name):
+        return None
+    return reader
+
+def extend_dictionaries(table, labels):
+    """Re-encode the dictionary columns of a chunk against labels, column -> {value: code} of the values
+    seen in earlier chunks, adding new values at the end.
+
+    compact_table() encodes every chunk on its own, while an IPC file holds one
+    dictionary per column; extended this way each chunk's dictionary is the
+    previous one plus new values, which the file stores as a delta.
+    """
+    for index, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            column = table.column(index).combine_chunks()
+            known = labels.setdefault(field.name, {})
+            codes = pa.array([known.setdefault(value, len(known)) for value in column.dictionary.to_pylist()], field.type.index_type)
+            column = pa.DictionaryArray.from_arrays(pc.take(codes, column.indices), pa.array(list(known), field.type.value_type))
+            table = table.set_column(index, field, column)
+    return table
+
+def write_arrow_table(config, name):
+    """Write the uncompressed Arrow IPC copy of a table, one record batch per Parquet row group; returns its row count."""
+    path = arrow_path(config, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    columns = table_dataset(config, name).schema.names
+    labels = {}
+    chunks = (extend_dictionaries(read_row_group(config, name, group, columns), labels) for group in row_groups(config, name))
+    first = next(chunks, None)
+    if first is None:
+        first = table_dataset(config, name).schema.empty_table()
+    schema = first.schema.with_metadata({**(first.schema.metadata or {}), ARROW_SOURCE: parquet_fingerprint(config, name)})
+    rows = 0
+    with pa.OSFile(path + '.tmp', 'wb') as sink, \
+            pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)) as writer:
+        for table in itertools.chain([first], chunks):
+            writer.write_table(table.replace_schema_metadata(schema.metadata))
+            rows += table.num_rows
+    os.replace(path + '.tmp', path)
+    return rows
+
+def refresh_arrow_cache(config, tables=None, report=None):
+    """Write the Arrow copy of each table (default: all generated ones) whose copy is missing or stale; returns those tables."""
+    report = report or RunReport(config.data_dir)
+    written = []
+    for name in tables or list(TABLES):
+        if not os.path.exists(config.path(name)) or open_arrow_table(config, name) is not None:
+            continue
+        with report.stage(f'arrow:{name}') as metrics:
+            metrics.update(rows=write_arrow_table(config, name), bytes=path_bytes(arrow_path(config, name)))
+        written.append(name)
+    return written
+
+def load_table(config, name, columns=None):
+    """A table as a pyarrow Table, memory-mapped from its Arrow copy if that is current, else read from Parquet.
+
+    A mapped table's buffers are the file's pages in the OS page cache, so
+    loading takes about a millisecond and every process mapping the file
+    shares one copy. to_pandas() copies every column but the strings, which pandas keeps in Arrow.
+    """
+    reader = open_arrow_table(config, name)
+    if reader is None:
+        return read_table(config, name, columns=columns)
+    table = reader.read_all()
+    return table.select(columns) if columns is not None else table
+
+# ==================== PROFILING CHARTS ====================
+# Each profiled table is scanned once into a small aggregate cube (row counts and
+# amount totals by as_of_date and dimension value) plus amount histograms, saved
+# to SUMMARY_DIR for dashboards; every chart renders from those aggregates.
+# matplotlib and seaborn are imported inside the plot functions so that runs
+# without charts never load them.
+
+# Profiled tables: (dimension columns, amount column or None)
+PROFILES = {
+    'customers': (['segment', 'state'], None),
+    'loans': (['credit_rating', 'lgd_rating', 'industry', 'sales_channel', 'product_type'], 'loan_amount'),
+    'loan_applications': (['status', 'product_type'], 'amount_requested'),
+    'write_offs': (['reason'], 'amount_written_off'),
+    'customer_interactions': (['interaction_type'], None),
+    'loan_securities': (['security_type', 'lien_type'], 'security_value'),
+    'liquidity_positions': (['asset_type', 'geography'], 'amount'),
+    'funding_sources': (['source_type'], 'amount'),
+    'market_positions': (['desk', 'instrument'], 'market_value'),
+}
+PROFILE_CUBE = 'profile_cube.parquet'
+PROFILE_HISTOGRAMS = 'profile_histograms.parquet'
+HISTOGRAM_BINS = 30
+# Digest of each rendered chart's inputs, so unchanged charts are not redrawn
+CHART_MANIFEST = '_charts.json'
+
+# Charts: (file name, table, kind, profiled column, options). 'distribution' bars
+# row counts per value, 'histogram' plots an amount column, 'stacked' stacks the
+# amount by as_of_date and value, 'trend' is the amount total by as_of_date.
+CHARTS = [
+    ('customers_segment.png', 'customers', 'distribution', 'segment', {'title': 'Customer Segment Distribution'}),
+    ('customers_state.png', 'customers', 'distribution', 'state', {'title': 'Customer State Distribution'}),
+    ('total_loan_amounts_by_date.png', 'loans', 'trend', 'credit_rating', {'title': 'Total Loan Amounts by As-of-Date'}),
+    ('stacked_loan_amounts_by_industry.png', 'loans', 'stacked', 'industry',
+     {'title': 'Stacked Loan Amounts by Industry and As-of-Date', 'xlabel': 'As-of-Date', 'ylabel': 'Loan Amount', 'figsize': (14, 7), 'rotate_xticks': True}),
+    ('stacked_loan_amounts_by_channel.png', 'loans', 'stacked', 'sales_channel',
+     {'title': 'Stacked Loan Amounts by Sales Channel and As-of-Date', 'xlabel': 'As-of-Date', 'ylabel': 'Loan Amount', 'figsize': (14, 7), 'rotate_xticks': True}),
+    ('loans_credit_rating.png', 'loans', 'distribution', 'credit_rating', {'title': 'Loan Credit Rating Distribution'}),
+    ('loans_lgd_rating.png', 'loans', 'distribution', 'lgd_rating', {'title': 'Loan LGD Rating Distribution'}),
+    ('loans_industry.png', 'loans', 'distribution', 'industry', {'title': 'Loan Industry Distribution'}),
+    ('loans_sales_channel.png', 'loans', 'distribution', 'sales_channel', {'title': 'Loan Sales Channel Distribution'}),
+    ('loans_product_type.png', 'loans', 'distribution', 'product_type', {'title': 'Loan Product Type Distribution'}),
+    ('loans_loan_amount.png', 'loans', 'histogram', 'loan_amount', {'title': 'Loan Amount Distribution'}),
+    ('loans_by_industry_stacked.png', 'loans', 'stacked', 'industry', {}),
+    ('loans_by_channel_stacked.png', 'loans', 'stacked', 'sales_channel', {}),
+    ('loans_by_product_type_stacked.png', 'loans', 'stacked', 'product_type', {}),
+    ('loans_by_credit_rating_stacked.png', 'loans', 'stacked', 'credit_rating', {}),
+    ('loans_by_lgd_rating_stacked.png', 'loans', 'stacked', 'lgd_rating', {}),
+    ('applications_status.png', 'loan_applications', 'distribution', 'status', {'title': 'Loan Application Status Distribution'}),
+    ('applications_product_type.png', 'loan_applications', 'distribution', 'product_type', {'title': 'Loan Application Product Type Distribution'}),
+    ('applications_amount_requested.png', 'loan_applications', 'histogram', 'amount_requested', {'title': 'Loan Application Amount Requested Distribution'}),
+    ('write_offs_reason.png', 'write_offs', 'distribution', 'reason', {'title': 'Write Off Reason Distribution'}),
+    ('write_offs_amount_written_off.png', 'write_offs', 'histogram', 'amount_written_off', {'title': 'Write Off Amount Distribution'}),
+    ('write_offs_by_reason_stacked.png', 'write_offs', 'stacked', 'reason', {}),
+    ('interactions_type.png', 'customer_interactions', 'distribution', 'interaction_type', {'title': 'Customer Interaction Type Distribution'}),
+    ('securities_type.png', 'loan_securities', 'distribution', 'security_type', {'title': 'Loan Security Type Distribution'}),
+    ('securities_lien_type.png', 'loan_securities', 'distribution', 'lien_type', {'title': 'Loan Security Lien Type Distribution'}),
+    ('securities_value.png', 'loan_securities', 'histogram', 'security_value', {'title': 'Loan Security Value Distribution'}),
+    ('securities_by_type_stacked.png', 'loan_securities', 'stacked', 'security_type', {}),
+    ('securities_by_lien_type_stacked.png', 'loan_securities', 'stacked', 'lien_type', {}),
+    ('liquidity_by_asset_type_stacked.png', 'liquidity_positions', 'stacked', 'asset_type', {}),
+    ('liquidity_by_geography_stacked.png', 'liquidity_positions', 'stacked', 'geography', {}),
+    ('funding_by_source_type_stacked.png', 'funding_sources', 'stacked', 'source_type', {}),
+    ('market_by_instrument_stacked.png', 'market_positions', 'stacked', 'instrument', {}),
+    ('market_by_desk_stacked.png', 'market_positions', 'stacked', 'desk', {}),
+]
+
+def column_range(config, name, column):
+    """(min, max) of a numeric column from the Parquet row-group statistics, without reading the data."""
+    low, high, metadata = None, None, {}
+    for path, index, _, _ in row_groups(config, name):
+        if path not in metadata:
+            metadata[path] = pq.ParquetFile(path).metadata
+        group = metadata[path].row_group(index)
+        statistics = group.column(metadata[path].schema.names.index(column)).statistics
+        if statistics is not None and statistics.has_min_max:
+            low = statistics.min if low is None else min(low, statistics.min)
+            high = statistics.max if high is None else max(high, statistics.max)
+    return (0.0, 1.0) if low is None else (low, high)
+
+def profile_table(config, name):
+    """Scan a table once into (cube, histogram) DataFrames, one record batch at a time.
+
+    The cube has the row count and amount total for each as_of_date (None for
+    tables without one), profiled dimension and value; the histogram counts the
+    amount column in HISTOGRAM_BINS equal-width bins.
+    """
+    dimensions, amount = PROFILES[name]
+    dataset = table_dataset(config, name)
+    keys = ['as_of_date'] if 'as_of_date' in dataset.schema.names else []
+    aggregates = [([], 'count_all')] + ([(amount, 'sum')] if amount else [])
+    edges = np.histogram_bin_edges([], HISTOGRAM_BINS, range=column_range(config, name, amount) if amount else (0, 1))
+    counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    partials = []
+    for batch in dataset.to_batches(columns=keys + dimensions + ([amount] if amount else [])):
+        chunk = pa.Table.from_batches([batch])
+        for dimension in dimensions:
+            grouped = chunk.group_by(keys + [dimension]).aggregate(aggregates)
+            partials.append(pa.table({
+                'as_of_date': grouped.column('as_of_date').cast(pa.string()) if keys else pa.nulls(grouped.num_rows, pa.string()),
+                'dimension': pa.array([dimension] * grouped.num_rows, pa.string()),
+                'value': grouped.column(dimension).cast(pa.string()),
+                'rows': grouped.column('count_all'),
+                'total': grouped.column(f'{amount}_sum') if amount else pa.nulls(grouped.num_rows, pa.float64()),
+            }))
+        if amount:
+            counts += np.histogram(chunk.column(amount).to_numpy(), bins=edges)[0]
+    cube = (pa.concat_tables(partials).group_by(['as_of_date', 'dimension', 'value'])
+            .aggregate([('rows', 'sum'), ('total', 'sum')]).to_pandas()
+            .rename(columns={'rows_sum': 'rows', 'total_sum': 'total'}))
+    cube.insert(0, 'table', name)
+    cube = cube.sort_values(['dimension', 'as_of_date', 'value'], ignore_index=True)
+    histogram = pd.DataFrame({'table': name, 'column': amount, 'bin_start': edges[:-1], 'bin_end': edges[1:], 'rows': counts})
+    return cube, histogram.iloc[:0] if amount is None else histogram
+
+def profile_tables(config, tables):
+    """Profile the given tables and save the cube and histograms to SUMMARY_DIR.
+
+    Rows of tables profiled by earlier runs are kept. Returns (cube, histograms).
+    """
+    os.makedirs(SUMMARY_DIR, exist_ok=True)
+    names = [name for name in tables if name in PROFILES]
+    cubes, histograms = [], []
+    for path, frames in ((PROFILE_CUBE, cubes), (PROFILE_HISTOGRAMS, histograms)):
+        if os.path.exists(os.path.join(SUMMARY_DIR, path)):
+            existing = pd.read_parquet(os.path.join(SUMMARY_DIR, path))
+            frames.append(existing[~existing['table'].isin(names)])
+    for name in names:
+        print(f'Profiling {name}...')
+        cube, histogram = profile_table(config, name)
+        cubes.append(cube)
+        histograms.append(histogram)
+    cube = pd.concat(cubes, ignore_index=True)
+    histograms = pd.concat(histograms, ignore_index=True)
+    cube.to_parquet(os.path.join(SUMMARY_DIR, PROFILE_CUBE), index=False)
+    histograms.to_parquet(os.path.join(SUMMARY_DIR, PROFILE_HISTOGRAMS), index=False)
+    return cube, histograms
+
+def plot_distribution(cube, column, filename, title, rotate_xticks=True):
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(12,6))
-    if kind == 'bar':
-        df[col].value_counts().plot(kind='bar')
-    elif kind == 'hist':
-        df[col].plot(kind='hist', bins=30)
+    cube.groupby('value')['rows'].sum().sort_values(ascending=False).rename_axis(column).plot(kind='bar')
     plt.title(title)
     if rotate_xticks:
         plt.xticks(rotation=45)
     plt.tight_layout()
-    plt.savefig(os.path.join(summary_dir, filename))
+    plt.savefig(os.path.join(SUMMARY_DIR, filename))
     plt.close()
 
-# Customers profiling
-plot_and_save(customers_df, 'segment', 'Customer Segment Distribution', 'customers_segment.png')
-plot_and_save(customers_df, 'state', 'Customer State Distribution', 'customers_state.png')
+def plot_histogram(histogram, column, filename, title):
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(12,6))
+    edges = np.append(histogram['bin_start'].to_numpy(), histogram['bin_end'].iloc[-1])
+    plt.hist(histogram['bin_start'], bins=edges, weights=histogram['rows'])
+    plt.ylabel('Frequency')
+    plt.title(title)
+    plt.tight_layout()
+    plt.savefig(os.path.join(SUMMARY_DIR, filename))
+    plt.close()
 
-# Loans profiling
-plot_and_save(loans_df, 'credit_rating', 'Loan Credit Rating Distribution', 'loans_credit_rating.png')
-plot_and_save(loans_df, 'lgd_rating', 'Loan LGD Rating Distribution', 'loans_lgd_rating.png')
-plot_and_save(loans_df, 'industry', 'Loan Industry Distribution', 'loans_industry.png')
-plot_and_save(loans_df, 'sales_channel', 'Loan Sales Channel Distribution', 'loans_sales_channel.png')
-plot_and_save(loans_df, 'product_type', 'Loan Product Type Distribution', 'loans_product_type.png')
-plot_and_save(loans_df, 'loan_amount', 'Loan Amount Distribution', 'loans_loan_amount.png', kind='hist', rotate_xticks=False)
+def plot_stacked_by_dimension(cube, value_col, dimension_col, filename, title=None, xlabel='as_of_date', ylabel=None,
+                              figsize=(12, 6), rotate_xticks=False):
+    import matplotlib.pyplot as plt
+    if cube['as_of_date'].isna().all():
+        return
+    pivot = cube.pivot_table(index='as_of_date', columns='value', values='total', aggfunc='sum', fill_value=0)
+    pivot.columns.name = dimension_col
+    pivot.plot(kind='bar', stacked=True, figsize=figsize)
+    plt.title(title or f"{value_col} by {dimension_col} and as_of_date")
+    plt.ylabel(ylabel or value_col)
+    plt.xlabel(xlabel)
+    if rotate_xticks:
+        plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig(os.path.join(SUMMARY_DIR, filename))
+    plt.close()
 
-# Loan Applications profiling
-plot_and_save(applications_df, 'status', 'Loan Application Status Distribution', 'applications_status.png')
-plot_and_save(applications_df, 'product_type', 'Loan Application Product Type Distribution', 'applications_product_type.png')
-plot_and_save(applications_df, 'amount_requested', 'Loan Application Amount Requested Distribution', 'applications_amount_requested.png', kind='hist', rotate_xticks=False)
+def plot_trend(cube, value_col, filename, title):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    totals = cube.groupby('as_of_date')['total'].sum().rename(value_col).reset_index()
+    plt.figure(figsize=(12,6))
+    sns.lineplot(data=totals, x='as_of_date', y=value_col)
+    plt.title(title)
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig(os.path.join(SUMMARY_DIR, filename))
+    plt.close()
 
-# Write Offs profiling
-plot_and_save(write_offs_df, 'reason', 'Write Off Reason Distribution', 'write_offs_reason.png')
-plot_and_save(write_offs_df, 'amount_written_off', 'Write Off Amount Distribution', 'write_offs_amount_written_off.png', kind='hist', rotate_xticks=False)
+def chart_inputs(cube, histograms, name, kind, column):
+    """The aggregate rows a CHARTS entry is drawn from."""
+    if kind == 'histogram':
+        return histograms[(histograms['table'] == name) & (histograms['column'] == column)].reset_index(drop=True)
+    return cube[(cube['table'] == name) & (cube['dimension'] == column)].reset_index(drop=True)
 
-# Customer Interactions profiling
-plot_and_save(interactions_df, 'interaction_type', 'Customer Interaction Type Distribution', 'interactions_type.png')
+def chart_digest(rows, chart):
+    """Hash of a chart's input rows, its CHARTS entry and the plotting code."""
+    hasher = hashlib.sha256(code_digest(render_chart).encode())
+    hasher.update(repr(chart).encode())
+    hasher.update(repr(list(rows.columns)).encode())
+    hasher.update(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes())
+    return hasher.hexdigest()
 
-# Loan Securities profiling
-plot_and_save(securities_df, 'security_type', 'Loan Security Type Distribution', 'securities_type.png')
-plot_and_save(securities_df, 'lien_type', 'Loan Security Lien Type Distribution', 'securities_lien_type.png')
-plot_and_save(securities_df, 'security_value', 'Loan Security Value Distribution', 'securities_value.png', kind='hist', rotate_xticks=False)
+def use_headless_backend():
+    """Chart worker initializer: draw with the non-interactive Agg backend."""
+    import matplotlib
+    matplotlib.use('Agg')
 
-print('Sample data and summary charts generated.')
-print('Profiling charts for all tables generated.')
+def render_chart(rows, filename, name, kind, column, options):
+    """Draw one CHARTS entry from its chart_inputs() rows (runs in worker processes)."""
+    amount = PROFILES[name][1]
+    if kind == 'histogram':
+        plot_histogram(rows, column, filename, **options)
+    elif kind == 'distribution':
+        plot_distribution(rows, column, filename, **options)
+    elif kind == 'stacked':
+        plot_stacked_by_dimension(rows, amount, column, filename, **options)
+    else:
+        plot_trend(rows, amount, filename, **options)
+    return filename
+
+def render_charts(tables, config, workers=1, report=None):
+    """Profile the given tables (see profile_tables) and render their summary/ charts from the aggregates.
+
+    Each chart's digest (see chart_digest) is recorded in SUMMARY_DIR's
+    CHART_MANIFEST, and only charts whose digest changed or whose PNG is
+    missing are drawn, in a pool of `workers` processes. The profile and
+    charts stages are added to `report` (see RunReport), if given.
+    Returns the number of charts drawn.
+    """
+    report = report or RunReport(config.data_dir)
+    with report.stage('profile') as metrics:
+        cube, histograms = profile_tables(config, tables)
+        metrics.update(rows=sum(table_rows(config, name) for name in tables if name in PROFILES),
+                       bytes=path_bytes(os.path.join(SUMMARY_DIR, PROFILE_CUBE)) + path_bytes(os.path.join(SUMMARY_DIR, PROFILE_HISTOGRAMS)))
+    manifest_path = os.path.join(SUMMARY_DIR, CHART_MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    jobs = []
+    for chart in CHARTS:
+        filename, name, kind, column, options = chart
+        if name not in tables:
+            continue
+        rows = chart_inputs(cube, histograms, name, kind, column)
+        digest = chart_digest(rows, chart)
+        if manifest.get(filename) != digest or not os.path.exists(os.path.join(SUMMARY_DIR, filename)):
+            jobs.append((digest, (rows, *chart)))
+    print(f'Rendering {len(jobs)} charts ({sum(name in tables for _, name, *_ in CHARTS) - len(jobs)} unchanged)...')
+    # With workers > 1 the drawing happens in the pool, so cpu_seconds and RSS are only this process's
+    with report.stage('charts') as metrics:
+        if workers <= 1 or len(jobs) <= 1:
+            for digest, job in jobs:
+                manifest[render_chart(*job)] = digest
+        elif jobs:
+            with ProcessPoolExecutor(max_workers=workers, initializer=use_headless_backend) as pool:
+                for (digest, _), filename in zip(jobs, pool.map(render_chart, *zip(*(job for _, job in jobs)))):
+                    manifest[filename] = digest
+        metrics.update(charts=len(jobs), bytes=sum(path_bytes(os.path.join(SUMMARY_DIR, job[1])) for _, job in jobs))
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return len(jobs)
+
+# ==================== KPI MART ====================
+# Monthly risk KPIs precomputed from the panels into small tables in the data folder's
+# MART_DIR (config.mart_dir), one per MARTS entry, for dashboards and query agents (see kpi_lookup)
+
+MART_MANIFEST = '_mart.json'
+MART_ALL = 'All'  # dimension value of the rows totalled over that dimension
+
+def month_fingerprints(config, name):
+    """{'YYYY-MM-DD': digest} of a table's rows per as_of_date, from the Parquet footers alone.
+
+    A month's digest covers the row counts, column sizes and statistics of the
+    row groups holding it; a row group spanning several months counts towards each.
+    """
+    months = [date.strftime('%Y-%m-%d') for date in config.dates]
+    files = hive_files(config.path(name)) if config.partitioned(name) else [(None, config.path(name))]
+    hashers = {}
+    for value, path in files:
+        metadata = pq.ParquetFile(path).metadata
+        for index in range(metadata.num_row_groups):
+            group = metadata.row_group(index)
+            columns = [group.column(i) for i in range(group.num_columns)]
+            first = last = value
+            if value is None:
+                stats = next(column.statistics for column in columns if column.path_in_schema == 'as_of_date')
+                first, last = (str(stats.min), str(stats.max)) if stats is not None and stats.has_min_max else (months[0], months[-1])
+            digest = repr((group.num_rows, [(column.path_in_schema, column.total_compressed_size,
+                                             column.statistics.to_dict() if column.statistics is not None else None)
+                                            for column in columns])).encode()
+            for month in months:
+                if first <= month <= last:
+                    hashers.setdefault(month, hashlib.sha256()).update(digest)
+    return {month: hasher.hexdigest() for month, hasher in hashers.items()}
+
+def read_month(config, name, month, columns):
+    """One as_of_date ('YYYY-MM-DD') of a table as a DataFrame."""
+    value = config.as_of_value(datetime.strptime(month, '%Y-%m-%d'))
+    return read_table(config, name, columns=columns, filters=[('as_of_date', '==', value)]).to_pandas()
+
+def rollup(df, dimensions, measures):
+    """Sums of the measures for every combination of dimensions, with MART_ALL rows totalling over each dimension."""
+    groups = []
+    for kept in itertools.product((True, False), repeat=len(dimensions)):
+        keys = [dimension for dimension, keep in zip(dimensions, kept) if keep]
+        if keys:
+            group = df.groupby(keys, observed=True)[measures].sum().reset_index()
+        else:
+            group = df[measures].sum().to_frame().T.astype(df[measures].dtypes.to_dict())
+        for dimension, keep in zip(dimensions, kept):
+            group[dimension] = group[dimension].astype(str) if keep else MART_ALL
+        groups.append(group[dimensions + measures])
+    return pd.concat(groups, ignore_index=True)
+
+def credit_kpis(config, month, months):
+    """Loan book sums with CAR, arrears ratio and provision coverage (provisions / loan_amount) by geography and product_type."""
+    loans = read_month(config, 'loans', month, ['geography', 'product_type', 'loan_amount', 'ead', 'rwa', 'capital',
+                                                 'provisions', 'arrears'])
+    loans['loans'] = 1
+    kpis = rollup(loans, ['geography', 'product_type'], ['loans', 'loan_amount', 'ead', 'rwa', 'capital', 'provisions', 'arrears'])
+    kpis['car'] = kpis['capital'] / kpis['rwa']
+    kpis['arrears_ratio'] = kpis['arrears'] / kpis['loan_amount']
+    kpis['provision_coverage'] = kpis['provisions'] / kpis['loan_amount']
+    return kpis
+
+def rating_migrations(config, month, months):
+    """Credit rating migration matrix from the previous as_of_date: loans, exposure and share of each from_rating.
+
+    Empty for the first month.
+    """
+    index = months.index(month)
+    if index == 0:
+        return pd.DataFrame({'from_rating': pd.Series(dtype=str), 'to_rating': pd.Series(dtype=str),
+                             'loans': pd.Series(dtype='int64'), 'loan_amount': pd.Series(dtype=float),
+                             'share': pd.Series(dtype=float)})
+    before = read_month(config, 'loans', months[index - 1], ['loan_id', 'credit_rating'])
+    after = read_month(config, 'loans', month, ['loan_id', 'credit_rating', 'loan_amount'])
+    moves = after.merge(before, on='loan_id', suffixes=('', '_before'))
+    moves = moves.assign(from_rating=moves['credit_rating_before'].astype(str), to_rating=moves['credit_rating'].astype(str), loans=1)
+    matrix = moves.groupby(['from_rating', 'to_rating'])[['loans', 'loan_amount']].sum().reset_index()
+    matrix['share'] = matrix['loans'] / matrix.groupby('from_rating')['loans'].transform('sum')
+    return matrix
+
+def liquidity_kpis(config, month, months, lcr, nsfr):
+    """LCR, NSFR and cash flows, with breach flags below the lcr and nsfr minimums (%)."""
+    kpis = read_month(config, 'liquidity_metrics', month, ['LCR', 'NSFR', 'cash_inflows', 'cash_outflows'])
+    kpis = kpis.rename(columns={'LCR': 'lcr', 'NSFR': 'nsfr'})
+    kpis['net_cash_flow'] = kpis['cash_inflows'] - kpis['cash_outflows']
+    kpis['lcr_breach'] = kpis['lcr'] < lcr
+    kpis['nsfr_breach'] = kpis['nsfr'] < nsfr
+    return kpis
+
+def funding_concentration(config, month, months):
+    """Funding by source_type: amount, share of total funding, amount-weighted cost and the largest single source's share."""
+    funding = read_month(config, 'funding_sources', month, ['source_type', 'amount', 'cost'])
+    funding['sources'] = 1
+    funding['cost_amount'] = funding['amount'] * funding['cost']
+    kpis = rollup(funding, ['source_type'], ['sources', 'amount', 'cost_amount'])
+    largest = funding.groupby(funding['source_type'].astype(str))['amount'].max()
+    kpis['largest_amount'] = kpis['source_type'].map(largest).fillna(funding['amount'].max())
+    total = funding['amount'].sum()
+    kpis['share'] = kpis['amount'] / total
+    kpis['largest_source_share'] = kpis['largest_amount'] / total
+    kpis['weighted_cost'] = kpis['cost_amount'] / kpis['amount']
+    return kpis.drop(columns=['cost_amount', 'largest_amount'])
+
+def desk_var(config, month, months):
+    """market_risk_metrics joined to market_positions, summed by desk and instrument (VaR sums are undiversified)."""
+    positions = read_month(config, 'market_positions', month, ['position_id', 'desk', 'instrument', 'notional', 'market_value'])
+    metrics = read_month(config, 'market_risk_metrics', month, ['position_id', 'VaR', 'SVaR', 'expected_shortfall'])
+    joined = positions.merge(metrics, on='position_id').rename(columns={'VaR': 'var', 'SVaR': 'svar'})
+    joined['positions'] = 1
+    kpis = rollup(joined, ['desk', 'instrument'], ['positions', 'notional', 'market_value', 'var', 'svar', 'expected_shortfall'])
+    kpis['var_to_market_value'] = kpis['var'] / kpis['market_value']
+    return kpis
+
+# Mart table -> (source tables, function(config, month, months, **thresholds) returning the month's rows,
+# earlier months it also reads, limits whose hard thresholds it is passed as keyword arguments)
+MARTS = {
+    'credit_kpis': (('loans',), credit_kpis, 0, ()),
+    'rating_migrations': (('loans',), rating_migrations, 1, ()),
+    'liquidity_kpis': (('liquidity_metrics',), liquidity_kpis, 0, ('lcr', 'nsfr')),
+    'funding_concentration': (('funding_sources',), funding_concentration, 0, ()),
+    'desk_var': (('market_positions', 'market_risk_metrics'), desk_var, 0, ()),
+}
+
+def refresh_mart(config, report=None, limits=None):
+    """Bring the config.mart_dir tables up to date with the data in config.data_dir; returns {mart: months recomputed}.
+
+    Each month's rows are recomputed only when the month's digest changes:
+    the month_fingerprints() of its source tables (and of the earlier months
+    it reads) plus the code_digest() of its function and the thresholds it
+    is passed, as recorded in MART_MANIFEST. Thresholds are the hard ones of
+    `limits` (see load_limits; default: LIMITS_FILE if it exists), NaN for
+    limits it does not set, which flag no breach. Months no longer in config.dates are dropped, and marts whose
+    source tables are missing are skipped.
+    """
+    report = report or RunReport(config.data_dir)
+    if limits is None:
+        limits = load_limits() if os.path.exists(LIMITS_FILE) else {}
+    os.makedirs(config.mart_dir, exist_ok=True)
+    manifest_path = os.path.join(config.mart_dir, MART_MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    months = [date.strftime('%Y-%m-%d') for date in config.dates]
+    fingerprints, refreshed = {}, {}
+    with report.stage('mart') as metrics:
+        for name, (sources, compute, lookback, thresholds) in MARTS.items():
+            if not all(os.path.exists(config.path(source)) for source in sources):
+                continue
+            for source in sources:
+                if source not in fingerprints:
+                    fingerprints[source] = month_fingerprints(config, source)
+            thresholds = {limit: limits[limit]['hard'] if limit in limits else float('nan') for limit in thresholds}
+            code = code_digest(compute) + repr(sorted(thresholds.items()))
+            digests = {}
+            for index, month in enumerate(months):
+                hasher = hashlib.sha256(code.encode())
+                for source, earlier in itertools.product(sources, months[max(0, index - lookback):index + 1]):
+                    hasher.update(fingerprints[source].get(earlier, '').encode())
+                digests[month] = hasher.hexdigest()[:20]
+            path = os.path.join(config.mart_dir, f'{name}.parquet')
+            recorded = manifest.get(name, {}) if os.path.exists(path) else {}
+            stale = [month for month in months if recorded.get(month) != digests[month]]
+            if not stale and set(recorded) == set(months):
+                continue
+            print(f'Refreshing {name} ({len(stale)} of {len(months)} months)...')
+            frames = []
+            if recorded:
+                existing = pd.read_parquet(path)
+                frames.append(existing[existing['as_of_date'].isin(set(months) - set(stale))])
+            for month in stale:
+                frame = compute(config, month, months, **thresholds)
+                frame.insert(0, 'as_of_date', month)
+                frames.append(frame)
+            mart = pd.concat(frames, ignore_index=True).sort_values('as_of_date', kind='stable', ignore_index=True)
+            mart.to_parquet(path, index=False)
+            manifest[name] = digests
+            refreshed[name] = len(stale)
+        metrics.update(months=sum(refreshed.values()), bytes=path_bytes(config.mart_dir))
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return refreshed
+
+def kpi_lookup(mart, as_of_date=None, data_dir=DATA_DIR, **dimensions):
+    """Rows of a data folder's KPI mart table, optionally for one as_of_date (date or 'YYYY-MM-DD') and dimension values.
+
+    A dimension's MART_ALL rows total over it, e.g. the bank-wide CAR at the last month-end:
+    kpi_lookup('credit_kpis', '2025-09-30', geography=MART_ALL, product_type=MART_ALL)['car']
+    """
+    if mart not in MARTS:
+        raise ValueError(f'Unknown KPI mart table {mart!r}; expected one of {", ".join(MARTS)}')
+    filters = []
+    if as_of_date is not None:
+        filters.append(('as_of_date', '==', as_of_date if isinstance(as_of_date, str) else as_of_date.strftime('%Y-%m-%d')))
+    filters.extend((column, '==', value) for column, value in dimensions.items())
+    return pd.read_parquet(os.path.join(data_dir, MART_DIR, f'{mart}.parquet'), filters=filters or None)
+
+# ==================== INTERACTION INDEX ====================
+# customer_interactions re-sorted by (customer_id, interaction_date) into a memory-mapped
+# Arrow file in the mart folder, with per-customer row ranges and an inverted index of the
+# interaction_text tokens, for "latest interactions of customer X" and keyword filters
+
+INTERACTIONS_SORTED = 'interactions_by_customer.arrow'
+INTERACTIONS_INDEX = 'interactions_index'  # folder of .npy arrays, memory-mapped when read
+INTERACTIONS_MANIFEST = '_interactions.json'
+INTERACTIONS_BATCH_ROWS = 65_536  # rows per record batch of the sorted file
+TOKEN_PATTERN = r'[^\pL\pN]+'  # interaction_text is lower-cased and split on runs of non-letters/digits
+
+def row_group_digests(config, name):
+    """A digest per row_groups() entry of a table, from its Parquet footer (row count, column sizes and statistics)."""
+    digests = []
+    for path, index, rows, value in row_groups(config, name):
+        group = pq.ParquetFile(path).metadata.row_group(index)
+        columns = [group.column(i) for i in range(group.num_columns)]
+        digest = repr((value, rows, [(column.path_in_schema, column.total_compressed_size,
+                                      column.statistics.to_dict() if column.statistics is not None else None)
+                                     for column in columns]))
+        digests.append(hashlib.sha256(digest.encode()).hexdigest()[:20])
+    return digests
+
+def interaction_tokens(text):
+    """Words of a text column as (terms, term, row): its distinct lower-cased words and, for every
+    occurrence of one, its index in terms and the row it came from."""
+    words = pc.split_pattern_regex(pc.utf8_lower(pc.fill_null(text, '')), TOKEN_PATTERN)
+    rows = pc.list_parent_indices(words).to_numpy()
+    encoded = pc.list_flatten(words).dictionary_encode()
+    terms, term = encoded.dictionary.to_pylist(), encoded.indices.to_numpy()
+    if '' in terms:  # the split leaves '' before a leading and after a trailing separator
+        empty = terms.index('')
+        del terms[empty]
+        keep = term != empty
+        term, rows = term[keep], rows[keep]
+        term -= term > empty
+    return terms, term, rows
+
+def batch_starts(batches):
+    """First row of each record batch of a table, followed by its row count."""
+    return np.cumsum([0] + [batch.num_rows for batch in batches])
+
+def take_rows(batches, starts, rows, schema):
+    """Rows of a table held as record batches, in the order given (see batch_starts for starts).
+
+    Table.take() would first concatenate every chunk of a chunked table; this
+    takes from each batch holding one of the rows instead.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    batch = np.searchsorted(starts, rows, side='right') - 1
+    order = np.argsort(batch, kind='stable')
+    ids, first = np.unique(batch[order], return_index=True)
+    local = np.split(rows[order] - starts[batch[order]], first[1:]) if len(rows) else []
+    taken = pa.Table.from_batches([batches[b].take(pa.array(indices)) for b, indices in zip(ids, local)], schema=schema)
+    return taken.combine_chunks().take(pa.array(np.argsort(order)))
+
+def sorted_unique(values):
+    """values sorted in place, without repeats (np.unique hashes and is far slower on large int64 arrays)."""
+    values.sort()
+    return values[np.concatenate(([True], values[1:] != values[:-1]))] if len(values) else values
+
+def merge_sorted(a, b):
+    """The merge of two sorted arrays, without re-sorting either."""
+    merged = np.empty(len(a) + len(b), dtype=np.result_type(a, b))
+    slots = np.searchsorted(a, b) + np.arange(len(b))
+    from_a = np.ones(len(merged), dtype=bool)
+    from_a[slots] = False
+    merged[slots] = b
+    merged[from_a] = a
+    return merged
+
+def refresh_interaction_index(config, report=None):
+    """Bring the config.mart_dir interaction index up to date with customer_interactions; returns the rows newly indexed.
+
+    The table's row groups are fingerprinted (row_group_digests); when the
+    indexed ones are still its leading row groups only the row groups added
+    since are read and tokenized, one at a time, and merged into the existing
+    index. Any other change rebuilds it. Writes:
+      INTERACTIONS_SORTED  the rows sorted by (customer_id, interaction_date), ids as integers
+      INTERACTIONS_INDEX   customer_offsets: customer c's rows are [offsets[c], offsets[c + 1])
+                           vocabulary, token_offsets, postings: the sorted rows containing
+                           vocabulary[t] are postings[token_offsets[t]:token_offsets[t + 1]]
+    Token codes are positions in the vocabulary, which only grows at the end,
+    so the existing postings stay in (code, row) order and the new ones are
+    merged in rather than everything being re-sorted.
+    """
+    name = 'customer_interactions'
+    report = report or RunReport(config.data_dir)
+    if not os.path.exists(config.path(name)):
+        return 0
+    manifest_path = os.path.join(config.mart_dir, INTERACTIONS_MANIFEST)
+    sorted_path, index_dir = os.path.join(config.mart_dir, INTERACTIONS_SORTED), os.path.join(config.mart_dir, INTERACTIONS_INDEX)
+    manifest = {}
+    if os.path.exists(manifest_path) and os.path.exists(sorted_path) and os.path.isdir(index_dir):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    digests, code = row_group_digests(config, name), code_digest(refresh_interaction_index)
+    indexed = manifest.get('row_groups', [])
+    if manifest.get('code') != code or digests[:len(indexed)] != indexed:
+        indexed = []
+    if indexed == digests:
+        return 0
+    groups = row_groups(config, name)[len(indexed):]
+    print(f'Indexing customer_interactions ({len(groups)} of {len(digests)} row groups)...')
+    with report.stage('interactions') as metrics:
+        columns = ['customer_id', 'interaction_date', 'interaction_id', 'interaction_type', 'agent_id', 'interaction_text']
+        tables = []
+        for group in groups:
+            table = compact_table(read_row_group(config, name, group, columns), name)
+            tables.append(table.set_column(3, 'interaction_type', table.column('interaction_type').cast(pa.string())))
+        new = pa.concat_tables(tables)
+        vocabulary, old_keys = [], np.array([], dtype=np.int64)
+        old = None
+        if indexed:
+            old = pa.ipc.open_file(pa.memory_map(sorted_path)).read_all()
+            new = new.cast(old.schema)
+            vocabulary = np.load(os.path.join(index_dir, 'vocabulary.npy')).tolist()
+            token_offsets = np.load(os.path.join(index_dir, 'token_offsets.npy'))
+            postings = np.load(os.path.join(index_dir, 'postings.npy'), mmap_mode='r')
+        source = pa.concat_tables([old, new]) if old is not None else new
+        # Merged order: stable, so rows with equal keys keep their order in the table
+        order = np.lexsort((source.column('interaction_date').cast(pa.int64()).to_numpy(),
+                            source.column('customer_id').to_numpy()))
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        if old is not None:
+            # Existing postings keep their codes and order; only their rows move
+            old_keys = np.repeat(np.arange(len(vocabulary), dtype=np.int64), np.diff(token_offsets)) << 32
+            old_keys |= position[postings]
+
+        # Tokens of the new rows only, one row group at a time, as sorted (code << 32 | row) keys
+        codes = {term: code for code, term in enumerate(vocabulary)}
+        keys, offset = [], source.num_rows - new.num_rows
+        for table in tables:
+            terms, term, rows = interaction_tokens(table.column('interaction_text').combine_chunks())
+            term_codes = np.array([codes.setdefault(term, len(codes)) for term in terms], dtype=np.int64)
+            keys.append(sorted_unique(term_codes[term] << 32 | position[offset + rows]))
+            offset += table.num_rows
+        new_keys = np.concatenate(keys) if keys else np.array([], dtype=np.int64)
+        del keys, tables
+        new_keys.sort()  # row groups hold different rows, so their keys never repeat each other's
+        merged = merge_sorted(old_keys, new_keys) if len(old_keys) else new_keys
+        del old_keys, new_keys
+        vocabulary = np.array(list(codes), dtype=str)
+        token_offsets = np.searchsorted(merged, np.arange(len(vocabulary) + 1, dtype=np.int64) << 32)
+        merged &= 0xFFFFFFFF
+        postings = merged.astype(np.int32)
+        del merged
+        customers = source.column('customer_id').to_numpy()[order]
+        customer_offsets = np.searchsorted(customers, np.arange((customers.max() if len(customers) else 0) + 2))
+
+        os.makedirs(config.mart_dir, exist_ok=True)
+        batches = source.to_batches()
+        starts = batch_starts(batches)
+        with pa.OSFile(sorted_path + '.tmp', 'wb') as sink, pa.ipc.new_file(sink, source.schema) as writer:
+            for start in range(0, len(order), INTERACTIONS_BATCH_ROWS):
+                writer.write_table(take_rows(batches, starts, order[start:start + INTERACTIONS_BATCH_ROWS], source.schema))
+        os.makedirs(index_dir + '.tmp', exist_ok=True)
+        for array_name, values in (('customer_offsets', customer_offsets), ('vocabulary', vocabulary),
+                                   ('token_offsets', token_offsets), ('postings', postings)):
+            np.save(os.path.join(index_dir + '.tmp', f'{array_name}.npy'), values)
+        rows, new_rows = source.num_rows, new.num_rows
+        del old, source, new, batches, postings  # release the memory maps before replacing their files
+        os.replace(sorted_path + '.tmp', sorted_path)
+        shutil.rmtree(index_dir, ignore_errors=True)
+        os.replace(index_dir + '.tmp', index_dir)
+        with open(manifest_path, 'w') as f:
+            json.dump({'code': code, 'rows': rows, 'row_groups': digests}, f, indent=1)
+        metrics.update(rows=rows, new_rows=new_rows, terms=len(vocabulary), bytes=path_bytes(sorted_path) + path_bytes(index_dir))
+    return new_rows
+
+class InteractionIndex:
+    """Read side of refresh_interaction_index(): the sorted interactions and index arrays, memory-mapped.
+
+    latest() slices one customer's row range and search() intersects token
+    postings, so neither scans the table. Results are DataFrames with text ids.
+    """
+
+    def __init__(self, data_dir=DATA_DIR):
+        mart_dir = os.path.join(data_dir, MART_DIR)
+        self.table = pa.ipc.open_file(pa.memory_map(os.path.join(mart_dir, INTERACTIONS_SORTED))).read_all()
+        self.batches = self.table.to_batches()
+        self.starts = batch_starts(self.batches)
+        index_dir = os.path.join(mart_dir, INTERACTIONS_INDEX)
+        self.customer_offsets = np.load(os.path.join(index_dir, 'customer_offsets.npy'), mmap_mode='r')
+        self.token_offsets = np.load(os.path.join(index_dir, 'token_offsets.npy'), mmap_mode='r')
+        self.postings = np.load(os.path.join(index_dir, 'postings.npy'), mmap_mode='r')
+        self.codes = {term: code for code, term in enumerate(np.load(os.path.join(index_dir, 'vocabulary.npy')).tolist())}
+
+    def customer_rows(self, customer_id):
+        """[start, stop) of a customer's rows ('CUST00042' or 42), oldest first."""
+        if isinstance(customer_id, str):
+            customer_id = int(customer_id[len(TABLES['customers']['ids']['customer_id'][0]):])
+        if not 0 <= customer_id < len(self.customer_offsets) - 1:
+            return 0, 0
+        return int(self.customer_offsets[customer_id]), int(self.customer_offsets[customer_id + 1])
+
+    def token_rows(self, token):
+        """Sorted rows whose interaction_text contains a token (case-insensitive)."""
+        code = self.codes.get(token.lower())
+        if code is None:
+            return np.array([], dtype=np.int32)
+        return self.postings[self.token_offsets[code]:self.token_offsets[code + 1]]
+
+    def rows(self, rows):
+        return text_ids(take_rows(self.batches, self.starts, rows, self.table.schema).to_pandas(), 'customer_interactions')
+
+    def latest(self, customer_id, n=10):
+        """A customer's n most recent interactions, newest first."""
+        start, stop = self.customer_rows(customer_id)
+        return self.rows(np.arange(stop - 1, max(start, stop - n) - 1, -1))
+
+    def search(self, *keywords, customer_ids=None, limit=None):
+        """Interactions whose text contains every keyword, optionally only those of some customers,
+        by customer and then date; at most `limit` of them."""
+        rows = None
+        for keyword in sorted(keywords, key=lambda keyword: len(self.token_rows(keyword))):
+            found = self.token_rows(keyword)
+            rows = found if rows is None else rows[np.isin(rows, found, assume_unique=True)]
+        if customer_ids is not None:
+            ranges = [self.customer_rows(customer_id) for customer_id in customer_ids]
+            within = np.concatenate([np.arange(start, stop) for start, stop in ranges] + [np.array([], dtype=np.int64)])
+            rows = within if rows is None else rows[np.isin(rows, within)]
+        if rows is None:
+            rows = np.arange(self.table.num_rows)
+        return self.rows(np.asarray(rows[:limit]))
+
+_INTERACTION_INDEXES = {}
+
+def interaction_index(data_dir=DATA_DIR):
+    """The InteractionIndex of a data folder, kept open until refresh_interaction_index() rewrites it."""
+    stamp = os.stat(os.path.join(data_dir, MART_DIR, INTERACTIONS_MANIFEST)).st_mtime_ns
+    cached = _INTERACTION_INDEXES.get(data_dir)
+    if cached is None or cached[0] != stamp:
+        cached = _INTERACTION_INDEXES[data_dir] = (stamp, InteractionIndex(data_dir))
+    return cached[1]
+
+# ==================== RISK APPETITE LIMITS ====================
+# Risk Appetite Statement limits evaluated for every as_of_date. Thresholds come from LIMITS_FILE:
+# limit name -> {'bound': 'max' or 'min', 'soft': threshold or null, 'hard': threshold, 'source': policy}
+
+LIMITS_FILE = 'risk_appetite.json'
+LIMIT_BREACHES = 'limit_breaches.parquet'  # in config.mart_dir
+
+def load_limits(path=LIMITS_FILE):
+    """Read and check a limits file."""
+    with open(path) as f:
+        limits = json.load(f)
+    for name, limit in limits.items():
+        if name not in LIMIT_SOURCES:
+            raise ValueError(f'Unknown limit {name!r} in {path}; expected one of {", ".join(LIMIT_SOURCES)}')
+        if limit.get('bound') not in ('max', 'min') or limit.get('hard') is None:
+            raise ValueError(f'Limit {name!r} in {path} needs a bound of "max" or "min" and a hard threshold')
+    return limits
+
+def scan_compact(config, name, columns, filter=None):
+    """A table's columns one record batch at a time, in the compact schema (see compact_table) whatever it was written in."""
+    for batch in table_dataset(config, name).to_batches(columns=columns, filter=filter):
+        yield compact_table(pa.Table.from_batches([batch]), name)
+
+def month_index(table, config):
+    """Position in config.dates of each row's as_of_date."""
+    days = table.column('as_of_date').cast(pa.int32()).to_numpy()
+    return np.searchsorted(np.array([date.date() for date in config.dates], dtype='datetime64[D]').astype(np.int64), days)
+
+def dictionary_codes(table, column, labels):
+    """Position in labels of each value of a dictionary-encoded column."""
+    values = table.column(column).combine_chunks()
+    positions = pc.index_in(values.dictionary, value_set=pa.array(labels)).to_numpy(zero_copy_only=False)
+    return positions[values.indices.to_numpy()]
+
+def group_sums(keys, weights, groups):
+    """Sums of weights by integer group key, for keys in range(groups)."""
+    return np.bincount(keys, weights, minlength=groups)
+
+def credit_limit_metrics(config):
+    """Credit limits from one scan of loans, grouped by (month, customer), (month, industry) and (month, geography)."""
+    months, customers = len(config.dates), config.rows['customers'] + 1
+    customer_ead = np.zeros(months * customers)
+    industries = INDUSTRIES + ['']  # retail customers have no industry; their EAD counts towards the total only
+    industry_ead = np.zeros(months * len(industries))
+    geography_ead = np.zeros(months * len(STATES))
+    totals = {column: np.zeros(months) for column in ('ead', 'capital', 'rwa', 'provisions', 'loan_amount')}
+    for table in scan_compact(config, 'loans', ['as_of_date', 'customer_id', 'industry', 'geography', *totals]):
+        month = month_index(table, config)
+        ead = table.column('ead').to_numpy()
+        customer_ead += group_sums(month * customers + table.column('customer_id').to_numpy(), ead, months * customers)
+        industry_ead += group_sums(month * len(industries) + dictionary_codes(table, 'industry', industries), ead, industry_ead.size)
+        geography_ead += group_sums(month * len(STATES) + dictionary_codes(table, 'geography', STATES), ead, geography_ead.size)
+        for column, total in totals.items():
+            total += group_sums(month, table.column(column).to_numpy(), months)
+    capital, ead = totals['capital'][:, None], totals['ead'][:, None]
+    return {
+        'single_customer_exposure': (customer_ead.reshape(months, customers) / capital, format_id_values('CUST', np.arange(customers), 5)),
+        'industry_ead_share': (industry_ead.reshape(months, -1)[:, :len(INDUSTRIES)] / ead, INDUSTRIES),
+        'geography_ead_share': (geography_ead.reshape(months, -1) / ead, STATES),
+        'car': ((totals['capital'] / totals['rwa'])[:, None], ['bank']),
+        'provision_coverage': ((totals['provisions'] / totals['loan_amount'])[:, None], ['bank']),
+    }
+
+def funding_limit_metrics(config):
+    """Each funding source's share of the month's total funding."""
+    months, sources = len(config.dates), config.rows['funding_sources'] + 1
+    amounts = np.zeros(months * sources)
+    for table in scan_compact(config, 'funding_sources', ['as_of_date', 'funding_id', 'amount']):
+        month = month_index(table, config)
+        amounts += group_sums(month * sources + table.column('funding_id').to_numpy(), table.column('amount').to_numpy(), amounts.size)
+    amounts = amounts.reshape(months, sources)
+    return {'single_funding_source': (amounts / amounts.sum(axis=1, keepdims=True), format_id_values('FS', np.arange(sources), 5))}
+
+def liquidity_limit_metrics(config):
+    """The month's LCR and NSFR (NaN for months without liquidity_metrics)."""
+    ratios = {'LCR': np.full(len(config.dates), np.nan), 'NSFR': np.full(len(config.dates), np.nan)}
+    for table in scan_compact(config, 'liquidity_metrics', ['as_of_date', 'LCR', 'NSFR']):
+        month = month_index(table, config)
+        for column, values in ratios.items():
+            values[month] = table.column(column).to_numpy()
+    return {'lcr': (ratios['LCR'][:, None], ['bank']), 'nsfr': (ratios['NSFR'][:, None], ['bank'])}
+
+def market_limit_metrics(config):
+    """Instrument shares of desk market value and summed desk VaR.
+
+    market_positions is scanned once into (month, desk, instrument) market
+    values and a (month, position) -> desk index, through which each
+    market_risk_metrics row's VaR is added to its desk.
+    """
+    months, positions, desks, instruments = len(config.dates), config.rows['market_positions'] + 1, len(DESKS), len(INSTRUMENTS)
+    market_value = np.zeros(months * desks * instruments)
+    desk_of = np.full(months * positions, -1, dtype=np.int64)
+    for table in scan_compact(config, 'market_positions', ['as_of_date', 'position_id', 'desk', 'instrument', 'market_value']):
+        month, desk = month_index(table, config), dictionary_codes(table, 'desk', DESKS)
+        keys = (month * desks + desk) * instruments + dictionary_codes(table, 'instrument', INSTRUMENTS)
+        market_value += group_sums(keys, table.column('market_value').to_numpy(), market_value.size)
+        desk_of[month * positions + table.column('position_id').to_numpy()] = desk
+    var = np.zeros(months * desks)
+    for table in scan_compact(config, 'market_risk_metrics', ['as_of_date', 'position_id', 'VaR']):
+        month = month_index(table, config)
+        desk = desk_of[month * positions + table.column('position_id').to_numpy()]
+        var += group_sums(month * desks + desk, table.column('VaR').to_numpy(), var.size)
+    market_value = market_value.reshape(months, desks, instruments)
+    shares = market_value / market_value.sum(axis=2, keepdims=True)
+    return {
+        'instrument_concentration': (shares.reshape(months, -1), [f'{desk} / {instrument}' for desk in DESKS for instrument in INSTRUMENTS]),
+        'desk_var': (var.reshape(months, desks), DESKS),
+    }
+
+# Limit name -> function computing it (with the other limits on the same tables) and the tables it reads
+LIMIT_SOURCES = {
+    'single_customer_exposure': (credit_limit_metrics, ('loans',)),
+    'industry_ead_share': (credit_limit_metrics, ('loans',)),
+    'geography_ead_share': (credit_limit_metrics, ('loans',)),
+    'car': (credit_limit_metrics, ('loans',)),
+    'provision_coverage': (credit_limit_metrics, ('loans',)),
+    'single_funding_source': (funding_limit_metrics, ('funding_sources',)),
+    'lcr': (liquidity_limit_metrics, ('liquidity_metrics',)),
+    'nsfr': (liquidity_limit_metrics, ('liquidity_metrics',)),
+    'instrument_concentration': (market_limit_metrics, ('market_positions', 'market_risk_metrics')),
+    'desk_var': (market_limit_metrics, ('market_positions', 'market_risk_metrics')),
+}
+
+def evaluate_limits(config, limits, report=None):
+    """Evaluate the limits for every as_of_date and save the breaches to config.mart_dir/LIMIT_BREACHES.
+
+    Each limit's values form a (month, entity) matrix, compared with its soft
+    and hard thresholds at once; limits whose tables are missing are skipped.
+    Returns the breaches: as_of_date, limit, entity, value, soft, hard and
+    severity ('hard', or 'soft' when only the soft threshold is crossed).
+    """
+    report = report or RunReport(config.data_dir)
+    months = np.array([date.strftime('%Y-%m-%d') for date in config.dates], dtype=object)
+    columns = ['as_of_date', 'limit', 'entity', 'value', 'soft', 'hard', 'severity']
+    frames = [pd.DataFrame({column: pd.Series(dtype=float if column in ('value', 'soft', 'hard') else str) for column in columns})]
+    with report.stage('limits') as metrics:
+        values = {}
+        for source, tables in dict(LIMIT_SOURCES[name] for name in limits).items():
+            if all(os.path.exists(config.path(name)) for name in tables):
+                values.update(source(config))
+        for name, limit in limits.items():
+            if name not in values:
+                continue
+            matrix, entities = values[name]
+            crosses = np.greater if limit['bound'] == 'max' else np.less
+            hard = crosses(matrix, limit['hard'])
+            soft = crosses(matrix, limit['soft']) & ~hard if limit.get('soft') is not None else np.zeros_like(hard)
+            month, entity = np.nonzero(hard | soft)
+            frames.append(pd.DataFrame({
+                'as_of_date': months[month], 'limit': name, 'entity': np.asarray(entities, dtype=object)[entity],
+                'value': matrix[month, entity], 'soft': limit.get('soft'), 'hard': limit['hard'],
+                'severity': np.where(hard[month, entity], 'hard', 'soft'),
+            }))
+        breaches = pd.concat(frames, ignore_index=True).astype({'soft': float, 'hard': float})
+        breaches = breaches.sort_values(['as_of_date', 'limit', 'entity'], ignore_index=True)
+        os.makedirs(config.mart_dir, exist_ok=True)
+        breaches.to_parquet(os.path.join(config.mart_dir, LIMIT_BREACHES), index=False)
+        metrics.update(rows=len(breaches), limits=len([name for name in limits if name in values]))
+    return breaches
+
+# ==================== VALIDATION ====================
+# The generated tables checked against the specs/ data models, one row group at a
+# time: allowed values, ranges, nulls, date order, key uniqueness and foreign keys
+
+VALIDATION_REPORT = 'validation_report.json'
+VALIDATION_EXAMPLES = 5  # offending values kept per check
+FINANCIALS = ['total_assets', 'total_liabilities', 'annual_revenue', 'interest_coverage_ratio', 'debt_to_equity_ratio',
+              'current_ratio', 'net_profit_margin']
+
+# Table -> constraints: 'enums' {column: allowed values}, 'ranges' {column: (min, max)}
+# (None for no bound), 'ordered' [(earlier, later)] column pairs, 'nullable' columns
+# (every other column must be non-null) and 'references' {column: referenced table}.
+# A reference to a panel table must match a row of the same as_of_date. Every key
+# (per as_of_date in panel tables) must be unique and every as_of_date one of config.dates.
+VALIDATIONS = {
+    'customers': {'enums': {'segment': SEGMENTS, 'state': STATES, 'industry': INDUSTRIES + ['']},
+                  'ordered': [('date_of_birth', 'customer_since')]},
+    'loans': {'enums': {'credit_rating': CREDIT_RATINGS, 'lgd_rating': LGD_RATINGS, 'sales_channel': SALES_CHANNELS,
+                        'industry': INDUSTRIES + [''], 'geography': STATES, 'product_type': PRODUCT_TYPES, 'purpose': PURPOSES,
+                        'currency': CURRENCIES, 'repayment_type': REPAYMENT_TYPES, 'collateral_type': COLLATERAL_TYPES},
+              'ranges': {'loan_amount': (0, None), 'ead': (0, None), 'rwa': (0, None), 'capital': (0, None),
+                         'provisions': (0, None), 'arrears': (0, None), 'interest_rate': (0, 100)},
+              'ordered': [('origination_date', 'as_of_date'), ('as_of_date', 'maturity_date')],
+              'nullable': FINANCIALS,  # retail loans have no financials
+              'references': {'customer_id': 'customers'}},
+    'loan_applications': {'enums': {'status': APPLICATION_STATUS, 'product_type': PRODUCT_TYPES},
+                          'ranges': {'amount_requested': (0, None)},
+                          'references': {'customer_id': 'customers'}},
+    'write_offs': {'enums': {'reason': WRITE_OFF_REASONS},
+                   'ranges': {'amount_written_off': (0, None)},
+                   'references': {'loan_id': 'loans'}},
+    'customer_interactions': {'enums': {'interaction_type': INTERACTION_TYPES},
+                              'ranges': {'agent_id': (1, N_AGENTS)},
+                              'references': {'customer_id': 'customers'}},
+    'loan_securities': {'enums': {'security_type': COLLATERAL_TYPES, 'lien_type': LIEN_TYPES},
+                        'ranges': {'security_value': (0, None)},
+                        'references': {'loan_id': 'loans'}},
+    'liquidity_positions': {'enums': {'asset_type': ASSET_TYPES, 'geography': STATES},
+                            'ranges': {'amount': (0, None)},
+                            'ordered': [('as_of_date', 'maturity_date')],
+                            'nullable': ['maturity_date'],
+                            'references': {'customer_id': 'customers'}},
+    'funding_sources': {'enums': {'source_type': FUNDING_SOURCE_TYPES},
+                        'ranges': {'amount': (0, None), 'cost': (0, 100)}},
+    'liquidity_metrics': {'ranges': {'LCR': (0, None), 'NSFR': (0, None), 'cash_inflows': (0, None), 'cash_outflows': (0, None)}},
+    'liquidity_events': {'enums': {'event_type': LIQUIDITY_EVENT_TYPES}},
+    'market_positions': {'enums': {'desk': DESKS, 'instrument': INSTRUMENTS},
+                         'ranges': {'notional': (0, None), 'market_value': (0, None)},
+                         'references': {'customer_id': 'customers'}},
+    # Historical VaR, SVaR and ES are negative when every scenario is a gain, so only volatility is bounded
+    'market_risk_metrics': {'ranges': {'volatility': (0, None)},
+                            'nullable': ['VaR', 'SVaR', 'expected_shortfall', 'volatility'],  # historical VaR has no first month
+                            'references': {'position_id': 'market_positions'}},
+    'instrument_prices': {'enums': {'instrument': INSTRUMENTS, 'currency': CURRENCIES},
+                          'ranges': {'price': (0, None)}},
+    'market_events': {'enums': {'instrument': INSTRUMENTS, 'event_type': MARKET_EVENT_TYPES}},
+}
+
+class KeyIndex:
+    """The keys of one table as a bitmap over their integer ids (compact schema), for
+    uniqueness and foreign-key checks.
+
+    Panel tables are indexed by (id, as_of_date) pairs, at slot id * months + month;
+    other tables by id alone. Keys seen more than once are counted in `duplicates`.
+    """
+
+    def __init__(self, months=1):
+        self.months = months
+        self.bits = np.zeros(0, dtype=bool)
+        self.duplicates = 0
+        self.examples = []
+
+    def slots(self, ids, month=None):
+        """Bitmap slot of each key; -1 for null ids and as_of_dates outside the run."""
+        slots = ids.astype(np.int64) * self.months
+        if month is not None:
+            slots = np.where(month >= 0, slots + month, -1)
+        return np.where(ids >= 0, slots, -1)
+
+    def add(self, ids, month=None):
+        slots = self.slots(ids, month)
+        slots = slots[slots >= 0]
+        if slots.size and slots.max() >= self.bits.size:
+            bits = np.zeros(max(int(slots.max()) + 1, 2 * self.bits.size), dtype=bool)
+            bits[:self.bits.size] = self.bits
+            self.bits = bits
+        unique, counts = np.unique(slots, return_counts=True)
+        repeated = (counts > 1) | self.bits[unique]
+        self.duplicates += int(counts.sum() - unique.size + self.bits[unique].sum())
+        self.examples.extend((unique[repeated][:VALIDATION_EXAMPLES - len(self.examples)] // self.months).tolist())
+        self.bits[unique] = True
+
+    def contains(self, ids, month=None):
+        slots = self.slots(ids, month)
+        found = np.zeros(slots.size, dtype=bool)
+        inside = (slots >= 0) & (slots < self.bits.size)
+        found[inside] = self.bits[slots[inside]]
+        return found
+
+def as_of_months(table, config):
+    """Position in config.dates of each row's as_of_date, or -1 where it is not one of them."""
+    days = pc.fill_null(table.column('as_of_date').cast(pa.int32()), -1).to_numpy()
+    dates = np.array([date.date() for date in config.dates], dtype='datetime64[D]').astype(np.int64)
+    month = np.minimum(np.searchsorted(dates, days), len(dates) - 1)
+    return np.where(dates[month] == days, month, -1)
+
+def id_values(table, column):
+    """An integer id column as a NumPy array, with -1 for nulls."""
+    return pc.fill_null(table.column(column), -1).to_numpy()
+
+def key_index(config, name):
+    """Scan a table's key column (and as_of_date for panels) into a KeyIndex."""
+    key, panel = TABLES[name]['key'], TABLES[name]['panel']
+    index = KeyIndex(len(config.dates) if panel else 1)
+    for table in scan_compact(config, name, [key, 'as_of_date'] if panel else [key]):
+        index.add(id_values(table, key), as_of_months(table, config) if panel else None)
+    return index
+
+_VALIDATION_STATE = {}
+
+def init_validation(config, indexes):
+    """Validation worker initializer: the run's config and the referenced tables' KeyIndexes, received once per process."""
+    _VALIDATION_STATE.update(config=config, indexes=indexes)
+
+def violation(table, name, column, mask):
+    """(count, example values) of the rows of a column selected by a boolean mask."""
+    rows = np.flatnonzero(mask)
+    values = table.column(column).take(pa.array(rows[:VALIDATION_EXAMPLES])).to_pylist()
+    if column in TABLES[name]['ids'] and pa.types.is_integer(table.schema.field(column).type):
+        prefix, width = TABLES[name]['ids'][column]
+        values = [None if value is None else text for value, text in zip(values, format_id_values(prefix, [value or 0 for value in values], width))]
+    return len(rows), [str(value) for value in values]
+
+def validate_row_group(name, group):
+    """Check one row_groups() entry of a table against VALIDATIONS (runs in worker processes).
+
+    Returns the row count and {(check, column): (violations, examples)} for the
+    checks that found any.
+    """
+    config, indexes = _VALIDATION_STATE['config'], _VALIDATION_STATE['indexes']
+    spec = VALIDATIONS[name]
+    source = read_row_group(config, name, group, pq.ParquetFile(group[0]).schema_arrow.names +
+                            ([TABLES[name]['partition_by']] if group[3] is not None else []))
+    table = compact_table(source, name)
+    found = {}
+    def check(kind, column, mask, values=table):
+        mask = np.asarray(mask, dtype=bool)
+        if mask.any():
+            found[(kind, column)] = violation(values, name, column, mask)
+    def where(values):
+        return pc.fill_null(values, False).to_numpy(zero_copy_only=False)
+
+    # Text ids that compact_table() could not convert: reported with their text, and not again as nulls
+    malformed = {}
+    for column, (prefix, _) in TABLES[name]['ids'].items():
+        if column in source.column_names and source.schema.field(column).type in (pa.string(), pa.large_string()):
+            malformed[column] = where(malformed_ids(source.column(column), prefix))
+            check('format', column, malformed[column], source)
+    for column in table.column_names:
+        if column not in spec.get('nullable', ()):
+            nulls = where(pc.is_null(table.column(column)))
+            check('not_null', column, nulls & ~malformed[column] if column in malformed else nulls)
+    for column, labels in spec.get('enums', {}).items():
+        values = table.column(column)
+        check('enum', column, where(pc.and_(pc.invert(pc.is_in(values, value_set=pa.array(labels))), pc.is_valid(values))))
+    for column, (low, high) in spec.get('ranges', {}).items():
+        if low is not None:
+            check('min', column, where(pc.less(table.column(column), low)))
+        if high is not None:
+            check('max', column, where(pc.greater(table.column(column), high)))
+    for earlier, later in spec.get('ordered', ()):
+        check(f'after {earlier}', later, where(pc.less(table.column(later), table.column(earlier))))
+    month = None
+    if 'as_of_date' in table.column_names:
+        month = as_of_months(table, config)
+        check('as_of_date', 'as_of_date', (month < 0) & table.column('as_of_date').is_valid().to_numpy(zero_copy_only=False))
+    for column, referenced in spec.get('references', {}).items():
+        ids = id_values(table, column)
+        found_ids = indexes[referenced].contains(ids, month if TABLES[referenced]['panel'] else None)
+        check(f'references {referenced}', column, ~found_ids & (ids >= 0))
+    return table.num_rows, found
+
+def validate(config, tables=None, workers=1, report=None):
+    """Validate the tables (default: every table present) and write <data_dir>/VALIDATION_REPORT.
+
+    Keys are checked for uniqueness in one scan of each key column, which also
+    builds the KeyIndex that foreign keys to the table are looked up in. The
+    remaining checks run row group by row group, so memory stays bounded by
+    the largest row group plus the indexes, in a pool of `workers` processes
+    that receive the indexes once. Returns the report as a dict; its
+    'violations' is the total number of failed values.
+    """
+    report = report or RunReport(config.data_dir)
+    tables = [name for name in (tables or list(TABLES)) if os.path.exists(config.path(name))]
+    checks = []
+    def record(name, kind, column, count, examples):
+        checks.append({'table': name, 'check': kind, 'column': column, 'violations': count, 'examples': examples})
+
+    with report.stage('validate') as metrics:
+        indexes = {}
+        for name in tables:
+            indexes[name] = key_index(config, name)
+            if indexes[name].duplicates:
+                key = TABLES[name]['key']
+                prefix, width = TABLES[name]['ids'][key]
+                record(name, 'unique', key, indexes[name].duplicates, list(format_id_values(prefix, indexes[name].examples, width)))
+        referenced = {table for name in tables for table in VALIDATIONS[name].get('references', {}).values()}
+        missing = referenced - set(indexes)
+        for name in sorted(missing):
+            indexes[name] = key_index(config, name) if os.path.exists(config.path(name)) else KeyIndex()
+        lookups = {name: indexes[name] for name in referenced}
+        jobs = [(name, group) for name in tables for group in row_groups(config, name)]
+        if workers <= 1 or len(jobs) <= 1:
+            init_validation(config, lookups)
+            results = [validate_row_group(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_validation, initargs=(config, lookups)) as pool:
+                results = list(pool.map(validate_row_group, *zip(*jobs), chunksize=max(1, len(jobs) // (4 * workers))))
+        rows = dict.fromkeys(tables, 0)
+        totals = {}
+        for (name, _), (count, found) in zip(jobs, results):
+            rows[name] += count
+            for (kind, column), (violations, examples) in found.items():
+                total = totals.setdefault((name, kind, column), [0, []])
+                total[0] += violations
+                total[1].extend(examples[:VALIDATION_EXAMPLES - len(total[1])])
+        for (name, kind, column), (count, examples) in totals.items():
+            record(name, kind, column, count, examples)
+        metrics.update(rows=sum(rows.values()), tables=len(tables), row_groups=len(jobs))
+    result = {'tables': rows, 'violations': sum(check['violations'] for check in checks), 'checks': checks}
+    os.makedirs(config.data_dir, exist_ok=True)
+    with open(os.path.join(config.data_dir, VALIDATION_REPORT), 'w') as f:
+        json.dump(result, f, indent=1)
+    return result
+
+# ==================== SUBSET TIERS ====================
+# Small copies of the dataset for tests and notebooks: a stratified sample of customers with
+# every row that belongs to them, cascaded along the VALIDATIONS references (loans to their
+# securities and write-offs, market positions to their risk metrics), so joins still match.
+
+SUBSET_DIR = '_subsets'  # in the data folder a tier is cut from, `_`-prefixed so upload.py leaves the tiers out
+SUBSET_TIERS = {'1pct': 0.01, '10pct': 0.1}  # tier folder -> fraction of the customers kept
+SUBSET_MANIFEST = '_subset.json'
+
+def subset_customers(config, fraction):
+    """Ids of a stratified sample of the customers: in every (segment, state) group, the fraction of
+    its customers (at least one) with the lowest random priority.
+
+    Priorities come from the run's seed, so a tier's customers are also in
+    every larger tier.
+    """
+    customers = pa.concat_tables(scan_compact(config, 'customers', ['customer_id', 'segment', 'state'])).to_pandas()
+    customers['priority'] = np.random.default_rng([config.seed, zlib.crc32(b'subset')]).random(len(customers))
+    groups = customers.groupby(['segment', 'state'], observed=True)['priority']
+    quota = np.maximum(1, np.round(groups.transform('size').to_numpy() * fraction))
+    return customers['customer_id'].to_numpy()[groups.rank(method='first').to_numpy() <= quota]
+
+def subset_config(tier, data_dir=DATA_DIR):
+    """The GenerationConfig of a tier of data_dir written by write_subset(), for read_frame(), validate(), the KPI functions, ..."""
+    folder = os.path.join(data_dir, SUBSET_DIR, tier)
+    with open(os.path.join(folder, SUBSET_MANIFEST)) as f:
+        return GenerationConfig.from_dict(json.load(f)['settings'], folder)
+
+def write_subset(config, tier, fraction=None, report=None):
+    """Write a tier of the dataset in config.data_dir to its SUBSET_DIR/<tier>, in the same layout and schema; returns {table: rows}.
+
+    Tables are filtered row group by row group in build order. A table with
+    references (see VALIDATIONS) keeps the rows whose referenced ids were kept,
+    which for customers means subset_customers(); the keys it keeps go into a
+    KeyIndex for the tables referencing it. Tables without references (funding,
+    liquidity metrics and events, prices, market events) are copied whole.
+    """
+    fraction = SUBSET_TIERS[tier] if fraction is None else fraction
+    report = report or RunReport(config.data_dir)
+    folder = os.path.join(config.data_dir, SUBSET_DIR, tier)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    tier_config = GenerationConfig.from_dict(config.to_dict(), folder)
+    referenced = {table for spec in VALIDATIONS.values() for table in spec.get('references', {}).values()}
+    kept = {'customers': KeyIndex()}
+    kept['customers'].add(subset_customers(config, fraction))
+    rows = {}
+    with report.stage(f'subset:{tier}') as metrics:
+        for name in resolve_tables(list(TABLES)):
+            if not os.path.exists(config.path(name)):
+                continue
+            key = TABLES[name]['key']
+            references = {column: table for column, table in VALIDATIONS[name].get('references', {}).items() if table in kept}
+            if name == 'customers':
+                references = {key: name}
+            if not references:
+                if config.partitioned(name):
+                    shutil.copytree(config.path(name), tier_config.path(name))
+                else:
+                    shutil.copy2(config.path(name), tier_config.path(name))
+                rows[name] = table_rows(config, name)
+                continue
+            if name in referenced and name not in kept:
+                kept[name] = KeyIndex()
+            columns = table_dataset(config, name).schema.names
+            groups = row_groups(config, name)
+            with tier_config.open_writer(name) as writer:
+                for index, group in enumerate(groups):
+                    table = read_row_group(config, name, group, columns)
+                    ids = compact_table(table.select(list(references)), name)
+                    mask = np.ones(table.num_rows, dtype=bool)
+                    for column, table_name in references.items():
+                        mask &= kept[table_name].contains(id_values(ids, column))
+                    table = table.filter(mask)
+                    if name in kept and name != 'customers':
+                        kept[name].add(id_values(compact_table(table.select([key]), name), key))
+                    if table.num_rows or (not writer.rows and index == len(groups) - 1):
+                        writer.write(table)  # an empty last row group still leaves a file with the schema
+            rows[name] = writer.rows
+        metrics.update(rows=sum(rows.values()), bytes=path_bytes(folder))
+    with open(os.path.join(folder, SUBSET_MANIFEST), 'w') as f:
+        json.dump({'tier': tier, 'fraction': fraction, 'source': config.data_dir, 'settings': config.to_dict(),
+                   'customers': rows.get('customers', 0), 'rows': rows}, f, indent=1)
+    return rows
+
+# ==================== CLI ====================
+
+def parse_rows(values):
+    """Parse repeated TABLE=N arguments into a row-count dict."""
+    rows = {}
+    for value in values:
+        name, _, count = value.partition('=')
+        if name not in DEFAULT_ROWS or not count.isdigit():
+            raise argparse.ArgumentTypeError(f'Invalid --rows {value!r}; expected TABLE=N with TABLE one of {", ".join(DEFAULT_ROWS)}')
+        rows[name] = int(count)
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the FakeBank synthetic dataset')
+    parser.add_argument('--tables', nargs='+', choices=list(TABLES), help='Tables to build (default: all); their upstream tables are built too')
+    parser.add_argument('--months', type=int, default=MONTHS, help=f'Number of month-end snapshots (default: {MONTHS})')
+    parser.add_argument('--end-date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'), default=END_DATE, help=f'Last as_of_date, YYYY-MM-DD (default: {END_DATE:%Y-%m-%d})')
+    parser.add_argument('--rows', action='append', default=[], metavar='TABLE=N', help='Row count for a table (per as_of_date for panel tables), e.g. loans=1000000; repeatable')
+    parser.add_argument('--seed', type=int, default=SEED, help=f'Random seed (default: {SEED})')
+    parser.add_argument('--data-dir', default=DATA_DIR, help=f'Output folder for Parquet files (default: {DATA_DIR})')
+    parser.add_argument('--sampling', choices=SAMPLING_MODES, default='pooled', help='Text/date columns from pre-sampled Faker pools and vectorised offsets (pooled, default) or one Faker call per value (exact)')
+    parser.add_argument('--layout', choices=LAYOUTS, default='flat', help='flat: one Parquet file per table (default); hive: panel tables as <table>/as_of_date=YYYY-MM-DD/ folders')
+    parser.add_argument('--compression', choices=COMPRESSION_CODECS, default='snappy', help='Parquet compression codec (default: snappy)')
+    parser.add_argument('--schema', choices=SCHEMAS, default='text', help='text: string ids and as_of_date (default); compact: int32 id keys, date32 as_of_date, dictionary-encoded enumerations')
+    parser.add_argument('--var-model', choices=VAR_MODELS, default='fraction', help='market_risk_metrics VaR/SVaR/ES as random fractions of market_value (fraction, default) or by historical simulation over instrument_prices (historical)')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes for partitioned generation and chart rendering (default: 1); output is identical for any value')
+    cache = parser.add_mutually_exclusive_group()
+    cache.add_argument('--cache-dir', default=CACHE_DIR, help=f'Folder of previously generated tables, reused when their code, settings and upstream tables are unchanged (default: {CACHE_DIR})')
+    cache.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None, help='Generate every table, without reading or filling the cache')
+    parser.add_argument('--append', action='store_true', help=f'Extend the dataset in --data-dir by one month from its checkpoint ({CHECKPOINT_FILE}); the settings it was built with are reused')
+    parser.add_argument('--limits', nargs='?', const=LIMITS_FILE, metavar='FILE', help=f'Also evaluate the risk appetite limits of FILE (default: {LIMITS_FILE}) over every as_of_date into <data-dir>/{MART_DIR}/{LIMIT_BREACHES}; --mart flags LCR/NSFR breaches against its thresholds')
+    parser.add_argument('--arrow-cache', action='store_true', help=f'Also keep an uncompressed Arrow IPC copy of each table in <data-dir>/{ARROW_DIR}/ for load_table() to memory-map (only missing or stale copies are written)')
+    parser.add_argument('--subsets', nargs='*', choices=list(SUBSET_TIERS), metavar='TIER', help=f'Also write referentially consistent tiers of the dataset, built from a stratified sample of the customers, to <data-dir>/{SUBSET_DIR}/<tier>/ (tiers: {", ".join(SUBSET_TIERS)}; all if none are named)')
+    parser.add_argument('--validate', action='store_true', help=f'Check the tables against the specs/ constraints into {VALIDATION_REPORT} in --data-dir; the exit status is 1 if any check fails')
+    parser.add_argument('--mart', action='store_true', help=f'Also refresh the KPI mart in <data-dir>/{MART_DIR}/ (only the months whose source data changed are recomputed)')
+    parser.add_argument('--interaction-index', action='store_true', help=f'Also refresh the customer_interactions index in <data-dir>/{MART_DIR}/ (only added row groups are tokenized)')
+    parser.add_argument('--no-samples', action='store_true', help=f'Do not write head(15) CSV samples to {SAMPLE_DIR}/')
+    parser.add_argument('--log-stages', action='store_true', help=f'Log each stage\'s metrics as a JSON line on stderr (they are always saved to {RUN_REPORT} in --data-dir)')
+    parser.add_argument('--profile-stage', metavar='STAGE', help='Run one stage under cProfile, e.g. generate:loans, write:loans or charts; stats go to <data-dir>/_profiles/')
+    charts = parser.add_mutually_exclusive_group()
+    charts.add_argument('--charts', dest='charts', action='store_true', default=None, help=f'Render {SUMMARY_DIR}/ profiling charts for the built tables (default when building all tables)')
+    charts.add_argument('--no-charts', dest='charts', action='store_false', help='Skip profiling charts')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.log_stages else logging.WARNING, format='%(message)s')
+
+    try:
+        rows = parse_rows(args.rows)
+        limits = load_limits(args.limits) if args.limits else None
+    except (argparse.ArgumentTypeError, OSError, ValueError) as e:
+        parser.error(str(e))
+    report = RunReport(args.data_dir, args.profile_stage)
+    if args.append:
+        try:
+            built, config = append_month(args.data_dir, report=report)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        config = GenerationConfig(seed=args.seed, end_date=args.end_date, months=args.months, rows=rows, data_dir=args.data_dir,
+                                  sampling=args.sampling, layout=args.layout, compression=args.compression,
+                                  schema=args.schema, cache_dir=args.cache_dir, var_model=args.var_model)
+        print('DATES:', [d.strftime('%Y-%m-%d') for d in config.dates])
+
+        built = build(args.tables, config, samples=not args.no_samples, workers=args.workers, report=report)
+
+    print(f'Fake bank data generated in ./{config.data_dir} as parquet files.')
+    print('\nGenerated files:')
+    for domain in ('Credit Risk', 'Liquidity Risk', 'Market Risk'):
+        names = [name for name in built if TABLES[name]['domain'] == domain]
+        if names:
+            print(f'  {domain}:')
+            for name in names:
+                print(f'    - {os.path.relpath(config.path(name), config.data_dir)}')
+    if args.arrow_cache:
+        written = refresh_arrow_cache(config, report=report)
+        print(f'Arrow IPC copies of {len(written)} tables written to ./{os.path.join(config.data_dir, ARROW_DIR)}.')
+    if args.subsets is not None:
+        for tier in args.subsets or list(SUBSET_TIERS):
+            rows = write_subset(config, tier, report=report)
+            print(f'Subset {tier}: {rows.get("customers", 0):,} customers and {sum(rows.values()):,} rows in ./{os.path.join(config.data_dir, SUBSET_DIR, tier)}.')
+
+    validation = None
+    if args.validate:
+        validation = validate(config, workers=args.workers, report=report)
+        print(f'Validation: {validation["violations"]} violations in {len(validation["checks"])} failed checks '
+              f'over {sum(validation["tables"].values()):,} rows, in ./{os.path.join(config.data_dir, VALIDATION_REPORT)}.')
+        for check in validation['checks']:
+            print(f'  {check["table"]}.{check["column"]} {check["check"]}: {check["violations"]:,} (e.g. {", ".join(check["examples"])})')
+    if args.mart:
+        refresh_mart(config, report=report, limits=limits)
+        print(f'KPI mart refreshed in ./{config.mart_dir}.')
+    if args.interaction_index:
+        refresh_interaction_index(config, report=report)
+        print(f'Interaction index refreshed in ./{config.mart_dir}.')
+    if limits:
+        breaches = evaluate_limits(config, limits, report=report)
+        counts = breaches['severity'].value_counts()
+        print(f'Risk appetite limits: {counts.get("hard", 0)} hard and {counts.get("soft", 0)} soft breaches '
+              f'over {len(config.dates)} months, in ./{os.path.join(config.mart_dir, LIMIT_BREACHES)}.')
+
+    charts = args.charts if args.charts is not None else not (args.tables or args.append)
+    if charts:
+        render_charts(built, config, workers=args.workers, report=report)
+        print('Profiling charts generated.')
+    print(f'Run report written to {report.save(config)}')
+    if validation and validation['violations']:
+        sys.exit(1)
 
-def plot_stacked_by_dimension(df, value_col, dimension_col, filename, aggfunc='sum'):
-    if 'as_of_date' not in df.columns:
-        return
-    pivot = df.pivot_table(
-        index='as_of_date',
-        columns=dimension_col,
-        values=value_col,
-        aggfunc=aggfunc,
-        fill_value=0
-    )
-    pivot.plot(kind='bar', stacked=True, figsize=(12, 6))
-    plt.title(f"{value_col} by {dimension_col} and as_of_date")
-    plt.ylabel(value_col)
-    plt.xlabel("as_of_date")
-    plt.tight_layout()
-    plt.savefig(os.path.join(summary_dir, os.path.basename(filename)))
-    plt.close()
 
-# Update all calls to plot_stacked_by_dimension to use only the filename, not a path
-plot_stacked_by_dimension(loans_df, 'loan_amount', 'industry', 'loans_by_industry_stacked.png')
-plot_stacked_by_dimension(loans_df, 'loan_amount', 'sales_channel', 'loans_by_channel_stacked.png')
-plot_stacked_by_dimension(loans_df, 'loan_amount', 'product_type', 'loans_by_product_type_stacked.png')
-plot_stacked_by_dimension(loans_df, 'loan_amount', 'credit_rating', 'loans_by_credit_rating_stacked.png')
-plot_stacked_by_dimension(loans_df, 'loan_amount', 'lgd_rating', 'loans_by_lgd_rating_stacked.png')
-plot_stacked_by_dimension(applications_df, 'amount_requested', 'product_type', 'applications_by_product_type_stacked.png')
-plot_stacked_by_dimension(applications_df, 'amount_requested', 'status', 'applications_by_status_stacked.png')
-plot_stacked_by_dimension(write_offs_df, 'amount_written_off', 'reason', 'write_offs_by_reason_stacked.png')
-if 'as_of_date' in interactions_df.columns:
-    interactions_df['as_of_date'] = pd.to_datetime(interactions_df['interaction_date']).dt.strftime('%Y-%m-%d')
-plot_stacked_by_dimension(interactions_df, 'interaction_id', 'interaction_type', 'interactions_by_type_stacked.png', aggfunc='count')
-plot_stacked_by_dimension(securities_df, 'security_value', 'security_type', 'securities_by_type_stacked.png')
-plot_stacked_by_dimension(securities_df, 'security_value', 'lien_type', 'securities_by_lien_type_stacked.png')
-if 'liquidity_positions_df' in locals():
-    plot_stacked_by_dimension(liquidity_positions_df, 'amount', 'asset_type', 'liquidity_by_asset_type_stacked.png')
-    plot_stacked_by_dimension(liquidity_positions_df, 'amount', 'geography', 'liquidity_by_geography_stacked.png')
-if 'funding_sources_df' in locals():
-    plot_stacked_by_dimension(funding_sources_df, 'amount', 'source_type', 'funding_by_source_type_stacked.png')
-if 'market_positions_df' in locals():
-    plot_stacked_by_dimension(market_positions_df, 'market_value', 'instrument', 'market_by_instrument_stacked.png')
-    plot_stacked_by_dimension(market_positions_df, 'market_value', 'desk', 'market_by_desk_stacked.png')
-
-print('Stacked column profiling charts for all tables generated.')
-print('Stacked column profiling charts for liquidity and market risk tables generated.')
+if __name__ == '__main__':
+    main()
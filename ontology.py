@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+ontology.py
+
+Load ontology/ontology.csv and ontology/semantic.csv into an in-memory triple
+store for lookups and multi-hop traversal, e.g. risk type -> tables -> fields.
+
+Usage examples:
+  python ontology.py --match "credit risk" has_table ?
+  python ontology.py --match ? has_pk ?
+  python ontology.py --traverse "credit risk" has_table has_field
+  python ontology.py --traverse customer_id ^has_pk     # ^ follows a predicate backwards
+  python ontology.py --rebuild
+
+Notes:
+- Terms are interned: every distinct subject, predicate and object is stored
+  once and triples are (subject, predicate, object) id tuples, indexed three
+  ways (subject -> predicate -> objects, predicate -> object -> subjects and
+  object -> subject -> predicates), so any pattern is two dict lookups.
+- The parsed store, indexes included, is pickled to a snapshot (SNAPSHOT)
+  together with the size and mtime of each CSV; later loads read the
+  snapshot instead of the CSVs until one of them changes. load_store() also keeps the store in
+  memory and only reloads it when a CSV changes, so long-running services can
+  call it for every question.
+"""
+import os
+import csv
+import time
+import pickle
+import argparse
+
+SOURCES = ('ontology/ontology.csv', 'ontology/semantic.csv')
+SNAPSHOT = 'ontology/_triples.pickle'
+SNAPSHOT_VERSION = 1
+WILDCARD = '?'
+INVERSE = '^'  # prefix of a predicate followed from object to subject in traverse()
+
+# Stores loaded by load_store(), by their source paths: (fingerprint, TripleStore)
+_STORES = {}
+
+
+def source_fingerprint(paths):
+    """[path, size, mtime_ns] of each source file, to tell whether a snapshot is current."""
+    fingerprint = []
+    for path in paths:
+        stat = os.stat(path)
+        fingerprint.append([path, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def read_triples(paths):
+    """(subject, predicate, object) rows of the CSVs, skipping headers, blank lines and # comments."""
+    for path in paths:
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                row = [value.strip() for value in row]
+                if len(row) < 3 or not row[0] or row[0].startswith('#') or row[:3] == ['Subject', 'Predicate', 'Object']:
+                    continue
+                yield row[0], row[1], ','.join(row[2:])
+
+
+def build_index(triples, order):
+    """Nested dict index[first][second] -> tuple of third, with the triple positions taken in `order`."""
+    first, second, third = order
+    index = {}
+    for triple in triples:
+        index.setdefault(triple[first], {}).setdefault(triple[second], []).append(triple[third])
+    for inner in index.values():
+        for key, values in inner.items():
+            inner[key] = tuple(values)
+    return index
+
+
+class TripleStore:
+    """Interned (subject, predicate, object) triples with SPO, POS and OSP indexes."""
+
+    def __init__(self, terms, triples, indexes=None):
+        self.terms = list(terms)
+        self.ids = {term: i for i, term in enumerate(self.terms)}
+        self.triples = [tuple(triple) for triple in triples]
+        if indexes is None:
+            indexes = [build_index(self.triples, order) for order in ((0, 1, 2), (1, 2, 0), (2, 0, 1))]
+        self.spo, self.pos, self.osp = indexes
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Intern rows of (subject, predicate, object) strings; repeated triples are kept once."""
+        ids, seen, triples = {}, set(), []
+        for row in rows:
+            triple = tuple(ids.setdefault(term, len(ids)) for term in row)
+            if triple not in seen:
+                seen.add(triple)
+                triples.append(triple)
+        return cls(ids, triples)
+
+    @classmethod
+    def from_csv(cls, paths=SOURCES):
+        return cls.from_rows(read_triples(paths))
+
+    def save(self, path, fingerprint=None):
+        """Pickle the store with the sources' fingerprint (see source_fingerprint) to a snapshot file."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((SNAPSHOT_VERSION, fingerprint, self.terms, self.triples, (self.spo, self.pos, self.osp)), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """(store, fingerprint) from a snapshot written by save()."""
+        with open(path, 'rb') as f:
+            version, fingerprint, *store = pickle.load(f)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f'{path} is a version {version} snapshot; expected {SNAPSHOT_VERSION}')
+        return cls(*store), fingerprint
+
+    def __len__(self):
+        return len(self.triples)
+
+    def match(self, subject=None, predicate=None, obj=None):
+        """Triples matching a pattern, as (subject, predicate, object) strings; None (or WILDCARD) matches anything."""
+        s, p, o = (None if term in (None, WILDCARD) else self.ids.get(term, -1) for term in (subject, predicate, obj))
+        if -1 in (s, p, o):
+            return []
+        if s is not None:
+            if p is not None:
+                found = [(s, p, x) for x in self.spo.get(s, {}).get(p, ())]
+            elif o is not None:
+                found = [(s, x, o) for x in self.osp.get(o, {}).get(s, ())]
+            else:
+                found = [(s, x, y) for x, ys in self.spo.get(s, {}).items() for y in ys]
+            if o is not None:
+                found = [triple for triple in found if triple[2] == o]
+        elif p is not None:
+            if o is not None:
+                found = [(x, p, o) for x in self.pos.get(p, {}).get(o, ())]
+            else:
+                found = [(y, p, x) for x, ys in self.pos.get(p, {}).items() for y in ys]
+        elif o is not None:
+            found = [(x, y, o) for x, ys in self.osp.get(o, {}).items() for y in ys]
+        else:
+            found = self.triples
+        terms = self.terms
+        return [(terms[a], terms[b], terms[c]) for a, b, c in found]
+
+    def objects(self, subject, predicate):
+        return [self.terms[o] for o in self.spo.get(self.ids.get(subject), {}).get(self.ids.get(predicate), ())]
+
+    def subjects(self, predicate, obj):
+        return [self.terms[s] for s in self.pos.get(self.ids.get(predicate), {}).get(self.ids.get(obj), ())]
+
+    def traverse(self, start, *predicates):
+        """Terms reached from start by following the predicates in turn, in first-reached order.
+
+        A predicate prefixed with INVERSE is followed backwards (object to
+        subject), e.g. traverse('customer_id', '^has_pk') gives the tables
+        keyed on customer_id. `start` may be one term or a list of terms.
+        """
+        frontier = [self.ids[term] for term in ([start] if isinstance(start, str) else start) if term in self.ids]
+        for predicate in predicates:
+            inverse = predicate.startswith(INVERSE)
+            p = self.ids.get(predicate[len(INVERSE):] if inverse else predicate)
+            index = self.pos.get(p, {}) if inverse else None
+            reached = {}
+            for term in frontier:
+                targets = index.get(term, ()) if inverse else self.spo.get(term, {}).get(p, ())
+                reached.update(dict.fromkeys(targets))
+            frontier = list(reached)
+        return [self.terms[term] for term in frontier]
+
+
+def load_store(paths=SOURCES, snapshot=SNAPSHOT, rebuild=False):
+    """The triple store of the source CSVs, from memory, the snapshot or the CSVs, whichever is current.
+
+    The sources are stat()ed on every call; the store is re-read only when a
+    file's size or mtime has changed, and then from the snapshot if it matches,
+    otherwise from the CSVs (refreshing the snapshot).
+    """
+    paths = tuple(paths)
+    fingerprint = source_fingerprint(paths)
+    cached = _STORES.get(paths)
+    if cached is not None and cached[0] == fingerprint and not rebuild:
+        return cached[1]
+    store = None
+    if snapshot and os.path.exists(snapshot) and not rebuild:
+        try:
+            store, saved = TripleStore.load(snapshot)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            saved = None  # unreadable snapshot: rebuild it
+        if saved != fingerprint:
+            store = None
+    if store is None:
+        store = TripleStore.from_csv(paths)
+        if snapshot:
+            store.save(snapshot, fingerprint)
+    _STORES[paths] = (fingerprint, store)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the ontology CSVs as an indexed triple store')
+    parser.add_argument('--sources', nargs='+', default=list(SOURCES), help=f'Triple CSV files (default: {" ".join(SOURCES)})')
+    parser.add_argument('--snapshot', default=SNAPSHOT, help=f'Binary snapshot of the parsed store (default: {SNAPSHOT})')
+    parser.add_argument('--rebuild', action='store_true', help='Re-read the CSVs and rewrite the snapshot even if it is current')
+    parser.add_argument('--match', nargs=3, metavar=('SUBJECT', 'PREDICATE', 'OBJECT'), help=f'Print the triples matching a pattern; {WILDCARD} matches anything')
+    parser.add_argument('--traverse', nargs='+', metavar='TERM', help=f'START PREDICATE [PREDICATE ...]: print the terms reached by following the predicates ({INVERSE}PREDICATE goes backwards)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = load_store(args.sources, args.snapshot, rebuild=args.rebuild)
+    print(f'Loaded {len(store)} triples over {len(store.terms)} terms in {(time.perf_counter() - start) * 1e3:.1f} ms')
+    if args.match:
+        start = time.perf_counter()
+        results = store.match(*args.match)
+        elapsed = time.perf_counter() - start
+        for triple in results:
+            print(','.join(triple))
+        print(f'{len(results)} triples in {elapsed * 1e6:.1f} µs')
+    if args.traverse:
+        if len(args.traverse) < 2:
+            parser.error('--traverse needs a start term and at least one predicate')
+        start = time.perf_counter()
+        results = store.traverse(*args.traverse)
+        elapsed = time.perf_counter() - start
+        for term in results:
+            print(term)
+        print(f'{len(results)} terms in {elapsed * 1e6:.1f} µs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+policy_index.py
+
+Split the policies/*.md frameworks into sections by heading and index them for
+BM25 retrieval of the sections that best match a question.
+
+Usage examples:
+  python policy_index.py "LCR limit escalation"
+  python policy_index.py "single customer concentration limit" --top 3 --text
+  python policy_index.py --rebuild
+
+Notes:
+- The index is saved as JSON next to the documents (policies/INDEX); upload.py
+  leaves it out, like other _-prefixed files. For each document it keeps the SHA-256 of
+  the file and its sections: heading path, line range, text, token count and
+  term frequencies. A rebuild re-reads every file but re-tokenizes only the
+  documents whose hash changed.
+- Loading the index turns the per-section term frequencies into postings
+  (term -> parallel section-id and term-frequency arrays) and a table of
+  section lengths, with each section's BM25 length normalisation and each
+  term's IDF precomputed, so a query only sums the postings of its terms.
+- load_index() keeps the index in memory and checks the policies' sizes and
+  mtimes on every call, rebuilding only when one of them changed.
+"""
+import os
+import re
+import glob
+import json
+import time
+import heapq
+import hashlib
+import argparse
+from array import array
+from math import log
+
+POLICIES_DIR = 'policies'
+INDEX = '_policy_index.json'  # in the policies folder
+INDEX_VERSION = 1
+TOP_K = 5
+
+# BM25 parameters: term-frequency saturation and section-length normalisation
+K1 = 1.2
+B = 0.75
+
+HEADING = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+TOKEN = re.compile(r'[a-z0-9]+(?:[%.][a-z0-9]+)*')
+STOPWORDS = frozenset('a an and are as at be by for from has have in into is it its of on or that the this to was were '
+                      'will with which when where who what how per via'.split())
+
+# Indexes loaded by load_index(), by policies folder: (fingerprint, PolicyIndex)
+_INDEXES = {}
+
+
+def tokenize(text):
+    """Lower-case word tokens of text without stopwords; a trailing plural 's' is dropped ("limits" -> "limit")."""
+    tokens = []
+    for token in TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss') and token.isalpha():
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def split_sections(text):
+    """(heading path, first line, last line, text) of each section of a markdown document.
+
+    A section runs from a heading to the next heading; its path joins the
+    enclosing headings with ' > '. Text before the first heading is a section
+    with an empty path. Code fence lines are left out.
+    """
+    sections, path, start, lines, number = [], [], 1, [], 0
+    def close(end):
+        body = '\n'.join(lines).strip()
+        if body:
+            sections.append((' > '.join(title for _, title in path), start, end, body))
+    for number, line in enumerate(text.splitlines(), start=1):
+        match = HEADING.match(line)
+        if match:
+            close(number - 1)
+            level = len(match.group(1))
+            path = [(depth, title) for depth, title in path if depth < level] + [(level, match.group(2))]
+            start, lines = number, [line]
+        elif not line.startswith('```'):
+            lines.append(line)
+    close(number)
+    return sections
+
+
+def index_document(text):
+    """Index entries of one document's sections: heading path, line range, text, token count and term frequencies."""
+    entries = []
+    for heading, first, last, body in split_sections(text):
+        tokens = tokenize(body)
+        frequencies = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        entries.append({'heading': heading, 'lines': [first, last], 'text': body, 'length': len(tokens), 'terms': frequencies})
+    return entries
+
+
+def policy_files(root=POLICIES_DIR):
+    return sorted(glob.glob(os.path.join(root, '*.md')))
+
+
+def source_fingerprint(paths):
+    """[name, size, mtime_ns] of each policy file, to tell whether an index in memory is current."""
+    fingerprint = []
+    for path in paths:
+        stat = os.stat(path)
+        fingerprint.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def build_index(root=POLICIES_DIR, rebuild=False):
+    """Bring root/INDEX up to date with the policies in root and return (PolicyIndex, documents re-indexed).
+
+    Documents whose SHA-256 matches the saved index keep their sections;
+    changed and new documents are re-split and re-tokenized, and entries of
+    deleted documents are dropped. With rebuild every document is re-indexed.
+    """
+    path = os.path.join(root, INDEX)
+    saved = {}
+    if os.path.exists(path) and not rebuild:
+        try:
+            with open(path, encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                saved = index['documents']
+        except (OSError, ValueError):
+            pass  # unreadable index: re-index everything
+    documents, changed = {}, 0
+    for filename in policy_files(root):
+        with open(filename, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        name = os.path.basename(filename)
+        if saved.get(name, {}).get('sha256') == digest:
+            documents[name] = saved[name]
+        else:
+            documents[name] = {'sha256': digest, 'sections': index_document(content.decode('utf-8'))}
+            changed += 1
+    if changed or set(documents) != set(saved) or not os.path.exists(path):
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'k1': K1, 'b': B, 'documents': documents}, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+    return PolicyIndex(documents), changed
+
+
+class PolicyIndex:
+    """BM25 postings over the sections of the policy documents."""
+
+    def __init__(self, documents, k1=K1, b=B):
+        self.sections = []  # (document, heading path, [first line, last line], text)
+        self.lengths = array('I')
+        postings = {}
+        for name, document in sorted(documents.items()):
+            for section in document['sections']:
+                section_id = len(self.sections)
+                self.sections.append((name, section['heading'], section['lines'], section['text']))
+                self.lengths.append(section['length'])
+                for term, frequency in section['terms'].items():
+                    ids, frequencies = postings.setdefault(term, (array('I'), array('I')))
+                    ids.append(section_id)
+                    frequencies.append(frequency)
+        self.postings = postings
+        self.k1 = k1
+        n = len(self.sections)
+        average = sum(self.lengths) / n if n else 0
+        # k1 * (1 - b + b * length / average length) of each section, the denominator term of BM25
+        self.norms = [k1 * (1 - b + b * length / average) if average else k1 for length in self.lengths]
+        self.idf = {term: log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5)) for term, (ids, _) in postings.items()}
+
+    def __len__(self):
+        return len(self.sections)
+
+    def scores(self, query):
+        """BM25 score of every section containing a query term, as {section id: score}."""
+        scores = {}
+        norms, k1 = self.norms, self.k1
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, frequencies = self.postings[term]
+            idf = self.idf[term] * (k1 + 1)
+            for section_id, frequency in zip(ids, frequencies):
+                scores[section_id] = scores.get(section_id, 0.0) + idf * frequency / (frequency + norms[section_id])
+        return scores
+
+    def search(self, query, k=TOP_K):
+        """The k best sections for a query as (score, document, heading path, [first line, last line], text), best first."""
+        best = heapq.nlargest(k, self.scores(query).items(), key=lambda item: item[1])
+        return [(score, *self.sections[section_id]) for section_id, score in best]
+
+
+def load_index(root=POLICIES_DIR):
+    """The index of the policies in root, kept in memory and rebuilt (see build_index) only when a policy file changes."""
+    fingerprint = source_fingerprint(policy_files(root))
+    cached = _INDEXES.get(root)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    index, _ = build_index(root)
+    _INDEXES[root] = (fingerprint, index)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BM25 retrieval over the sections of the policies/ documents')
+    parser.add_argument('query', nargs='?', help='Question or keywords to retrieve policy sections for')
+    parser.add_argument('--policies-dir', default=POLICIES_DIR, help=f'Folder of policy markdown files (default: {POLICIES_DIR})')
+    parser.add_argument('--top', type=int, default=TOP_K, help=f'Sections to return (default: {TOP_K})')
+    parser.add_argument('--text', action='store_true', help='Print each section\'s text, not just its heading')
+    parser.add_argument('--rebuild', action='store_true', help='Re-index every document, not only the changed ones')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index, changed = build_index(args.policies_dir, rebuild=args.rebuild)
+    print(f'Indexed {len(index)} sections of {len(policy_files(args.policies_dir))} documents ({changed} re-indexed) '
+          f'in {(time.perf_counter() - start) * 1e3:.1f} ms; {len(index.postings)} terms in {os.path.join(args.policies_dir, INDEX)}')
+    if args.query:
+        start = time.perf_counter()
+        results = index.search(args.query, args.top)
+        elapsed = time.perf_counter() - start
+        for score, name, heading, (first, last), text in results:
+            print(f'{score:6.2f}  {name}:{first}-{last}  {heading}')
+            if args.text:
+                print('\n'.join('        ' + line for line in text.splitlines()) + '\n')
+        print(f'{len(results)} sections in {elapsed * 1e6:.0f} µs')
+
+
+if __name__ == '__main__':
+    main()
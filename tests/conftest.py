@@ -0,0 +1,35 @@
+"""Shared fixtures: small generation configs written under a temporary working directory."""
+from datetime import datetime
+
+import pytest
+
+import generate_fakebank_data as fb
+
+# Row counts small enough for a build in a few seconds, with several partitions for the larger tables
+SMALL_ROWS = {'customers': 1500, 'loans': 1200, 'loan_applications': 12000, 'write_offs': 100, 'customer_interactions': 25000,
+              'loan_securities': 800, 'liquidity_positions': 900, 'funding_sources': 100, 'liquidity_events': 50,
+              'market_positions': 700, 'market_events': 50}
+NOW = datetime(2025, 10, 1, 12)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in tmp_path: the generator writes sample/, summary/ and cache/ relative to the working directory."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def small_config(workdir):
+    """GenerationConfig factory for SMALL_ROWS tables in workdir/<data_dir>, with a fixed `now` and no cache."""
+    def make(data_dir='data', months=3, **options):
+        options.setdefault('rows', SMALL_ROWS)
+        config = fb.GenerationConfig(months=months, data_dir=str(workdir / data_dir), cache_dir=None, **options)
+        config.now = NOW
+        return config
+    return make
+
+
+def build_small(config, names=None, workers=1, **options):
+    """Build tables quietly: no samples, and the run report kept out of the way."""
+    return fb.build(names, config=config, samples=False, workers=workers, report=fb.RunReport(config.data_dir), **options)
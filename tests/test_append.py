@@ -0,0 +1,60 @@
+"""append_month() extends the panels by one month exactly as a full build with one more month would."""
+import os
+from datetime import datetime
+
+import pytest
+import pandas as pd
+import pyarrow.parquet as pq
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+APPENDED = [name for name in fb.resolve_tables(list(fb.TABLES)) if fb.TABLES[name]['append']]
+
+
+def assert_same_rows(actual, expected):
+    """Same rows in the same order; the dictionaries of categorical columns may be split differently into chunks."""
+    pd.testing.assert_frame_equal(actual.to_pandas(), expected.to_pandas())
+
+
+@pytest.mark.parametrize('options', [{}, {'layout': 'hive', 'schema': 'compact'}], ids=['flat-text', 'hive-compact'])
+def test_append_matches_full_build(small_config, options):
+    appended = small_config('appended', months=3, end_date=datetime(2025, 8, 31), **options)
+    full = small_config('full', months=4, end_date=datetime(2025, 9, 30), **options)
+    build_small(appended)
+    build_small(full)
+    names, config = fb.append_month(appended.data_dir, report=fb.RunReport(appended.data_dir))
+    assert names == APPENDED
+    assert config.dates == full.dates
+    for name in APPENDED:
+        assert_same_rows(fb.read_table(config, name), fb.read_table(full, name))
+
+
+def test_append_writes_only_the_new_month(small_config):
+    config = small_config(months=3, end_date=datetime(2025, 8, 31), layout='hive')
+    build_small(config)
+    before = {}  # existing as_of_date folders are left as they are
+    for name in APPENDED:
+        if config.partitioned(name):
+            for _, path in fb.hive_files(config.path(name)):
+                before[path] = os.stat(path).st_mtime_ns
+    assert before
+    fb.append_month(config.data_dir, report=fb.RunReport(config.data_dir))
+    for path, mtime in before.items():
+        assert os.stat(path).st_mtime_ns == mtime, path
+    for name in APPENDED:
+        if config.partitioned(name):
+            assert os.path.isdir(os.path.join(config.path(name), 'as_of_date=2025-09-30')), name
+        else:  # tables without an as_of_date partition column are rewritten
+            assert pq.read_table(config.path(name), columns=['as_of_date']).column(0).to_pylist()[-1] == '2025-09-30', name
+
+
+def test_append_twice_continues_from_the_checkpoint(small_config):
+    appended = small_config('appended', months=2, end_date=datetime(2025, 7, 31), schema='compact')
+    full = small_config('full', months=4, end_date=datetime(2025, 9, 30), schema='compact')
+    build_small(appended)
+    build_small(full, APPENDED)
+    fb.append_month(appended.data_dir, report=fb.RunReport(appended.data_dir))
+    _, config = fb.append_month(appended.data_dir, report=fb.RunReport(appended.data_dir))
+    for name in APPENDED:
+        assert_same_rows(fb.read_table(config, name), fb.read_table(full, name))
@@ -0,0 +1,36 @@
+"""load_table() memory-maps a table's Arrow copy only while the copy matches its Parquet output."""
+import os
+
+import pytest
+import pandas as pd
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+
+@pytest.mark.parametrize('options', [{}, {'layout': 'hive', 'schema': 'compact'}], ids=['flat-text', 'hive-compact'])
+def test_touched_parquet_falls_back_until_the_copy_is_refreshed(small_config, monkeypatch, options):
+    config = small_config(**options)
+    build_small(config, ['loans'])
+    assert fb.refresh_arrow_cache(config) == ['customers', 'loans']
+    assert os.path.exists(fb.arrow_path(config, 'loans'))
+    parquet = []
+    read_table = fb.read_table
+    monkeypatch.setattr(fb, 'read_table', lambda config, name, **options: parquet.append(name) or read_table(config, name, **options))
+
+    table = fb.load_table(config, 'loans')
+    assert parquet == []
+    # The copy's dictionaries are one per column, extended chunk by chunk, so compare the values
+    pd.testing.assert_frame_equal(table.to_pandas(), read_table(config, 'loans').to_pandas())
+    assert fb.refresh_arrow_cache(config) == []
+
+    path = fb.hive_files(config.path('loans'))[-1][1] if config.partitioned('loans') else config.path('loans')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))  # touched, not changed
+    assert fb.open_arrow_table(config, 'loans') is None
+    assert fb.load_table(config, 'loans', columns=['loan_id']).num_rows == table.num_rows
+    assert parquet == ['loans']
+
+    assert fb.refresh_arrow_cache(config) == ['loans']
+    fb.load_table(config, 'loans')
+    assert parquet == ['loans']
@@ -0,0 +1,38 @@
+"""build() replaces only the outputs it is asked to write."""
+import os
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+
+def test_build_without_samples_keeps_existing_samples(small_config, workdir):
+    config = small_config()
+    os.makedirs(workdir / fb.SAMPLE_DIR)
+    sample = workdir / fb.SAMPLE_DIR / 'customers_sample.csv'
+    sample.write_text('customer_id\nCUST000001\n')
+    build_small(config, ['customers'])
+    assert sample.read_text() == 'customer_id\nCUST000001\n'
+    fb.build(['customers'], config=config, workers=1, report=fb.RunReport(config.data_dir))
+    assert sample.read_text() != 'customer_id\nCUST000001\n'
+
+
+def test_constant_change_invalidates_only_the_table_and_its_downstream(monkeypatch):
+    config = fb.GenerationConfig(months=3)
+    order = fb.resolve_tables(['write_offs', 'loan_securities', 'loan_applications', 'funding_sources'])
+    before = fb.cache_keys(config, order)
+    monkeypatch.setattr(fb, 'PURPOSES', fb.PURPOSES + ['Boat'])  # used by the loans generator only
+    after = fb.cache_keys(config, order)
+    assert {name for name in order if after[name] != before[name]} == {'loans', 'write_offs', 'loan_securities'}
+
+
+def test_cached_tables_are_reused_after_a_constant_change(small_config, monkeypatch, capsys):
+    config = small_config()
+    config.cache_dir = os.path.join(os.path.dirname(config.data_dir), 'cache')
+    tables = ['market_events', 'liquidity_events']
+    build_small(config, tables)
+    capsys.readouterr()
+    monkeypatch.setattr(fb, 'MARKET_EVENT_TYPES', fb.MARKET_EVENT_TYPES + ['Outage'])
+    build_small(config, tables)
+    output = capsys.readouterr().out.splitlines()
+    assert sorted(line for line in output if line.startswith(('Generating', 'Reusing'))) == [
+        'Generating market_events...', 'Reusing cached liquidity_events...']
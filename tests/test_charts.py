@@ -0,0 +1,33 @@
+"""Charts are redrawn only when their input rows or their plotting code change."""
+import os
+
+import pytest
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+pytest.importorskip('matplotlib')
+
+TABLES = ['customers', 'loans']
+
+
+def chart_files(workdir):
+    return {name: os.stat(workdir / fb.SUMMARY_DIR / name).st_mtime_ns
+            for name, table, *_ in fb.CHARTS if table in TABLES}
+
+
+def test_unchanged_rerun_draws_no_charts(small_config, workdir):
+    config = small_config()
+    build_small(config, TABLES)
+    report = fb.RunReport(config.data_dir)
+    drawn = fb.render_charts(TABLES, config, report=report)
+    assert drawn == sum(table in TABLES for _, table, *_ in fb.CHARTS) > 1
+    before = chart_files(workdir)
+    assert fb.render_charts(TABLES, config, report=report) == 0
+    assert chart_files(workdir) == before
+
+    os.remove(workdir / fb.SUMMARY_DIR / 'customers_state.png')
+    assert fb.render_charts(TABLES, config, report=report) == 1
+    config.seed += 1
+    build_small(config, ['loans'], upstream=False)  # new loans: only the loan charts change
+    assert fb.render_charts(TABLES, config, report=report) == sum(table == 'loans' for _, table, *_ in fb.CHARTS)
@@ -0,0 +1,93 @@
+"""The interaction index merges only added row groups into a from-scratch equivalent, and answers like a table scan."""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+NAME = 'customer_interactions'
+COLUMNS = ['interaction_id', 'customer_id', 'interaction_date', 'interaction_type', 'agent_id', 'interaction_text']
+
+
+@pytest.fixture
+def dataset(small_config, monkeypatch):
+    monkeypatch.setattr(fb, '_INTERACTION_INDEXES', {})
+    config = small_config(months=2)
+    build_small(config, [NAME])
+    return config
+
+
+def read_index(config):
+    """(sorted interactions, {array name: values}) of the index in a data folder."""
+    index_dir = os.path.join(config.mart_dir, fb.INTERACTIONS_INDEX)
+    table = pa.ipc.open_file(pa.memory_map(os.path.join(config.mart_dir, fb.INTERACTIONS_SORTED))).read_all()
+    return table.to_pandas(), {name: np.load(os.path.join(index_dir, f'{name}.npy'))
+                               for name in ('customer_offsets', 'vocabulary', 'token_offsets', 'postings')}
+
+
+def words(text):
+    return set(re.split(r'[\W_]+', (text or '').lower())) - {''}
+
+
+def test_added_row_groups_are_merged_into_the_index(small_config, dataset, capsys):
+    groups = fb.row_groups(dataset, NAME)
+    assert len(groups) > 2
+    full = fb.read_table(dataset, NAME, COLUMNS)
+    # The same table with only its first row groups, as it was before the later ones were added
+    grown = small_config('grown', months=2)
+    columns = fb.table_dataset(dataset, NAME).schema.names
+    os.makedirs(grown.data_dir)
+    with fb.ParquetTableWriter(grown.path(NAME), **grown.writer_options(NAME)) as writer:
+        for group in groups[:2]:
+            writer.write(fb.read_row_group(dataset, NAME, group, columns))
+    first = sum(rows for _, _, rows, _ in groups[:2])
+    assert fb.refresh_interaction_index(grown) == first
+    os.replace(dataset.path(NAME), grown.path(NAME))
+
+    capsys.readouterr()
+    assert fb.refresh_interaction_index(grown) == len(full) - first
+    assert f'({len(groups) - 2} of {len(groups)} row groups)' in capsys.readouterr().out
+    assert fb.refresh_interaction_index(grown) == 0
+
+    os.replace(grown.path(NAME), dataset.path(NAME))
+    assert fb.refresh_interaction_index(dataset) == len(full)
+    merged, merged_arrays = read_index(grown)
+    rebuilt, rebuilt_arrays = read_index(dataset)
+    pd.testing.assert_frame_equal(merged, rebuilt)
+    for name, values in rebuilt_arrays.items():
+        np.testing.assert_array_equal(merged_arrays[name], values, err_msg=name)
+
+
+def test_latest_and_search_match_a_table_scan(dataset):
+    fb.refresh_interaction_index(dataset)
+    index = fb.interaction_index(dataset.data_dir)
+    assert fb.interaction_index(dataset.data_dir) is index
+    table = fb.read_table(dataset, NAME, COLUMNS).to_pandas()
+    table['interaction_date'] = pd.to_datetime(table['interaction_date'])
+    by_customer = table.sort_values(['customer_id', 'interaction_date'], kind='stable')
+
+    customer = table['customer_id'].value_counts().index[0]
+    latest = index.latest(customer, 5)
+    expected = by_customer[by_customer['customer_id'] == customer].iloc[::-1].head(5)
+    assert latest['interaction_id'].tolist() == expected['interaction_id'].tolist()
+    assert latest['interaction_date'].is_monotonic_decreasing
+    assert index.latest('CUST99999').empty
+
+    tokens = by_customer['interaction_text'].map(words)
+    counts = pd.Series([word for found in tokens for word in found]).value_counts()
+    common, rarer = counts.index[0], counts.index[len(counts) // 2]
+    for keywords in [(common,), (common.upper(), rarer)]:
+        matches = tokens.map(lambda found: {keyword.lower() for keyword in keywords} <= found)
+        assert index.search(*keywords)['interaction_id'].tolist() == by_customer[matches]['interaction_id'].tolist()
+    customers = by_customer['customer_id'].unique()[:20].tolist()
+    mentions = by_customer[tokens.map(lambda found: common in found)]
+    within = mentions[mentions['customer_id'].isin(customers)]
+    found = index.search(common, customer_ids=customers)
+    assert len(found) > 0 and found['interaction_id'].tolist() == within['interaction_id'].tolist()
+    assert index.search(common, limit=3)['interaction_id'].tolist() == mentions['interaction_id'].head(3).tolist()
+    assert index.search('zeppelin').empty
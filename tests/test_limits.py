@@ -0,0 +1,59 @@
+"""evaluate_limits() reports breaches of the Risk Appetite Statement thresholds with their severity."""
+import os
+import json
+
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rewrite(config, name, change):
+    """Apply change(DataFrame) to a flat table and write it back in place."""
+    df = pq.read_table(config.path(name)).to_pandas()
+    change(df)
+    pq.write_table(pa.Table.from_pandas(df, schema=pq.read_schema(config.path(name)), preserve_index=False), config.path(name))
+
+
+@pytest.fixture
+def limits():
+    return fb.load_limits(os.path.join(REPO, fb.LIMITS_FILE))
+
+
+def test_thresholds_are_the_risk_appetite_statement(limits):
+    assert {name: limits[name]['hard'] for name in ('lcr', 'nsfr', 'provision_coverage')} == {
+        'lcr': 110, 'nsfr': 105, 'provision_coverage': 0.015}
+    assert limits['nsfr']['soft'] is None and limits['provision_coverage']['soft'] is None
+
+
+def test_injected_breaches_have_their_severity(small_config, limits):
+    config = small_config(months=3)
+    build_small(config, ['liquidity_metrics', 'funding_sources'])
+    # LCR below the hard minimum, between it and the soft one, and above both
+    rewrite(config, 'liquidity_metrics', lambda df: df.__setitem__('LCR', [105.0, 112.0, 130.0]))
+    last = config.dates[-1].strftime('%Y-%m-%d')
+
+    def concentrate(df):  # FS00001 as much as all the other sources together in the last month
+        month = df['as_of_date'] == last
+        df.loc[month & (df['funding_id'] == 'FS00001'), 'amount'] = df.loc[month & (df['funding_id'] != 'FS00001'), 'amount'].sum()
+
+    rewrite(config, 'funding_sources', concentrate)
+    breaches = fb.evaluate_limits(config, limits)
+    lcr = breaches[breaches['limit'] == 'lcr'].set_index('as_of_date')
+    months = [date.strftime('%Y-%m-%d') for date in config.dates]
+    assert lcr['severity'].to_dict() == {months[0]: 'hard', months[1]: 'soft'}
+    assert (lcr['hard'] == 110).all() and (lcr['soft'] == 115).all()
+    funding = breaches[(breaches['limit'] == 'single_funding_source') & (breaches['entity'] == 'FS00001')]
+    assert funding[['as_of_date', 'severity', 'value']].values.tolist() == [[last, 'hard', pytest.approx(0.5)]]
+    assert os.path.exists(os.path.join(config.mart_dir, fb.LIMIT_BREACHES))
+
+
+def test_unknown_limits_are_rejected(tmp_path):
+    path = tmp_path / 'limits.json'
+    path.write_text(json.dumps({'lcr': {'bound': 'min', 'hard': 110}, 'leverage': {'bound': 'max', 'hard': 0.03}}))
+    with pytest.raises(ValueError, match='leverage'):
+        fb.load_limits(str(path))
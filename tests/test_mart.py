@@ -0,0 +1,67 @@
+"""The KPI mart recomputes only the months whose source rows changed and matches a full rebuild."""
+import os
+from datetime import datetime
+
+import pytest
+import pandas as pd
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLES = sorted({source for sources, *_ in fb.MARTS.values() for source in sources})
+
+
+@pytest.fixture
+def limits():
+    return fb.load_limits(os.path.join(REPO, fb.LIMITS_FILE))
+
+
+def read_mart(config, name):
+    return pd.read_parquet(os.path.join(config.mart_dir, f'{name}.parquet'))
+
+
+@pytest.mark.parametrize('options', [{}, {'layout': 'hive', 'schema': 'compact'}], ids=['flat-text', 'hive-compact'])
+def test_append_recomputes_only_the_new_month(small_config, limits, options):
+    appended = small_config('appended', months=3, end_date=datetime(2025, 8, 31), **options)
+    full = small_config('full', months=4, end_date=datetime(2025, 9, 30), **options)
+    build_small(appended)  # append_month() extends every panel
+    build_small(full, TABLES)
+    report = fb.RunReport(appended.data_dir)
+    assert fb.refresh_mart(appended, report, limits) == dict.fromkeys(fb.MARTS, 3)
+    assert fb.refresh_mart(appended, report, limits) == {}
+
+    _, config = fb.append_month(appended.data_dir, report=report)
+    assert fb.refresh_mart(config, report, limits) == dict.fromkeys(fb.MARTS, 1)
+    fb.refresh_mart(full, report, limits)
+    for name in fb.MARTS:
+        pd.testing.assert_frame_equal(read_mart(config, name), read_mart(full, name), obj=name)
+
+
+def test_changed_threshold_recomputes_the_flags(small_config, limits):
+    config = small_config(months=2)
+    build_small(config, ['liquidity_metrics'])
+    fb.refresh_mart(config, limits=limits)
+    kpis = read_mart(config, 'liquidity_kpis')
+    assert (kpis['lcr_breach'] == (kpis['lcr'] < limits['lcr']['hard'])).all()
+    lowered = dict(limits, lcr=dict(limits['lcr'], hard=kpis['lcr'].min()))
+    assert fb.refresh_mart(config, limits=lowered) == {'liquidity_kpis': 2}
+    assert not read_mart(config, 'liquidity_kpis')['lcr_breach'].any()
+
+
+def test_kpi_lookup_filters_by_month_and_dimension(small_config, limits):
+    config = small_config(months=2)
+    build_small(config, ['loans'])
+    fb.refresh_mart(config, limits=limits)
+    month = config.dates[-1]
+    bank = fb.kpi_lookup('credit_kpis', month, data_dir=config.data_dir, geography=fb.MART_ALL, product_type=fb.MART_ALL)
+    loans = fb.read_month(config, 'loans', month.strftime('%Y-%m-%d'), ['capital', 'rwa', 'loan_amount'])
+    assert len(bank) == 1
+    assert bank['loans'].iloc[0] == len(loans)
+    assert bank['car'].iloc[0] == pytest.approx(loans['capital'].sum() / loans['rwa'].sum())
+
+    by_product = fb.kpi_lookup('credit_kpis', month.strftime('%Y-%m-%d'), data_dir=config.data_dir, geography=fb.MART_ALL)
+    assert by_product.loc[by_product['product_type'] != fb.MART_ALL, 'loan_amount'].sum() == pytest.approx(loans['loan_amount'].sum())
+    assert set(fb.kpi_lookup('credit_kpis', data_dir=config.data_dir)['as_of_date']) == {d.strftime('%Y-%m-%d') for d in config.dates}
+    with pytest.raises(ValueError):
+        fb.kpi_lookup('no_such_mart', data_dir=config.data_dir)
@@ -0,0 +1,72 @@
+"""The ontology triple store answers like a scan of the CSVs and reloads only when a CSV changes."""
+import os
+import shutil
+
+import pytest
+
+import ontology
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    """Copies of the ontology CSVs, with an empty in-memory store cache."""
+    monkeypatch.setattr(ontology, '_STORES', {})
+    paths = []
+    for source in ontology.SOURCES:
+        path = tmp_path / os.path.basename(source)
+        shutil.copy(os.path.join(REPO, source), path)
+        paths.append(str(path))
+    return paths, str(tmp_path / 'triples.pickle')
+
+
+def touch(path, line):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('\n' + line + '\n')  # the CSV may not end with a newline
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_patterns_match_a_scan_of_the_csvs(sources):
+    paths, snapshot = sources
+    store = ontology.load_store(paths, snapshot)
+    rows = sorted(set(ontology.read_triples(paths)))
+    assert sorted(store.match()) == rows
+    for pattern in [('credit risk', None, None), (None, 'has_pk', None), (None, None, 'customer_id'),
+                    ('credit risk', 'has dataset', None), (None, 'has_pk', 'loan_id'), ('loans', None, 'loan_id'),
+                    ('loans', 'has_pk', 'loan_id'), ('no such term', None, None)]:
+        expected = [row for row in rows if all(term is None or term == value for term, value in zip(pattern, row))]
+        assert sorted(store.match(*pattern)) == expected, pattern
+
+
+def test_traverse_follows_predicates_both_ways(sources):
+    store = ontology.load_store(*sources)
+    tables = store.objects('credit risk', 'has_table')
+    assert tables and 'loans' in tables
+    fields = store.traverse('credit risk', 'has_table', 'has_field')
+    assert fields == list(dict.fromkeys(field for table in tables for field in store.objects(table, 'has_field')))
+    assert store.traverse('loan_id', '^has_pk') == store.subjects('has_pk', 'loan_id') == ['loans']
+
+
+def test_snapshot_is_used_until_a_csv_changes(sources, monkeypatch):
+    paths, snapshot = sources
+    store = ontology.load_store(paths, snapshot)
+    assert os.path.exists(snapshot)
+    assert ontology.load_store(paths, snapshot) is store  # unchanged: kept in memory
+
+    # A fresh process reads the snapshot, not the CSVs
+    monkeypatch.setattr(ontology, '_STORES', {})
+    from_csv = ontology.TripleStore.from_csv
+    reads = []
+    monkeypatch.setattr(ontology.TripleStore, 'from_csv', classmethod(lambda cls, paths: reads.append(paths) or from_csv(paths)))
+    loaded = ontology.load_store(paths, snapshot)
+    assert reads == [] and sorted(loaded.match()) == sorted(store.match())
+
+    touch(paths[1], 'new risk,has_table,loans')
+    changed = ontology.load_store(paths, snapshot)
+    assert len(reads) == 1
+    assert changed.objects('new risk', 'has_table') == ['loans']
+    # The refreshed snapshot is current again
+    monkeypatch.setattr(ontology, '_STORES', {})
+    assert ontology.load_store(paths, snapshot).objects('new risk', 'has_table') == ['loans'] and len(reads) == 1
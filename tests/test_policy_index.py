@@ -0,0 +1,91 @@
+"""The policy BM25 index re-tokenizes only changed documents and scores like a direct BM25 computation."""
+import os
+import glob
+import shutil
+from math import log
+
+import pytest
+
+import policy_index
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def policies(tmp_path, monkeypatch):
+    """(folder with a copy of the policy documents, texts of the documents tokenized), with no index in memory."""
+    monkeypatch.setattr(policy_index, '_INDEXES', {})
+    for path in glob.glob(os.path.join(REPO, policy_index.POLICIES_DIR, '*.md')):
+        shutil.copy(path, tmp_path)
+    tokenized = []
+    index_document = policy_index.index_document
+    monkeypatch.setattr(policy_index, 'index_document', lambda text: tokenized.append(text) or index_document(text))
+    return str(tmp_path), tokenized
+
+
+def edit(path, text):
+    """Append text to a document, moving its mtime on so the change is seen even within the clock's resolution."""
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(text)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_rebuild_tokenizes_only_changed_documents(policies):
+    root, tokenized = policies
+    documents = policy_index.policy_files(root)
+    index, changed = policy_index.build_index(root)
+    assert changed == len(tokenized) == len(documents) > 1
+    assert os.path.exists(os.path.join(root, policy_index.INDEX))
+
+    index, changed = policy_index.build_index(root)
+    assert changed == 0 and len(tokenized) == len(documents)
+
+    edit(documents[0], '\n## Zeppelin Exposure\n\nZeppelin exposures are escalated to the board.\n')
+    os.remove(documents[1])
+    index, changed = policy_index.build_index(root)
+    assert changed == 1 and len(tokenized) == len(documents) + 1
+    assert {name for name, *_ in index.sections} == {os.path.basename(path) for path in documents if path != documents[1]}
+    score, name, heading, _, text = index.search('zeppelin escalation', 1)[0]
+    assert name == os.path.basename(documents[0]) and heading.endswith('Zeppelin Exposure')
+
+    _, changed = policy_index.build_index(root, rebuild=True)
+    assert changed == len(documents) - 1
+
+
+def test_search_scores_are_bm25(policies):
+    root, _ = policies
+    index, _ = policy_index.build_index(root)
+    sections = [policy_index.tokenize(text) for *_, text in index.sections]
+    average = sum(map(len, sections)) / len(sections)
+    query = 'LCR limit escalation'
+    terms = set(policy_index.tokenize(query))
+    expected = {}
+    for section_id, tokens in enumerate(sections):
+        score = 0.0
+        for term in terms:
+            frequency = tokens.count(term)
+            if frequency:
+                containing = sum(term in other for other in sections)
+                idf = log(1 + (len(sections) - containing + 0.5) / (containing + 0.5))
+                norm = policy_index.K1 * (1 - policy_index.B + policy_index.B * len(tokens) / average)
+                score += idf * frequency * (policy_index.K1 + 1) / (frequency + norm)
+        if score:
+            expected[section_id] = score
+    assert index.scores(query) == pytest.approx(expected)
+    best = sorted(expected, key=expected.get, reverse=True)[:3]
+    assert [result[1:3] for result in index.search(query, 3)] == [index.sections[section_id][:2] for section_id in best]
+
+
+def test_load_index_rebuilds_only_when_a_document_changes(policies):
+    root, tokenized = policies
+    documents = policy_index.policy_files(root)
+    index = policy_index.load_index(root)
+    assert policy_index.load_index(root) is index
+    assert len(tokenized) == len(documents)
+
+    edit(documents[-1], '\nAn added sentence about quokka limits.\n')
+    reloaded = policy_index.load_index(root)
+    assert reloaded is not index and len(tokenized) == len(documents) + 1
+    assert reloaded.search('quokka', 1)[0][1] == os.path.basename(documents[-1])
+    assert policy_index.load_index(root) is reloaded
@@ -0,0 +1,37 @@
+"""Subset tiers pass validation on their own, keep whole customers, and nest."""
+import os
+
+import pytest
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+
+def column(config, name, column):
+    return set(fb.read_table(config, name, [column]).column(column).to_pylist())
+
+
+@pytest.mark.parametrize('options', [{}, {'layout': 'hive', 'schema': 'compact'}], ids=['flat-text', 'hive-compact'])
+def test_tiers_are_valid_nested_datasets(small_config, options):
+    config = small_config(months=2, **options)
+    build_small(config)
+    tiers = {}
+    for tier in fb.SUBSET_TIERS:
+        rows = fb.write_subset(config, tier, report=fb.RunReport(config.data_dir))
+        tiers[tier] = fb.subset_config(tier, config.data_dir)
+        assert tiers[tier].data_dir == os.path.join(config.data_dir, fb.SUBSET_DIR, tier)
+        assert 0 < rows['loans'] < fb.table_rows(config, 'loans')
+        assert rows['funding_sources'] == fb.table_rows(config, 'funding_sources')
+        result = fb.validate(tiers[tier], report=fb.RunReport(tiers[tier].data_dir))
+        assert result['checks'] == [], tier
+        assert result['tables']['customers'] == rows['customers']
+
+    small, large = tiers['1pct'], tiers['10pct']
+    customers = column(small, 'customers', 'customer_id')
+    assert 0 < len(customers) < len(column(large, 'customers', 'customer_id'))
+    assert customers <= column(large, 'customers', 'customer_id')
+    assert column(small, 'loans', 'customer_id') <= customers
+    assert column(small, 'write_offs', 'loan_id') <= column(small, 'loans', 'loan_id')
+    # Whole customers: every loan of a kept customer is kept
+    loans = fb.read_table(config, 'loans', ['loan_id', 'customer_id']).to_pandas()
+    assert column(small, 'loans', 'loan_id') == set(loans.loc[loans['customer_id'].isin(customers), 'loan_id'])
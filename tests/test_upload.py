@@ -0,0 +1,290 @@
+"""upload.py against moto's in-process S3, with throttling injected into the client's requests."""
+import os
+import threading
+import time
+
+import pytest
+
+moto = pytest.importorskip('moto')
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import EndpointConnectionError
+
+import upload
+
+BUCKET = 'fakebank-test'
+SLOW_DOWN = (b'<?xml version="1.0" encoding="UTF-8"?>'
+             b'<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>')
+
+
+class Body:
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+
+class Requests:
+    """Counts the requests of one S3 operation as they are sent; the first `throttled` get a 503 SlowDown
+    (or raise `error`) and each request is held for `hold` seconds, so concurrent uploads overlap."""
+
+    def __init__(self, client, operation='PutObject', throttled=0, hold=0.0, error=None):
+        self.throttled, self.hold, self.error = throttled, hold, error
+        self.sent = self.active = self.max_active = 0
+        self.lock = threading.Lock()
+        # Ahead of moto's own handler, which answers every request it sees
+        client.meta.events.register_first(f'before-send.s3.{operation}', self)
+
+    def __call__(self, request, **kwargs):
+        with self.lock:
+            self.sent += 1
+            throttle = self.sent <= self.throttled
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.hold)
+        with self.lock:
+            self.active -= 1
+        if throttle and self.error is not None:
+            raise self.error
+        if throttle:
+            return AWSResponse(request.url, 503, {}, Body(SLOW_DOWN))
+        return None
+
+
+class Backoff:
+    """Stands in for upload.random: records the upper bound of each backoff delay and waits none of it."""
+
+    def __init__(self):
+        self.bounds = []
+
+    def uniform(self, low, high):
+        self.bounds.append(high)
+        return 0.0
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing', 'AWS_SESSION_TOKEN': 'testing',
+                        'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1', config=upload.client_config(4))
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def list_client(s3):
+    """A client keeping botocore's standard retries, as upload.py uses for the --sync listing and deletes."""
+    return boto3.client('s3', region_name='us-east-1', config=upload.client_config(1, retries=True))
+
+
+@pytest.fixture
+def backoff(monkeypatch):
+    backoff = Backoff()
+    monkeypatch.setattr(upload, 'random', backoff)
+    return backoff
+
+
+def write_files(root, count, size=1000):
+    """count files of `size` bytes under root/a and root/b; returns {relative path: bytes}."""
+    files = {}
+    for i in range(count):
+        rel = os.path.join('a' if i % 2 else 'b', f'file-{i:03d}.bin')
+        os.makedirs(root / os.path.dirname(rel), exist_ok=True)
+        content = os.urandom(size)
+        (root / rel).write_bytes(content)
+        files[rel.replace(os.sep, '/')] = content
+    return files
+
+
+def remote_objects(s3, prefix):
+    return {key: s3.get_object(Bucket=BUCKET, Key=key)['Body'].read() for key in upload.list_objects(s3, BUCKET, prefix)}
+
+
+def test_upload_tree_sends_every_file_concurrently(s3, tmp_path):
+    files = write_files(tmp_path, 20)
+    requests = Requests(s3, hold=0.05)
+    results = upload.upload_tree(s3, str(tmp_path), BUCKET, 'data', workers=4)
+    assert sorted(r[1] for r in results) == sorted(f'data/{rel}' for rel in files)
+    assert all(r[2] == 'ok' for r in results)
+    assert remote_objects(s3, 'data') == {f'data/{rel}': content for rel, content in files.items()}
+    assert requests.sent == 20
+    assert 1 < requests.max_active <= 4
+
+
+def test_upload_tree_queue_stays_bounded(s3, tmp_path):
+    files = write_files(tmp_path, 30)
+    requests = Requests(s3, hold=0.02)
+    ahead = []
+
+    def listing():
+        for rel in files:
+            # Files taken from the walk but not yet sent: the queue, one in each worker and this one
+            ahead.append(len(ahead) - requests.sent)
+            yield str(tmp_path / rel), f'data/{rel}'
+
+    results = upload.upload_tree(s3, str(tmp_path), BUCKET, 'data', workers=2, queue_size=3, files=listing())
+    assert len(results) == 30 and all(r[2] == 'ok' for r in results)
+    assert max(ahead) <= 3 + 2 + 1
+
+
+def test_throttled_upload_is_retried_with_growing_backoff(s3, tmp_path, backoff):
+    write_files(tmp_path, 1)
+    requests = Requests(s3, throttled=2)
+    results = upload.upload_tree(s3, str(tmp_path), BUCKET, 'data', workers=1)
+    assert [r[2] for r in results] == ['ok']
+    # One request per attempt: botocore does not retry on its own as well
+    assert requests.sent == 3
+    assert backoff.bounds == [upload.BACKOFF_SECONDS, 2 * upload.BACKOFF_SECONDS]
+
+
+def test_upload_fails_after_max_attempts(s3, tmp_path, backoff):
+    write_files(tmp_path, 1)
+    requests = Requests(s3, throttled=100)
+    results = upload.upload_tree(s3, str(tmp_path), BUCKET, 'data', workers=1, max_attempts=3)
+    assert [r[2] for r in results] == ['failed']
+    assert requests.sent == 3
+    assert len(backoff.bounds) == 2
+
+
+def test_connection_errors_are_retried(s3, tmp_path, backoff):
+    write_files(tmp_path, 1)
+    requests = Requests(s3, throttled=1, error=EndpointConnectionError(endpoint_url='https://s3.amazonaws.com'))
+    results = upload.upload_tree(s3, str(tmp_path), BUCKET, 'data', workers=1)
+    assert [r[2] for r in results] == ['ok']
+    assert requests.sent == 2
+    assert backoff.bounds == [upload.BACKOFF_SECONDS]
+
+
+def test_other_errors_are_not_retried(s3, tmp_path, backoff):
+    write_files(tmp_path, 2)
+    results = upload.upload_tree(s3, str(tmp_path), 'no-such-bucket', 'data', workers=2)
+    assert [r[2] for r in results] == ['failed', 'failed']
+    assert backoff.bounds == []
+
+
+def test_summarize_reports_throughput(s3, tmp_path):
+    write_files(tmp_path, 4, size=250_000)
+    results = upload.upload_tree(s3, str(tmp_path), BUCKET, 'data', workers=2)
+    results.append((str(tmp_path / 'missing'), 'data/missing', 'failed', 5_000))
+    totals = upload.summarize(results, 'data', elapsed=2.0)
+    assert (totals['total'], totals['ok'], totals['failed']) == (5, 4, 1)
+    assert totals['megabytes'] == pytest.approx(1.0)
+    assert totals['mb_per_second'] == pytest.approx(0.5)
+    assert totals['objects_per_second'] == pytest.approx(2.0)
+    assert 'mb_per_second' not in upload.summarize(results, 'data')
+
+
+# ==== --sync ====
+
+def sync(s3, root, manifest, **options):
+    options.setdefault('workers', 2)
+    return upload.sync_tree(s3, str(root), BUCKET, 'data', manifest, **options)
+
+
+def statuses(results):
+    return {r[1]: r[2] for r in results}
+
+
+def test_sync_sends_only_new_and_changed_files(s3, tmp_path):
+    files = write_files(tmp_path, 6)
+    manifest = {}
+    assert set(statuses(sync(s3, tmp_path, manifest)).values()) == {'ok'}
+
+    requests = Requests(s3)
+    assert set(statuses(sync(s3, tmp_path, manifest)).values()) == {'unchanged'}
+    assert requests.sent == 0
+
+    changed, removed = list(files)[:2]
+    (tmp_path / changed).write_bytes(os.urandom(1000))  # same size, new content
+    stat = os.stat(tmp_path / changed)
+    os.utime(tmp_path / changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    (tmp_path / removed).unlink()
+    (tmp_path / 'c').mkdir()
+    (tmp_path / 'c' / 'new.bin').write_bytes(os.urandom(500))
+    results = sync(s3, tmp_path, manifest, delete=True)
+    assert requests.sent == 2
+    assert statuses(results) == {**{f'data/{rel}': 'unchanged' for rel in list(files)[2:]}, f'data/{changed}': 'ok',
+                                 'data/c/new.bin': 'ok', f'data/{removed}': 'deleted'}
+    local = {rel: (tmp_path / rel).read_bytes() for rel in [*files, 'c/new.bin'] if rel != removed}
+    assert remote_objects(s3, 'data') == {f'data/{rel}': content for rel, content in local.items()}
+
+
+def test_sync_listing_and_deletes_are_retried(s3, list_client, tmp_path):
+    files = write_files(tmp_path, 4)
+    sync(s3, tmp_path, {})
+    removed = list(files)[0]
+    (tmp_path / removed).unlink()
+    listings = Requests(list_client, 'ListObjectsV2', throttled=1)
+    deletes = Requests(list_client, 'DeleteObjects', throttled=1)
+    results = sync(s3, tmp_path, {}, delete=True, list_client=list_client)
+    assert (listings.sent, deletes.sent) == (2, 2)
+    assert statuses(results)[f'data/{removed}'] == 'deleted'
+    assert sorted(upload.list_objects(s3, BUCKET, 'data')) == sorted(f'data/{rel}' for rel in list(files)[1:])
+
+
+def test_sync_dry_run_reports_the_delta_and_bytes_saved(s3, tmp_path):
+    files = write_files(tmp_path, 4, size=250_000)
+    manifest = {}
+    sync(s3, tmp_path, manifest)
+    before = remote_objects(s3, 'data')
+    first = list(files)[0]
+    (tmp_path / first).unlink()
+    (tmp_path / 'c').mkdir()
+    (tmp_path / 'c' / 'new.bin').write_bytes(os.urandom(100_000))
+
+    requests = Requests(s3)
+    results = sync(s3, tmp_path, manifest, dry_run=True, delete=True)
+    assert requests.sent == 0
+    assert remote_objects(s3, 'data') == before
+    assert statuses(results) == {**{f'data/{rel}': 'unchanged' for rel in list(files)[1:]}, 'data/c/new.bin': 'dry-run',
+                                 f'data/{first}': 'dry-run-delete'}
+    totals = upload.summarize(results, 'data')
+    assert totals['unchanged'] == 3
+    assert totals['unchanged_megabytes'] == pytest.approx(0.75)
+    assert totals['megabytes'] == pytest.approx(0.1)
+    assert totals['deleted'] == 1
+
+
+def test_sync_matches_multipart_etags(s3, tmp_path):
+    config = upload.TransferConfig(multipart_threshold=5 * 1024 * 1024, multipart_chunksize=5 * 1024 * 1024)
+    (tmp_path / 'large.bin').write_bytes(os.urandom(11 * 1024 * 1024))
+    etag = upload.file_etag(str(tmp_path / 'large.bin'), config)
+    assert etag.endswith('-3')
+    manifest = {}
+    assert statuses(sync(s3, tmp_path, manifest, config=config)) == {'data/large.bin': 'ok'}
+    assert upload.list_objects(s3, BUCKET, 'data') == {'data/large.bin': (11 * 1024 * 1024, etag)}
+    assert statuses(sync(s3, tmp_path, manifest, config=config)) == {'data/large.bin': 'unchanged'}
+
+
+def test_sync_hashes_only_files_changed_since_the_manifest(s3, tmp_path, monkeypatch):
+    root = tmp_path / 'data'
+    files = write_files(root, 4)
+    manifest = {}
+    sync(s3, root, manifest)
+    path = str(tmp_path / upload.MANIFEST)
+    upload.save_manifest(path, manifest)
+    hashed = []
+    file_etag = upload.file_etag
+    monkeypatch.setattr(upload, 'file_etag', lambda path, config: hashed.append(path) or file_etag(path, config))
+    first = list(files)[0]
+    stat = os.stat(root / first)
+    os.utime(root / first, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))  # touched, not changed
+    results = sync(s3, root, upload.load_manifest(path))
+    assert hashed == [str(root / first)]
+    assert set(statuses(results).values()) == {'unchanged'}
+
+
+def test_run_artefacts_are_not_published(s3, tmp_path):
+    files = write_files(tmp_path, 2)
+    for rel in ['_checkpoint.json', 'run_report.json', 'validation_report.json', '_profiles/generate-loans-00000.prof',
+                '_parts/loans/part-00000.parquet', 'loans/as_of_date=2025-09-30/_checkpoint.json']:
+        os.makedirs(tmp_path / os.path.dirname(rel), exist_ok=True)
+        (tmp_path / rel).write_bytes(b'{}')
+    (tmp_path / 'loans' / 'as_of_date=2025-09-30' / 'part-00000.parquet').write_bytes(b'PAR1')
+    expected = sorted([*(f'data/{rel}' for rel in files), 'data/loans/as_of_date=2025-09-30/part-00000.parquet'])
+    assert sorted(key for _, key in upload.tree_keys(str(tmp_path), 'data')) == expected
+    sync(s3, tmp_path, {})
+    assert sorted(upload.list_objects(s3, BUCKET, 'data')) == expected
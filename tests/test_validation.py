@@ -0,0 +1,99 @@
+"""validate() passes generated tables and catches violations injected into them."""
+import pytest
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+TABLES = ['customers', 'loans', 'write_offs', 'market_positions', 'market_risk_metrics']
+
+
+def rewrite(config, name, change):
+    """Apply change(DataFrame) to a flat table and write it back in place."""
+    df = pq.read_table(config.path(name)).to_pandas()
+    change(df)
+    pq.write_table(pa.Table.from_pandas(df, schema=pq.read_schema(config.path(name)), preserve_index=False), config.path(name))
+
+
+def failures(result):
+    """(table, check, column) -> (violations, examples) of a validate() result."""
+    return {(check['table'], check['check'], check['column']): (check['violations'], check['examples'])
+            for check in result['checks']}
+
+
+@pytest.fixture
+def dataset(small_config):
+    config = small_config(months=2)
+    build_small(config, TABLES)
+    return config
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_generated_tables_pass(small_config, workers):
+    config = small_config(months=2, layout='hive', schema='compact')
+    build_small(config)
+    result = fb.validate(config, workers=workers, report=fb.RunReport(config.data_dir))
+    assert result['checks'] == []
+    assert result['tables']['loans'] == 2 * config.rows['loans']
+
+
+def test_injected_violations_are_reported(dataset):
+    def loans(df):
+        df.loc[0, 'credit_rating'] = 'Z'
+        df.loc[1, 'interest_rate'] = 150.0
+        df.loc[2, 'loan_amount'] = -5.0
+        df.loc[3, 'sales_channel'] = None
+        df.loc[4, 'customer_id'] = 'CUST99999'
+        df.loc[5, 'loan_id'] = df.loc[6, 'loan_id']  # same as_of_date, so a duplicate key
+        df.loc[7, 'maturity_date'] = df.loc[7, 'origination_date'] - pd.Timedelta(days=1)
+    rewrite(dataset, 'loans', loans)
+
+    def write_offs(df):
+        df.loc[0, 'loan_id'] = 'LOAN999999'
+        df.loc[1, 'reason'] = 'Lost'
+    rewrite(dataset, 'write_offs', write_offs)
+
+    def positions(df):
+        df.loc[0, 'as_of_date'] = '2020-01-31'
+    rewrite(dataset, 'market_positions', positions)
+
+    found = failures(fb.validate(dataset, report=fb.RunReport(dataset.data_dir)))
+    expected = {
+        ('loans', 'enum', 'credit_rating'): (1, ['Z']),
+        ('loans', 'max', 'interest_rate'): (1, ['150.0']),
+        ('loans', 'min', 'loan_amount'): (1, ['-5.0']),
+        ('loans', 'not_null', 'sales_channel'): (1, ['None']),
+        ('loans', 'references customers', 'customer_id'): (1, ['CUST99999']),
+        ('write_offs', 'references loans', 'loan_id'): (1, ['LOAN999999']),
+        ('write_offs', 'enum', 'reason'): (1, ['Lost']),
+        ('market_positions', 'as_of_date', 'as_of_date'): (1, ['2020-01-31']),
+    }
+    for key, value in expected.items():
+        assert found.pop(key) == value, key
+    violations, examples = found.pop(('loans', 'unique', 'loan_id'))
+    assert violations == 1 and examples == [pq.read_table(dataset.path('loans')).column('loan_id')[6].as_py()]
+    assert found.pop(('loans', 'after as_of_date', 'maturity_date'))[0] >= 1
+    # The position moved out of the run leaves its risk metric without a matching position
+    assert found.pop(('market_risk_metrics', 'references market_positions', 'position_id'))[0] == 1
+    assert found == {}
+
+
+def test_malformed_ids_are_format_violations(dataset):
+    def loans(df):
+        df.loc[0, 'loan_id'] = 'LOAN000001X'
+        df.loc[1, 'customer_id'] = 'XYZ00001'
+        df.loc[2, 'customer_id'] = 'CUST'
+    rewrite(dataset, 'loans', loans)
+    found = failures(fb.validate(dataset, report=fb.RunReport(dataset.data_dir)))
+    assert found == {
+        ('loans', 'format', 'loan_id'): (1, ['LOAN000001X']),
+        ('loans', 'format', 'customer_id'): (2, ['XYZ00001', 'CUST']),
+    }
+
+
+def test_compact_table_nulls_malformed_ids():
+    table = pa.table({'loan_id': ['LOAN000001', 'LOAN000001X', 'XYZ000002', None, 'LOAN12', 'LOAN1234567890'],
+                      'customer_id': ['CUST00001'] * 6})
+    assert fb.compact_table(table, 'write_offs').column('loan_id').to_pylist() == [1, None, None, None, 12, None]
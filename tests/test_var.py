@@ -0,0 +1,37 @@
+"""Historical-simulation market_risk_metrics agree with historical_var() and read their sources once."""
+import numpy as np
+import pytest
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+TABLES = ['market_positions', 'instrument_prices', 'market_risk_metrics']
+
+
+@pytest.mark.parametrize('options', [{}, {'layout': 'hive', 'schema': 'compact'}], ids=['flat-text', 'hive-compact'])
+def test_market_risk_metrics_match_historical_var(small_config, options):
+    config = small_config(months=15, var_model='historical', **options)
+    build_small(config, TABLES)
+    as_of_date = config.dates[-1].strftime('%Y-%m-%d')
+    expected = fb.historical_var(config, as_of_date)['positions']
+    metrics = fb.text_ids(fb.read_month(config, 'market_risk_metrics', as_of_date, ['position_id', 'VaR', 'SVaR', 'expected_shortfall']),
+                          'market_risk_metrics')
+    merged = fb.text_ids(expected, 'market_positions').merge(metrics, on='position_id', validate='one_to_one')
+    assert len(merged) == len(expected) == config.rows['market_positions']
+    np.testing.assert_allclose(merged['VaR'], merged['var_99'].round(2))
+    np.testing.assert_allclose(merged['SVaR'], merged['svar_99'].round(2))
+    np.testing.assert_allclose(merged['expected_shortfall'], merged['es_99'].round(2))
+
+
+def test_scenarios_are_computed_once_per_dataset(small_config, monkeypatch):
+    config = small_config(months=6, var_model='historical')
+    build_small(config, TABLES[:2])
+    calls = []
+    instrument_returns = fb.instrument_returns
+    monkeypatch.setattr(fb, 'instrument_returns', lambda config: calls.append('returns') or instrument_returns(config))
+    month_exposures = fb.month_exposures
+    monkeypatch.setattr(fb, 'month_exposures', lambda config: calls.append('exposures') or month_exposures(config))
+    monkeypatch.setattr(fb, '_MONTH_SCENARIOS', {})
+    build_small(config, TABLES[2:], upstream=False)
+    assert calls == ['returns', 'exposures']
+    assert fb.table_rows(config, 'market_risk_metrics') == 6 * config.rows['market_positions']
@@ -0,0 +1,51 @@
+"""Generation output does not depend on the number of worker processes."""
+import os
+import json
+
+import pytest
+import pyarrow.parquet as pq
+
+import generate_fakebank_data as fb
+from tests.conftest import build_small
+
+
+def output_files(data_dir):
+    """Relative path -> bytes of every file a build leaves in data_dir, except the timings in the run report."""
+    files = {}
+    for root, _, names in os.walk(data_dir):
+        for name in names:
+            if name != fb.RUN_REPORT:
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    files[os.path.relpath(path, data_dir)] = f.read()
+    return files
+
+
+def differing_columns(first, second):
+    a, b = pq.read_table(first), pq.read_table(second)
+    return [column for column in a.column_names if not a[column].equals(b[column])]
+
+
+@pytest.mark.parametrize('options', [{}, {'layout': 'hive', 'schema': 'compact'}], ids=['flat-text', 'hive-compact'])
+def test_output_matches_for_any_worker_count(small_config, options):
+    # config.now is fixed, so the date columns drawn relative to it (interaction_date, ages) match as well
+    serial, parallel = small_config('serial', **options), small_config('parallel', **options)
+    build_small(serial, workers=1)
+    build_small(parallel, workers=4)
+    expected, actual = output_files(serial.data_dir), output_files(parallel.data_dir)
+    assert sorted(actual) == sorted(expected)
+    for name in expected:
+        if name.endswith('.parquet'):
+            assert actual[name] == expected[name], (name, differing_columns(os.path.join(serial.data_dir, name),
+                                                                            os.path.join(parallel.data_dir, name)))
+        else:  # the checkpoint's tables are in the order they finished
+            assert json.loads(actual[name]) == json.loads(expected[name]), name
+
+
+def test_exact_sampling_matches_for_any_worker_count(small_config):
+    serial, parallel = small_config('serial', sampling='exact'), small_config('parallel', sampling='exact')
+    tables = ['customers', 'customer_interactions']
+    build_small(serial, tables, workers=1)
+    build_small(parallel, tables, workers=3)
+    for name in tables:
+        assert pq.read_table(parallel.path(name)).equals(pq.read_table(serial.path(name))), name
@@ -8,65 +8,292 @@ and all files from `policies/` to s3://<bucket>/<policies-prefix>/
 Usage examples:
   python upload.py --bucket fakebankdata
   python upload.py --bucket my-bucket --profile myawsprofile --dry-run
+  python upload.py --bucket fakebankdata --workers 16
+  python upload.py --bucket test --endpoint-url http://localhost:9000   # MinIO / moto server
+  python upload.py --bucket fakebankdata --sync --dry-run   # show what a sync would send
+  python upload.py --bucket fakebankdata --sync --delete
 
 Notes:
 - This script assumes AWS credentials are available via environment, shared credentials file or role.
 - Do not embed credentials in scripts.
+- Files are uploaded by a pool of worker threads sharing one S3 client; each
+  large file is additionally split into parts by the TransferConfig.
+- --sync compares local files with one listing of the destination prefix and
+  only sends new or changed files; ETags of local files are cached in a
+  manifest so unchanged files are not re-hashed.
+- Uploads are retried per file (throttling, unavailable service, dropped
+  connections); listing and deletes use a second client that keeps botocore's
+  standard retries.
+- Run artefacts are not published: `_`-prefixed files and folders (e.g.
+  data/_checkpoint.json, data/_profiles/) and the run and validation reports.
 """
 import os
 import sys
+import json
+import time
+import queue
+import random
+import hashlib
 import argparse
 import logging
+import threading
+from functools import partial
 
 try:
     import boto3
-    from botocore.exceptions import ClientError
+    import botocore.exceptions
+    from botocore.config import Config
+    from botocore.exceptions import BotoCoreError, ClientError
+    from boto3.exceptions import S3UploadFailedError
     from boto3.s3.transfer import TransferConfig
+    from s3transfer.utils import ChunksizeAdjuster
 except Exception:
     print("boto3 is required. Install with: pip install boto3")
     sys.exit(1)
 
 
+# Files uploaded concurrently, and parts per file uploaded concurrently by the TransferConfig
+WORKERS = 8
+PART_CONCURRENCY = 4
+
+# Error codes for throttled or briefly unavailable requests, retried with backoff
+RETRY_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+               'RequestTimeout', 'ServiceUnavailable', 'InternalError', '500', '503'}
+# Connection failures and timeouts, retried like RETRY_CODES (the classes botocore's standard retry mode retries)
+RETRY_ERRORS = (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError)
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 0.5  # first retry waits up to this long, doubling per attempt
+
+# Local cache of file ETags for --sync: {"s3://bucket/key": {"size", "mtime_ns", "etag"}}
+MANIFEST = '.upload_manifest.json'
+
+# Run artefacts kept next to the published files, which change on every run: files and folders whose
+# name starts with PRIVATE_PREFIX (checkpoint, cProfile stats, partition scratch, KPI mart, Arrow cache, subsets, policy index) and the reports
+PRIVATE_PREFIX = '_'
+REPORT_FILES = {'run_report.json', 'validation_report.json'}
+
+
 def iter_files(root_dir):
-    """Yield full file paths under root_dir (skip directories)."""
-    for dirpath, _, filenames in os.walk(root_dir):
-        for name in filenames:
-            yield os.path.join(dirpath, name)
+    """Yield full file paths under root_dir (skip directories and run artefacts)."""
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith(PRIVATE_PREFIX))
+        for name in sorted(filenames):
+            if not name.startswith(PRIVATE_PREFIX) and name not in REPORT_FILES:
+                yield os.path.join(dirpath, name)
+
+
+def tree_keys(local_root, s3_prefix):
+    """(path, key) for every file under local_root."""
+    for path in iter_files(local_root):
+        rel = os.path.relpath(path, local_root)
+        yield path, s3_prefix.rstrip('/') + '/' + rel.replace(os.sep, '/')
+
+
+def file_etag(path, config):
+    """The ETag S3 gives the file when uploaded with `config`: the MD5, or for
+    multipart uploads the MD5 of the part MD5s followed by -<parts>."""
+    size = os.path.getsize(path)
+    if size < config.multipart_threshold:
+        chunksize = max(size, 1)
+    else:
+        chunksize = ChunksizeAdjuster().adjust_chunksize(config.multipart_chunksize, size)
+    digests = []
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), b''):
+            digests.append(hashlib.md5(chunk).digest())
+    if size < config.multipart_threshold:
+        return digests[0].hex() if digests else hashlib.md5(b'').hexdigest()
+    return f'{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}'
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def cached_etag(manifest, bucket, key, path, config):
+    """A file's ETag from the manifest when its size and mtime are unchanged, otherwise hashed and recorded."""
+    stat = os.stat(path)
+    entry = manifest.get(f's3://{bucket}/{key}')
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['etag']
+    etag = file_etag(path, config)
+    manifest[f's3://{bucket}/{key}'] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'etag': etag}
+    return etag
+
+
+def list_objects(s3_client, bucket, s3_prefix):
+    """{key: (size, etag)} for every object under the prefix, from one paginated listing."""
+    objects = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=s3_prefix.rstrip('/') + '/'):
+        for obj in page.get('Contents', []):
+            objects[obj['Key']] = (obj['Size'], obj['ETag'].strip('"'))
+    return objects
+
 
+def sync_tree(s3_client, local_root, bucket, s3_prefix, manifest, config=None, dry_run=False, delete=False, list_client=None,
+              **options):
+    """Upload only the files under local_root whose key is missing or differs (size/ETag) under the prefix.
 
-def upload_file(s3_client, filename, bucket, key, config=None):
-    try:
-        s3_client.upload_file(filename, bucket, key, ExtraArgs={"ACL": "private"}, Config=config)
-        logging.info("Uploaded %s -> s3://%s/%s", filename, bucket, key)
-        return True
-    except ClientError as e:
-        logging.error("Failed to upload %s -> s3://%s/%s : %s", filename, bucket, key, e)
-        return False
+    With `delete`, objects under the prefix with no local file are removed.
+    The listing and deletes go through `list_client` (default s3_client),
+    which should keep botocore's retries (see client_config).
+    Returns upload_tree() results plus (path, key, 'unchanged', bytes) and
+    (None, key, 'deleted' or 'dry-run-delete', bytes) entries.
+    """
+    if not os.path.isdir(local_root):
+        logging.warning("Local folder %s does not exist, skipping", local_root)
+        return []
+    config = config or TransferConfig()
+    list_client = list_client or s3_client
+    remote = list_objects(list_client, bucket, s3_prefix)
+    changed, results = [], []
+    for path, key in tree_keys(local_root, s3_prefix):
+        size = os.path.getsize(path)
+        if remote.pop(key, None) == (size, cached_etag(manifest, bucket, key, path, config)):
+            results.append((path, key, 'unchanged', size))
+        else:
+            changed.append((path, key))
+    results += upload_tree(s3_client, local_root, bucket, s3_prefix, config=config, dry_run=dry_run, files=changed, **options)
+    if delete:
+        orphans = sorted(remote)
+        for start in range(0, len(orphans), 1000):  # delete_objects takes up to 1000 keys
+            batch = orphans[start:start + 1000]
+            if dry_run:
+                for key in batch:
+                    logging.info("[dry-run] would delete s3://%s/%s", bucket, key)
+            else:
+                response = list_client.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+                for error in response.get('Errors', []):
+                    logging.error("Failed to delete s3://%s/%s : %s", bucket, error['Key'], error.get('Message'))
+                logging.info("Deleted %d orphaned objects under s3://%s/%s", len(batch) - len(response.get('Errors', [])), bucket, s3_prefix)
+            results += [(None, key, 'dry-run-delete' if dry_run else 'deleted', remote[key][0]) for key in batch]
+    return results
+
+
+def error_code(error):
+    """S3 error code of a failed call; upload_file wraps the ClientError in an S3UploadFailedError."""
+    if isinstance(error, S3UploadFailedError):
+        error = error.__context__
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+def retryable(error):
+    """True for a throttled or unavailable request, or a connection that failed, dropped or timed out."""
+    return error_code(error) in RETRY_CODES or isinstance(error, RETRY_ERRORS)
+
+
+def client_config(workers=WORKERS, retries=False):
+    """Client settings with a pooled connection for every concurrent part upload.
+
+    The upload client has no retries inside botocore, since upload_file()
+    retries files itself and the attempts would multiply; with `retries`
+    (the client for listing and deletes) botocore's standard mode is kept.
+    """
+    return Config(max_pool_connections=workers * PART_CONCURRENCY,
+                  retries={'mode': 'standard'} if retries else {'total_max_attempts': 1})
 
 
-def upload_tree(s3_client, local_root, bucket, s3_prefix, config=None, dry_run=False):
+def upload_file(s3_client, filename, bucket, key, config=None, max_attempts=MAX_ATTEMPTS):
+    """Upload one file, retrying throttled or unavailable requests and connection errors (see retryable)
+    with exponential backoff and full jitter."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            s3_client.upload_file(filename, bucket, key, ExtraArgs={"ACL": "private"}, Config=config)
+            logging.info("Uploaded %s -> s3://%s/%s", filename, bucket, key)
+            return True
+        except (ClientError, S3UploadFailedError, BotoCoreError) as e:
+            if retryable(e) and attempt < max_attempts:
+                delay = random.uniform(0, BACKOFF_SECONDS * 2 ** (attempt - 1))
+                logging.warning("Retrying %s after %s, retry %d/%d in %.1fs", filename, error_code(e) or type(e).__name__,
+                                attempt, max_attempts - 1, delay)
+                time.sleep(delay)
+                continue
+            logging.error("Failed to upload %s -> s3://%s/%s : %s", filename, bucket, key, e)
+            return False
+
+
+def upload_tree(s3_client, local_root, bucket, s3_prefix, config=None, dry_run=False, workers=WORKERS, queue_size=None,
+                max_attempts=MAX_ATTEMPTS, files=None):
+    """Upload every file under local_root (or the given (path, key) files) to s3_prefix;
+    returns (path, key, status, bytes) per file.
+
+    `workers` threads share s3_client and take files from a queue of at most
+    `queue_size` entries (default 2 * workers), so walking a large tree never
+    runs far ahead of the uploads.
+    """
     results = []
     if not os.path.isdir(local_root):
         logging.warning("Local folder %s does not exist, skipping", local_root)
         return results
 
-    for path in iter_files(local_root):
-        rel = os.path.relpath(path, local_root)
-        key = s3_prefix.rstrip('/') + '/' + rel.replace(os.sep, '/')
-        if dry_run:
+    def keys():
+        return tree_keys(local_root, s3_prefix) if files is None else iter(files)
+
+    if dry_run:
+        for path, key in keys():
             logging.info("[dry-run] would upload %s -> s3://%s/%s", path, bucket, key)
-            results.append((path, key, 'dry-run'))
-            continue
-        ok = upload_file(s3_client, path, bucket, key, config=config)
-        results.append((path, key, 'ok' if ok else 'failed'))
+            results.append((path, key, 'dry-run', os.path.getsize(path)))
+        return results
+
+    tasks = queue.Queue(maxsize=queue_size or 2 * workers)
+
+    def worker():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            path, key = task
+            try:
+                ok = upload_file(s3_client, path, bucket, key, config=config, max_attempts=max_attempts)
+            except Exception:
+                # Keep the worker alive so the queue keeps draining
+                logging.exception("Failed to upload %s -> s3://%s/%s", path, bucket, key)
+                ok = False
+            results.append((path, key, 'ok' if ok else 'failed', os.path.getsize(path)))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for task in keys():
+        tasks.put(task)
+    for _ in threads:
+        tasks.put(None)
+    for thread in threads:
+        thread.join()
     return results
 
 
-def summarize(results, name):
-    total = len(results)
+def summarize(results, name, elapsed=None):
+    """Log the totals of upload_tree()/sync_tree() results and return them as a dict
+    (with MB/s and objects/s when `elapsed` seconds are given)."""
+    total = sum(1 for r in results if r[0] is not None)  # local files; deletions have no path
     ok = sum(1 for r in results if r[2] in ('ok', 'dry-run'))
     failed = sum(1 for r in results if r[2] == 'failed')
-    logging.info("%s: total=%d ok/dry=%d failed=%d", name, total, ok, failed)
+    megabytes = sum(r[3] for r in results if r[2] in ('ok', 'dry-run')) / 1e6
+    totals = {'total': total, 'ok': ok, 'failed': failed, 'megabytes': megabytes}
+    if elapsed:
+        totals.update(seconds=elapsed, mb_per_second=megabytes / elapsed, objects_per_second=ok / elapsed)
+        logging.info("%s: total=%d ok/dry=%d failed=%d %.1f MB in %.1fs (%.2f MB/s, %.1f objects/s)",
+                     name, total, ok, failed, megabytes, elapsed, totals['mb_per_second'], totals['objects_per_second'])
+    else:
+        logging.info("%s: total=%d ok/dry=%d failed=%d %.1f MB", name, total, ok, failed, megabytes)
+    unchanged = [r for r in results if r[2] == 'unchanged']
+    deleted = sum(1 for r in results if r[2] in ('deleted', 'dry-run-delete'))
+    totals.update(unchanged=len(unchanged), unchanged_megabytes=sum(r[3] for r in unchanged) / 1e6, deleted=deleted)
+    if unchanged or deleted:
+        logging.info("%s: unchanged=%d (%.1f MB not re-sent) orphans deleted%s=%d", name, len(unchanged),
+                     totals['unchanged_megabytes'], ' (dry-run)' if any(r[2] == 'dry-run-delete' for r in results) else '', deleted)
+    return totals
 
 
 def main():
@@ -76,8 +303,18 @@ def main():
     parser.add_argument('--policies-prefix', default='policies', help='S3 prefix for policies files (default: policies)')
     parser.add_argument('--profile', help='AWS profile name to use from credentials file')
     parser.add_argument('--region', help='AWS region (optional)')
-    parser.add_argument('--dry-run', action='store_true', help='Do not actually upload, just show actions')
+    parser.add_argument('--endpoint-url', help='S3-compatible endpoint, e.g. a MinIO or moto server (optional)')
+    parser.add_argument('--workers', type=int, default=WORKERS, help=f'Files uploaded concurrently (default: {WORKERS})')
+    parser.add_argument('--queue-size', type=int, help='Files queued ahead of the workers (default: 2 x workers)')
+    parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                        help=f'Attempts per file when throttled or the connection fails (default: {MAX_ATTEMPTS})')
+    parser.add_argument('--sync', action='store_true', help='Only upload files that are new or differ from the objects under the prefixes')
+    parser.add_argument('--delete', action='store_true', help='With --sync, delete objects under the prefixes that have no local file')
+    parser.add_argument('--manifest', default=MANIFEST, help=f'Local ETag cache used by --sync (default: {MANIFEST})')
+    parser.add_argument('--dry-run', action='store_true', help='Do not actually upload, just show actions (with --sync, the planned delta)')
     args = parser.parse_args()
+    if args.delete and not args.sync:
+        parser.error('--delete requires --sync')
 
     logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 
@@ -86,9 +323,12 @@ def main():
         session_kwargs['profile_name'] = args.profile
 
     session = boto3.session.Session(**session_kwargs)
-    s3_client = session.client('s3', region_name=args.region) if args.region else session.client('s3')
+    # One client shared by all workers, and one with botocore's retries for the --sync listing and deletes
+    s3_client = session.client('s3', region_name=args.region, endpoint_url=args.endpoint_url, config=client_config(args.workers))
+    list_client = session.client('s3', region_name=args.region, endpoint_url=args.endpoint_url,
+                                 config=client_config(1, retries=True))
 
-    transfer_config = TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=4)
+    transfer_config = TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=PART_CONCURRENCY)
 
     repo_root = os.path.abspath(os.path.dirname(__file__))
     data_root = os.path.join(repo_root, 'data')
@@ -98,11 +338,24 @@ def main():
     logging.info("Data folder: %s -> s3://%s/%s/", data_root, args.bucket, args.data_prefix)
     logging.info("Policies folder: %s -> s3://%s/%s/", policies_root, args.bucket, args.policies_prefix)
 
-    data_results = upload_tree(s3_client, data_root, args.bucket, args.data_prefix, config=transfer_config, dry_run=args.dry_run)
-    policies_results = upload_tree(s3_client, policies_root, args.bucket, args.policies_prefix, config=transfer_config, dry_run=args.dry_run)
+    options = dict(config=transfer_config, dry_run=args.dry_run, workers=args.workers, queue_size=args.queue_size,
+                   max_attempts=args.max_attempts)
+    if args.sync:
+        manifest_path = os.path.join(repo_root, args.manifest)
+        manifest = load_manifest(manifest_path)
+        upload = partial(sync_tree, manifest=manifest, delete=args.delete, list_client=list_client)
+    else:
+        upload = upload_tree
+    start = time.perf_counter()
+    data_results = upload(s3_client, data_root, args.bucket, args.data_prefix, **options)
+    data_elapsed = time.perf_counter() - start
+    policies_results = upload(s3_client, policies_root, args.bucket, args.policies_prefix, **options)
+    policies_elapsed = time.perf_counter() - start - data_elapsed
+    if args.sync:
+        save_manifest(manifest_path, manifest)
 
-    summarize(data_results, 'data')
-    summarize(policies_results, 'policies')
+    summarize(data_results, 'data', None if args.dry_run else data_elapsed)
+    summarize(policies_results, 'policies', None if args.dry_run else policies_elapsed)
 
     if any(r[2] == 'failed' for r in (data_results + policies_results)):
         logging.error('One or more uploads failed')